@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+#
+# PyService-Registry - https://github.com/cr0hn/pyservice-registry
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+# following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the
+# following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the
+# following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote
+# products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Measure the time a registry process needs, after a restart, to answer its first lookup.
+
+The same catalog is stored in the pickle FileBackend and in a binary snapshot. The benchmark reports the time to load
+the FileBackend into the catalog index, and the time to map the snapshot and answer a lookup from it.
+
+It also starts the aiohttp server in front of the snapshot, and reports the time to its first HTTP response, and the
+time of a lookup answered while a blocking query is parked, both during the warm-up.
+
+Usage:
+
+	python benchmarks/bench_cold_start.py [-s SERVICES] [-n NODES]
+"""
+
+import os
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import requests
+
+from aiohttp import web
+from blitzdb import FileBackend
+
+from pyservice_registry.cache import ResponseCache
+from pyservice_registry.models import Service
+from pyservice_registry.server import build_aiohttp_app
+from pyservice_registry.catalog import Catalog
+from pyservice_registry.snapshot import Snapshot
+
+
+def open_backend(path):
+	backend = FileBackend(path, {'serializer_class': 'pickle'})
+	backend.create_index(Service, 'name', ephemeral=False, fields=["name"])
+	backend.autocommit = True
+
+	return backend
+
+
+def build(path, services, nodes):
+	"""
+	Store a catalog in a FileBackend, with a single commit.
+	"""
+	backend = open_backend(path)
+	backend.autocommit = False
+
+	for i in range(services):
+		backend.save(Service({
+			"name"       : "service-%d" % i,
+			"description": "benchmark service %d" % i,
+			"nodes"      : {
+				"node-%d-%d" % (i, j): {
+					"address"     : "10.0.%d.%d" % (j // 250, j % 250),
+					"service_port": 8000 + j,
+					"node_id"     : "node-%d-%d" % (i, j)
+				}
+				for j in range(nodes)
+			}
+		}))
+
+	backend.commit()
+
+
+def serve(catalog):
+	"""
+	Serve a catalog with the aiohttp app of the server, in a background thread.
+
+	:return: listen port, once the server accepts connections
+	:rtype: int
+	"""
+	sock = socket.socket()
+	sock.bind(("127.0.0.1", 0))
+	port = sock.getsockname()[1]
+	sock.close()
+
+	started = threading.Event()
+
+	def _run():
+		loop = asyncio.new_event_loop()
+		asyncio.set_event_loop(loop)
+
+		runner = web.AppRunner(build_aiohttp_app(catalog, ResponseCache(catalog)))
+		loop.run_until_complete(runner.setup())
+		loop.run_until_complete(web.TCPSite(runner, "127.0.0.1", port).start())
+
+		started.set()
+		loop.run_forever()
+
+	threading.Thread(target=_run, daemon=True).start()
+	started.wait()
+
+	return port
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Cold start benchmark')
+	parser.add_argument('-s', dest="SERVICES", type=int, help="number of services. Default: 2000", default=2000)
+	parser.add_argument('-n', dest="NODES", type=int, help="nodes per service. Default: 10", default=10)
+
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as path:
+		db_path = os.path.join(path, "service_db")
+		snapshot_path = os.path.join(path, "catalog.snapshot")
+
+		build(db_path, args.SERVICES, args.NODES)
+
+		lookup = "service-%d" % (args.SERVICES // 2)
+
+		# FileBackend: the whole catalog is read and unpickled before the first answer
+		start = time.perf_counter()
+		catalog = Catalog(open_backend(db_path))
+		catalog.service(lookup)
+		file_time = time.perf_counter() - start
+
+		start = time.perf_counter()
+		catalog.save_snapshot(snapshot_path)
+		dump_time = time.perf_counter() - start
+
+		# Snapshot: mapped, and only the pages touched by the lookup are read
+		start = time.perf_counter()
+		snapshot = Snapshot(snapshot_path)
+		snapshot.service(lookup)
+		snapshot_time = time.perf_counter() - start
+
+		# Snapshot in front of the FileBackend, as the server does
+		start = time.perf_counter()
+		warm_catalog = Catalog(open_backend(db_path), Snapshot(snapshot_path))
+		warm_catalog.service(lookup)
+		warm_first = time.perf_counter() - start
+		warm_catalog.wait_ready()
+		warm_loaded = time.perf_counter() - start
+
+		# Snapshot in front of the FileBackend, through the aiohttp server
+		start = time.perf_counter()
+		http_catalog = Catalog(open_backend(db_path), Snapshot(snapshot_path))
+		url = "http://127.0.0.1:%s/api/v1/catalog/service/%s" % (serve(http_catalog), lookup)
+		response = requests.get(url)
+		http_first = time.perf_counter() - start
+
+		# A blocking query parked during the warm-up must not delay the other requests
+		index = response.headers["X-Catalog-Index"]
+		threading.Thread(target=requests.get, args=("%s?index=%s&wait=60s" % (url, index),), daemon=True).start()
+		time.sleep(0.05)
+
+		start = time.perf_counter()
+		requests.get(url)
+		http_parked = time.perf_counter() - start
+		http_warming = not http_catalog.wait_ready(0)
+		http_catalog.wait_ready()
+
+		print("Catalog                        : %d services, %d nodes" % (args.SERVICES, args.SERVICES * args.NODES))
+		print("FileBackend size               : %.1f MB" % (sum(os.path.getsize(os.path.join(d, f))
+		                                                         for d, _, files in os.walk(db_path)
+		                                                         for f in files) / 2 ** 20))
+		print("Snapshot size                  : %.1f MB" % (os.path.getsize(snapshot_path) / 2 ** 20))
+		print("Snapshot write                 : %.3f s" % dump_time)
+		print("First lookup, FileBackend      : %.3f s" % file_time)
+		print("First lookup, snapshot         : %.6f s" % snapshot_time)
+		print("First lookup, snapshot + warmup: %.6f s (catalog loaded in %.3f s)" % (warm_first, warm_loaded))
+		print("First HTTP response, snapshot  : %.6f s" % http_first)
+		print("HTTP lookup, parked query      : %.6f s (%s)" % (http_parked, "during the warm-up" if http_warming else
+		                                                        "catalog already loaded"))
+
+		snapshot.close()
+
+
+if __name__ == '__main__':
+	main()
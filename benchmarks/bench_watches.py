@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+#
+# PyService-Registry - https://github.com/cr0hn/pyservice-registry
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+# following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the
+# following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the
+# following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote
+# products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Measure how many idle blocking queries (watches) one registry process can hold.
+
+Each watcher parks on Catalog.wait_async(), as a blocking query does in the asyncio server. The benchmark reports the
+memory used per watcher and the time needed to wake up all of them with a single catalog change.
+
+Usage:
+
+	python benchmarks/bench_watches.py [-n WATCHERS]
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from blitzdb import FileBackend
+
+from pyservice_registry.models import Service
+from pyservice_registry.catalog import Catalog
+
+
+def build_catalog(path):
+	backend = FileBackend(path, {'serializer_class': 'pickle'})
+	backend.create_index(Service, 'name', ephemeral=False, fields=["name"])
+	backend.autocommit = True
+
+	catalog = Catalog(backend)
+	catalog.register("bench", "benchmark service", {"address": "127.0.0.1",
+	                                                 "service_port": 8080,
+	                                                 "node_id": "node-0"})
+	return catalog
+
+
+async def run(catalog, watchers):
+	index = catalog.service_index("bench")
+
+	tracemalloc.start()
+	before, _ = tracemalloc.get_traced_memory()
+
+	start = time.perf_counter()
+	tasks = [asyncio.ensure_future(catalog.wait_async("bench", index, 600)) for _ in range(watchers)]
+
+	# Let all the watchers park
+	await asyncio.sleep(0)
+	parked = time.perf_counter() - start
+
+	after, _ = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+
+	start = time.perf_counter()
+	catalog.register("bench", "benchmark service", {"address": "127.0.0.1",
+	                                                 "service_port": 8081,
+	                                                 "node_id": "node-0"})
+	await asyncio.gather(*tasks)
+	woken = time.perf_counter() - start
+
+	print("Idle watchers        : %d" % watchers)
+	print("Threads              : 1")
+	print("Memory per watcher   : %.0f bytes" % ((after - before) / watchers))
+	print("Time to park all     : %.3f s" % parked)
+	print("Time to wake up all  : %.3f s" % woken)
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Idle watches benchmark')
+	parser.add_argument('-n', dest="WATCHERS", type=int, help="number of watchers. Default: 50000", default=50000)
+
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as path:
+		catalog = build_catalog(path)
+
+		loop = asyncio.new_event_loop()
+		loop.run_until_complete(run(catalog, args.WATCHERS))
+		loop.close()
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+#
+# PyService-Registry - https://github.com/cr0hn/pyservice-registry
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+# following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the
+# following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the
+# following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote
+# products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Check the native MongoDB backend against an in-process stand-in of MongoDB (mongomock), or a real mongod:
+
+- catalogs stored by blitzdb are imported once, and their removed services don't come back on the next start;
+- collections imported by a previous version, without the import marker, are not imported again;
+- registering a node again updates it, and a node is never stored twice;
+- deregistered and expired nodes are removed from the collection;
+- a batch of writes is sent in a single bulk_write;
+- a new catalog loads the same services from the collection.
+
+It exits with status 1 if any check fails.
+
+Usage:
+
+	python benchmarks/check_mongo_backend.py [--uri mongodb://127.0.0.1:27017]
+"""
+
+import os
+import sys
+import time
+import uuid
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pyservice_registry.catalog import Catalog
+from pyservice_registry.backends.mongo import NativeMongoBackend
+
+
+class CountingCollection(object):
+	"""
+	Collection that counts the bulk_write calls, the round trips of the writes.
+	"""
+
+	def __init__(self, collection):
+		self.collection = collection
+		self.bulk_writes = 0
+
+	def bulk_write(self, *args, **kwargs):
+		self.bulk_writes += 1
+
+		return self.collection.bulk_write(*args, **kwargs)
+
+	def __getattr__(self, name):
+		return getattr(self.collection, name)
+
+
+def node(node_id, port=8080):
+	return {"address": "10.0.0.1", "service_port": port, "node_id": node_id}
+
+
+def stored(collection, name):
+	"""
+	:return: node IDs stored for a service, with repetitions
+	:rtype: list(str)
+	"""
+	document = collection.find_one({"_id": name}) or {}
+
+	return [n["node_id"] for n in document.get("nodes") or []]
+
+
+def check(db):
+	errors = []
+
+	# Catalog stored by blitzdb: a document per node, and a document with the nodes by ID
+	db["services"]["service"].insert_many([
+		{"name": "legacy", "description": "old", "nodes": [node("l1")]},
+		{"name": "legacy", "description": None, "nodes": {"l2": node("l2")}}
+	])
+
+	collection = CountingCollection(db["services"])
+	catalog = Catalog(NativeMongoBackend(collection))
+
+	if sorted(n["service_port"] for n in catalog.service("legacy")["nodes"]) != [8080, 8080]:
+		errors.append("blitzdb catalog not imported: %s" % catalog.service("legacy"))
+
+	# Removed services don't come back from the blitzdb catalog, even if the collection is empty
+	catalog.deregister("legacy", "l1")
+	catalog.deregister("legacy", "l2")
+
+	if collection.find_one({"_id": "legacy"}) is not None:
+		errors.append("service without nodes not removed")
+
+	catalog = Catalog(NativeMongoBackend(collection))
+
+	if catalog.services():
+		errors.append("removed blitzdb services came back on the next start: %s" % catalog.services())
+
+	# Register, register again and update
+	catalog.register("users", "users service", node("u1"))
+	catalog.register("users", "users service", node("u1"))
+	catalog.register("users", "users service", node("u1", 9090))
+
+	if stored(collection, "users") != ["u1"]:
+		errors.append("node stored more than once: %s" % stored(collection, "users"))
+
+	if collection.find_one({"_id": "users"})["nodes"][0]["service_port"] != 9090:
+		errors.append("node not updated")
+
+	# Batch, in a single round trip
+	bulk_writes = collection.bulk_writes
+
+	catalog.batch([dict(op="register", name="orders", description=None, node=node("o%d" % i)) for i in range(100)])
+
+	if collection.bulk_writes - bulk_writes != 1:
+		errors.append("batch sent in %d bulk_write calls" % (collection.bulk_writes - bulk_writes))
+
+	if len(stored(collection, "orders")) != 100:
+		errors.append("batch stored %d nodes" % len(stored(collection, "orders")))
+
+	# Expiration
+	catalog.register("jobs", None, node("j1"), ttl=0.05)
+	time.sleep(0.1)
+	catalog.expire()
+
+	if collection.find_one({"_id": "jobs"}) is not None:
+		errors.append("expired node not removed")
+
+	# Next start
+	reloaded = Catalog(NativeMongoBackend(db["services"]))
+	names = sorted(service["name"] for service in reloaded.services())
+
+	if names != ["orders", "users"]:
+		errors.append("reloaded services: %s" % names)
+
+	if [n["service_port"] for n in reloaded.service("users")["nodes"]] != [9090]:
+		errors.append("reloaded nodes: %s" % reloaded.service("users")["nodes"])
+
+	# Collection imported by a previous version, without the marker
+	db["upgraded"]["service"].insert_one({"name": "legacy", "description": "old", "nodes": [node("l1")]})
+	db["upgraded"].insert_one({"_id": "users", "name": "users", "description": None, "nodes": [node("u1")]})
+
+	names = sorted(service["name"] for service in Catalog(NativeMongoBackend(db["upgraded"])).services())
+
+	if names != ["users"]:
+		errors.append("collection imported by a previous version imported again: %s" % names)
+
+	return errors
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Check the native MongoDB backend")
+	parser.add_argument("--uri", help="mongod URI. Default: in-process mongomock", default=None)
+
+	args = parser.parse_args()
+
+	if args.uri:
+		from pymongo import MongoClient
+
+		client = MongoClient(args.uri)
+	else:
+		import mongomock
+
+		client = mongomock.MongoClient()
+
+	name = "pyregistry_check_%s" % uuid.uuid4().hex[:8]
+
+	try:
+		errors = check(client[name])
+	finally:
+		client.drop_database(name)
+
+	for error in errors:
+		print("ERROR: %s" % error)
+
+	if errors:
+		sys.exit(1)
+
+	print("OK")
+
+
+if __name__ == '__main__':
+	main()
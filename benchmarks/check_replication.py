@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+#
+# PyService-Registry - https://github.com/cr0hn/pyservice-registry
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+# following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the
+# following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the
+# following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote
+# products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Check the leader/follower replication with local processes: a leader server and some followers, each one on its own
+port.
+
+- writes sent to a follower are forwarded to the leader, and the follower reads them back at once;
+- every instance converges to the same catalog, at the same index, and the followers report no lag;
+- when the leader is stopped, the followers keep answering lookups from their replica, and report they are
+  disconnected and lagging.
+
+It exits with status 1 if any check fails.
+
+Usage:
+
+	python benchmarks/check_replication.py [-f FOLLOWERS] [-n NODES] [-p FIRST_PORT]
+"""
+
+import os
+import sys
+import time
+import shlex
+import socket
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import requests
+
+from pyservice_registry.client import AGENT_ENV, RegisterClient
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Max seconds to wait for a process to listen, or for the followers to converge
+TIMEOUT = 15
+
+
+def launch(command, port, *args):
+	"""
+	Start a registry server process, listening on localhost.
+
+	:rtype: `subprocess.Popen`
+	"""
+	env = dict(os.environ)
+	env[AGENT_ENV] = "none"
+	env["PYTHONPATH"] = os.pathsep.join(filter(None, [ROOT, env.get("PYTHONPATH")]))
+
+	return subprocess.Popen(command + ["-l", "127.0.0.1", "-p", str(port)] + list(args), env=env, cwd=ROOT,
+	                        stdout=subprocess.DEVNULL)
+
+
+def stats(port):
+	"""
+	:return: stats of an instance. None if it's not available
+	:rtype: dict|None
+	"""
+	try:
+		response = requests.get("http://127.0.0.1:%s/api/v1/catalog/stats" % port, timeout=5)
+	except requests.RequestException:
+		return None
+
+	return response.json() if response.status_code == 200 else None
+
+
+def wait_for(check, timeout=TIMEOUT):
+	"""
+	:return: seconds until check() was true. None if it never was
+	:rtype: float|None
+	"""
+	start = time.monotonic()
+
+	while time.monotonic() - start < timeout:
+		if check():
+			return time.monotonic() - start
+
+		time.sleep(0.05)
+
+	return None
+
+
+def nodes(client, name):
+	"""
+	:return: ports of the nodes of a service, as seen by an instance. Nodes are returned without their ID
+	:rtype: set(int)
+	"""
+	details = client.service_details(name)
+
+	if isinstance(details, str):
+		return set()
+
+	return {node["service_port"] for service in details for node in service["nodes"]}
+
+
+def check(followers, count, first_port, command):
+	errors = []
+
+	leader_port = first_port
+	follower_ports = [first_port + 1 + i for i in range(followers)]
+	ports = [leader_port] + follower_ports
+
+	path = tempfile.mkdtemp()
+	processes = [launch(command, leader_port, "-e", "aiohttp", "--path", path)]
+
+	try:
+		if wait_for(lambda: stats(leader_port) is not None) is None:
+			return ["leader didn't start"]
+
+		for port in follower_ports:
+			processes.append(launch(command, port, "--follow", "127.0.0.1:%s" % leader_port, "--follow-sync-wait", "5"))
+
+		if wait_for(lambda: all(stats(port) is not None and stats(port)["index"] is not None
+		                        for port in follower_ports)) is None:
+			return ["followers didn't start"]
+
+		clients = {port: RegisterClient("127.0.0.1", port, agent=False) for port in ports}
+
+		# Writes through a follower, that must be read back from it at once
+		writer = clients[follower_ports[0]]
+		node_ports = {"replication-node-%d" % i: 9000 + i for i in range(count)}
+
+		start = time.monotonic()
+
+		for node_id, port in node_ports.items():
+			error = writer.register("replication-check", port, "replication check", node_id=node_id)
+
+			if error is not None:
+				errors.append("register of %s failed: %s" % (node_id, error))
+			elif port not in nodes(writer, "replication-check"):
+				errors.append("%s is not visible in the follower that wrote it" % node_id)
+
+		print("%d writes through a follower, each one read back: %.3f s" % (count, time.monotonic() - start))
+
+		# Removals through another follower
+		removed = sorted(node_ports)[:count // 2]
+		remover = clients[follower_ports[-1]]
+
+		for node_id in removed:
+			error = remover.deregister("replication-check", node_id)
+
+			if error is not None:
+				errors.append("deregister of %s failed: %s" % (node_id, error))
+
+		expected = {port for node_id, port in node_ports.items() if node_id not in removed}
+
+		# All the instances converge to the leader catalog
+		def converged():
+			leader_index = stats(leader_port)["index"]
+
+			return all(stats(port)["index"] == leader_index for port in follower_ports) and \
+			       all(nodes(clients[port], "replication-check") == expected for port in ports)
+
+		seconds = wait_for(converged)
+
+		if seconds is None:
+			errors.append("followers didn't converge to the leader catalog")
+		else:
+			print("Followers converged in %.3f s, at index %s" % (seconds, stats(leader_port)["index"]))
+
+		for port in follower_ports:
+			replication = stats(port)["replication"]
+
+			print("Follower %s: %s" % (port, replication))
+
+			if replication["lag"] != 0 or not replication["connected"]:
+				errors.append("follower %s reports lag %s, connected %s" % (port, replication["lag"],
+				                                                           replication["connected"]))
+
+		# Followers survive the leader
+		processes[0].terminate()
+		processes[0].wait()
+
+		time.sleep(1)
+
+		for port in follower_ports:
+			if nodes(clients[port], "replication-check") != expected:
+				errors.append("follower %s doesn't serve its replica without the leader" % port)
+
+			replication = stats(port)["replication"]
+
+			if replication["connected"] or not replication["lag_seconds"]:
+				errors.append("follower %s doesn't report the leader is gone: %s" % (port, replication))
+
+			if clients[port].register("replication-check", 9999, node_id="replication-orphan") is None:
+				errors.append("follower %s accepted a write without the leader" % port)
+
+		print("Followers without the leader: lookups answered, lag reported")
+	finally:
+		for process in processes:
+			if process.poll() is None:
+				process.terminate()
+				process.wait()
+
+	return errors
+
+
+def main():
+	parser = argparse.ArgumentParser(description="Check the leader/follower replication with local processes")
+	parser.add_argument("-f", "--followers", type=int, default=2, help="follower processes. Default: 2")
+	parser.add_argument("-n", "--nodes", type=int, default=50, help="nodes written through the followers. Default: 50")
+	parser.add_argument("-p", "--port", type=int, default=18000,
+	                    help="leader port. Followers listen on the next ones. Default: 18000")
+	parser.add_argument("--command", default="%s -m pyservice_registry.server" % sys.executable,
+	                    help="command that runs a registry server. Default: %(default)s")
+
+	args = parser.parse_args()
+
+	errors = check(args.followers, args.nodes, args.port, shlex.split(args.command))
+
+	for error in errors:
+		print("ERROR: %s" % error)
+
+	if errors:
+		sys.exit(1)
+
+	print("OK")
+
+
+if __name__ == '__main__':
+	main()
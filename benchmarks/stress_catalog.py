@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+#
+# PyService-Registry - https://github.com/cr0hn/pyservice-registry
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+# following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the
+# following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the
+# following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote
+# products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Stress the catalog with many threads registering, deregistering and looking up nodes at once, like a threaded server
+does, and check it's consistent at the end:
+
+- each lookup sees the last write of its own thread, and never fails;
+- the final catalog has exactly the nodes left by the writes, in memory and in the backend;
+- the catalog index moved once per effective change, so no write was lost.
+
+It exits with status 1 if any check fails.
+
+Usage:
+
+	python benchmarks/stress_catalog.py [-t THREADS] [-n OPERATIONS] [-s SERVICES]
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from blitzdb import FileBackend
+
+from pyservice_registry.models import Service
+from pyservice_registry.catalog import Catalog
+
+# Nodes owned by each thread
+NODES_PER_THREAD = 8
+
+
+def open_backend(path):
+	backend = FileBackend(path, {'serializer_class': 'pickle'})
+	backend.create_index(Service, 'name', ephemeral=False, fields=["name"])
+	backend.autocommit = True
+
+	return backend
+
+
+def worker(catalog, thread_id, operations, services, errors, results):
+	"""
+	Run random operations over the nodes of a thread. Nodes are identified by their address, as nodes are read
+	without their ID.
+
+	:return: (expected nodes of the thread: (service, address) -> port; changes done)
+	"""
+	rnd = random.Random(thread_id)
+
+	nodes = [("service-%d" % rnd.randrange(services), "10.%d.0.%d" % (thread_id, i))
+	         for i in range(NODES_PER_THREAD)]
+
+	expected = {}
+	changes = 0
+
+	try:
+		for _ in range(operations):
+			name, address = rnd.choice(nodes)
+			action = rnd.random()
+
+			if action < 0.4:
+				port = rnd.choice((80, 443))
+
+				catalog.register(name, "service %s" % name, {
+					"node_id"     : address,
+					"address"     : address,
+					"service_port": port
+				})
+
+				if expected.get((name, address)) != port:
+					changes += 1
+				expected[(name, address)] = port
+
+			elif action < 0.6:
+				try:
+					catalog.deregister(name, address)
+				except Service.DoesNotExist:
+					pass
+
+				if expected.pop((name, address), None) is not None:
+					changes += 1
+
+			elif action < 0.9:
+				try:
+					found = {node["address"]: node["service_port"] for node in catalog.service(name)["nodes"]}
+				except Service.DoesNotExist:
+					found = {}
+
+				if found.get(address) != expected.get((name, address)):
+					errors.append("Thread %d read %s for node %s of %s, expected %s" % (
+						thread_id, found.get(address), address, name, expected.get((name, address))))
+			else:
+				catalog.services()
+				catalog.resolve([name for name, _ in nodes])
+	except Exception as e:
+		errors.append("Thread %d failed: %r" % (thread_id, e))
+
+	results[thread_id] = (expected, changes)
+
+
+def catalog_nodes(catalog):
+	"""
+	:return: nodes of a catalog, as (service, address) -> port
+	:rtype: dict
+	"""
+	return {
+		(name, node["address"]): node["service_port"]
+		for name, _, nodes in catalog_items(catalog)
+		for node in nodes
+	}
+
+
+def catalog_items(catalog):
+	for service in catalog.services():
+		details = catalog.service(service["name"])
+
+		yield details["name"], details["description"], details["nodes"]
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Catalog concurrency stress test')
+	parser.add_argument('-t', dest="THREADS", type=int, help="concurrent threads. Default: 32", default=32)
+	parser.add_argument('-n', dest="OPERATIONS", type=int, help="operations per thread. Default: 300", default=300)
+	parser.add_argument('-s', dest="SERVICES", type=int, help="number of services. Default: 10", default=10)
+
+	args = parser.parse_args()
+
+	errors = []
+
+	with tempfile.TemporaryDirectory() as path:
+		catalog = Catalog(open_backend(path))
+
+		events = []
+		catalog.listen(events.append)
+
+		results = {}
+		threads = [threading.Thread(target=worker,
+		                            args=(catalog, i, args.OPERATIONS, args.SERVICES, errors, results))
+		           for i in range(args.THREADS)]
+
+		start = time.perf_counter()
+
+		for t in threads:
+			t.start()
+		for t in threads:
+			t.join()
+
+		elapsed = time.perf_counter() - start
+
+		expected = {}
+		changes = 0
+
+		for thread_expected, thread_changes in results.values():
+			expected.update(thread_expected)
+			changes += thread_changes
+
+		if catalog_nodes(catalog) != expected:
+			errors.append("Catalog nodes don't match the writes")
+
+		if catalog.index != changes or len(events) != changes:
+			errors.append("Catalog index is %d and %d events were sent, for %d changes" % (
+				catalog.index, len(events), changes))
+
+		if any(not nodes for _, _, nodes in catalog_items(catalog)):
+			errors.append("Catalog has services without nodes")
+
+		if catalog_nodes(Catalog(open_backend(path))) != expected:
+			errors.append("Backend nodes don't match the writes")
+
+	total = args.THREADS * args.OPERATIONS
+
+	print("Operations: %d, in %d threads" % (total, args.THREADS))
+	print("Throughput: %.0f operations/s" % (total / elapsed))
+	print("Changes   : %d" % changes)
+	print("Nodes left: %d" % len(expected))
+
+	for error in errors[:20]:
+		print("ERROR: %s" % error)
+
+	if errors:
+		print("FAILED: %d errors" % len(errors))
+		sys.exit(1)
+
+	print("OK")
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,608 @@
+# -*- coding: utf-8 -*-
+#
+# PyService-Registry - https://github.com/cr0hn/pyservice-registry
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+# following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the
+# following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the
+# following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote
+# products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Local agent of a host. The processes of the host talk to it, through a Unix socket or localhost, instead of talking
+to the registry server on their own:
+
+- Registrations, deregistrations and lease renewals are sent to the server in batches, with a single call for all the
+  operations received in a short window. Renewals of the same node in a window are sent once.
+- Service lookups are answered from a local mirror of the catalog, kept up to date with the changes end-point of the
+  server.
+
+It serves the same catalog end-points than the server, so the clients don't need any change. They find the agent by
+themselves: see `pyservice_registry.client.find_agent()`.
+
+The same agent, listening on a public port, is a follower of a leader registry server: `pyregistry-server --follow`.
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+import argparse
+
+import aiohttp
+
+from aiohttp import web
+
+from pyservice_registry.mirror import CatalogMirror
+from pyservice_registry.helpers import parse_duration
+from pyservice_registry.client import DEFAULT_AGENT_SOCKET, RegistryError
+from pyservice_registry.client_aiohttp import AsyncRegisterClient
+from pyservice_registry.routes.catalog import DEFAULT_WAIT, MAX_WAIT, MAX_BATCH, MAX_RESOLVE, parse_batch
+from pyservice_registry.routes.catalog_aiohttp import forward, _json_response
+
+
+logging.basicConfig(level=logging.ERROR, format='[ Service Register agent ] %(asctime)s - %(message)s')
+log = logging.getLogger(__name__)
+
+# Seconds to wait before syncing again, after the server failed
+SYNC_RETRY = 1
+
+# Max seconds a write waits for the mirror to get it, before it's answered
+WRITE_VISIBILITY_WAIT = 1
+
+
+class Agent(object):
+	"""
+	Batches the writes of the local clients, and answers their reads from a mirror of the catalog.
+	"""
+
+	def __init__(self, upstream, flush_interval=0.05, sync_wait=30):
+		"""
+		:param upstream: client of the registry server. It must not use an agent itself
+		:type upstream: `pyservice_registry.client_aiohttp.AsyncRegisterClient`
+
+		:param flush_interval: seconds operations are held, to send them to the server in a single call
+		:type flush_interval: float
+
+		:param sync_wait: seconds each sync waits for catalog changes in the server
+		:type sync_wait: float
+		"""
+		self.upstream = upstream
+		self.flush_interval = flush_interval
+		self.sync_wait = sync_wait
+
+		self.mirror = CatalogMirror()
+
+		# Operations waiting to be sent to the server, as (operation, future) tuples
+		self._pending = []
+
+		# Futures of pending renewals, by (service name, node ID): they are sent once per batch
+		self._renews = {}
+
+		# Counters
+		self.operations = 0
+		self.upstream_calls = 0
+		self.full_copies = 0
+
+		# Replication state: last catalog index known of the server, if the last sync succeeded, and monotonic times of
+		# the last sync, the last time the mirror was up to date, and the first write the mirror doesn't have yet
+		self.upstream_index = None
+		self._connected = False
+		self._last_sync = None
+		self._caught_up_at = None
+		self._behind_since = None
+
+		self._wakeup = None
+		self._synced = None
+		self._tasks = []
+
+		# Writes sent, waiting for the mirror to get them before they are answered
+		self._acks = set()
+
+	async def start(self):
+		self._wakeup = asyncio.Event()
+		self._synced = asyncio.Event()
+
+		self._tasks = [asyncio.ensure_future(self._flush_loop()),
+		               asyncio.ensure_future(self._sync_loop())]
+
+	async def stop(self):
+		for task in self._tasks:
+			task.cancel()
+
+		await asyncio.gather(*self._tasks, return_exceptions=True)
+
+		# Don't leave local clients waiting
+		await self._flush()
+		await asyncio.gather(*self._acks, return_exceptions=True)
+
+		await self.upstream.close()
+
+	# --------------------------------------------------------------------------
+	# Writes
+	# --------------------------------------------------------------------------
+	def submit(self, operation):
+		"""
+		Queue an operation, in batch end-point format, to send it in the next batch.
+
+		:return: future of the (status, message) result
+		:rtype: `asyncio.Future`
+		"""
+		self.operations += 1
+
+		if operation["op"] == "renew":
+			key = (operation["name"], operation["node_id"])
+
+			try:
+				return self._renews[key]
+			except KeyError:
+				pass
+
+		future = asyncio.get_event_loop().create_future()
+
+		if operation["op"] == "renew":
+			self._renews[key] = future
+
+		self._pending.append((operation, future))
+		self._wakeup.set()
+
+		return future
+
+	async def _flush_loop(self):
+		while True:
+			await self._wakeup.wait()
+
+			# Let the next operations arrive, to send them in the same call
+			await asyncio.sleep(self.flush_interval)
+
+			self._wakeup.clear()
+
+			await self._flush()
+
+	async def _flush(self):
+		while self._pending:
+			batch, self._pending = self._pending[:MAX_BATCH], self._pending[MAX_BATCH:]
+
+			# Renewals received from here are sent in the next batch
+			for operation, _ in batch:
+				if operation["op"] == "renew":
+					self._renews.pop((operation["name"], operation["node_id"]), None)
+
+			results, index = await self._send([operation for operation, _ in batch])
+
+			if index is None:
+				self._acknowledge(batch, results)
+			else:
+				# The next batch is sent meanwhile
+				ack = asyncio.ensure_future(self._acknowledge_visible(batch, results, index))
+				ack.add_done_callback(self._acks.discard)
+
+				self._acks.add(ack)
+
+	def _acknowledge(self, batch, results):
+		for (_, future), result in zip(batch, results):
+			if not future.done():
+				future.set_result(result)
+
+	async def _acknowledge_visible(self, batch, results, index):
+		"""
+		Answer the writes once the mirror has them, so a client reads its own writes from this agent.
+		"""
+		if self.upstream_index is None or index > self.upstream_index:
+			self.upstream_index = index
+
+		if self._behind_since is None and self.mirror.index is not None and self.mirror.index < index:
+			self._behind_since = time.monotonic()
+
+		await self._wait_past(index - 1, WRITE_VISIBILITY_WAIT)
+
+		self._acknowledge(batch, results)
+
+	async def _send(self, operations):
+		"""
+		:return: (status, message) of each operation, and the catalog index of the server after them, if known
+		:rtype: tuple(list(tuple(int, str)), int|None)
+		"""
+		self.upstream_calls += 1
+
+		try:
+			status, headers, text = await self.upstream._request("POST",
+			                                                     self.upstream._build_url(self.upstream.route_batch),
+			                                                     data=json.dumps(operations),
+			                                                     headers=self.upstream.json_headers)
+		except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+			log.error("Registry server is not available: %s" % e)
+
+			return [(503, "registry server is not available")] * len(operations), None
+
+		if status != 200:
+			return [(status, text)] * len(operations), None
+
+		try:
+			results = [(result["status"], result["message"]) for result in json.loads(text)["results"]]
+		except (ValueError, KeyError, TypeError) as e:
+			results = None
+
+			log.error("Unexpected response of the registry server: %s" % e)
+
+		# Each operation must get its result, or its client would wait forever
+		if results is None or len(results) != len(operations):
+			return [(502, "unexpected response of the registry server")] * len(operations), None
+
+		try:
+			index = int(headers["X-Catalog-Index"])
+		except (KeyError, ValueError):
+			index = None
+
+		return results, index
+
+	async def _submit_one(self, item):
+		"""
+		Validate an operation, queue it and wait for its result.
+
+		:rtype: `aiohttp.web.Response`
+		"""
+		_, results = parse_batch([item])
+
+		if results[0]:
+			status, message = results[0]
+		else:
+			status, message = await self.submit(item)
+
+		return _json_response({"message": message}, status=status)
+
+	# --------------------------------------------------------------------------
+	# Reads
+	# --------------------------------------------------------------------------
+	async def _sync_loop(self):
+		while True:
+			try:
+				data = await self.upstream.changes(self.mirror.index, self.mirror.epoch, self.sync_wait)
+			except (RegistryError, aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+				log.error("Can't sync the catalog: %s" % e)
+
+				self._connected = False
+
+				await asyncio.sleep(SYNC_RETRY)
+				continue
+
+			index = self.mirror.index
+
+			copied = self.mirror.apply(data)
+
+			if copied:
+				self.full_copies += 1
+
+				log.info("Catalog copied, at index %s" % self.mirror.index)
+
+			# The server index is the mirror one, unless a write answered with a newer one is still on its way. A full
+			# copy may come from a restarted server, with indexes of its own
+			if copied or self.upstream_index is None or self.mirror.index >= self.upstream_index:
+				self.upstream_index = self.mirror.index
+
+			now = time.monotonic()
+
+			self._connected = True
+			self._last_sync = now
+
+			if self.mirror.index >= self.upstream_index:
+				self._caught_up_at = now
+				self._behind_since = None
+
+			if self.mirror.index != index:
+				synced, self._synced = self._synced, asyncio.Event()
+				synced.set()
+
+	def replication(self):
+		"""
+		:return: replication state of the mirror: server, indexes, lag in operations and seconds, and counters
+		:rtype: dict
+		"""
+		now = time.monotonic()
+
+		if self._caught_up_at is None:
+			lag_seconds = None
+		elif not self._connected:
+			lag_seconds = now - self._caught_up_at
+		elif self._behind_since is not None:
+			lag_seconds = now - self._behind_since
+		else:
+			lag_seconds = 0.0
+
+		if self.mirror.index is None or self.upstream_index is None:
+			lag = None
+		else:
+			lag = max(self.upstream_index - self.mirror.index, 0)
+
+		return {
+			"leader"        : self.upstream.base_url,
+			"connected"     : self._connected,
+			"epoch"         : self.mirror.epoch,
+			"index"         : self.mirror.index,
+			"leader_index"  : self.upstream_index,
+			"lag"           : lag,
+			"lag_seconds"   : lag_seconds,
+			"last_sync_ago" : None if self._last_sync is None else now - self._last_sync,
+			"full_copies"   : self.full_copies,
+			"operations"    : self.operations,
+			"upstream_calls": self.upstream_calls
+		}
+
+	async def _wait(self, query):
+		"""
+		Wait for a catalog change, for blocking queries: the mirror index is the server one.
+
+		:return: error response. None if query is right
+		:rtype: `aiohttp.web.Response`|None
+		"""
+		index = query.get("index", None)
+
+		if index is None:
+			return None
+
+		try:
+			index = int(index)
+			wait = min(parse_duration(query.get("wait", str(DEFAULT_WAIT))), MAX_WAIT)
+		except ValueError:
+			return _json_response(dict(message="'index' and 'wait' must be a number and a duration"), status=400)
+
+		await self._wait_past(index, wait)
+
+		return None
+
+	async def _wait_past(self, index, wait):
+		"""
+		Wait up to 'wait' seconds for the mirror index to be greater than an index.
+		"""
+		deadline = time.monotonic() + wait
+
+		while self.mirror.index is not None and self.mirror.index <= index:
+			remaining = deadline - time.monotonic()
+
+			if remaining <= 0:
+				break
+
+			try:
+				await asyncio.wait_for(self._synced.wait(), remaining)
+			except asyncio.TimeoutError:
+				break
+
+	def _not_synced(self):
+		if self.mirror.index is None:
+			return _json_response({"message": "catalog is not synced yet"}, status=503)
+
+		return None
+
+	# --------------------------------------------------------------------------
+	# Entry points
+	# --------------------------------------------------------------------------
+	async def register(self, request):
+		post_data = await request.json()
+
+		return await self._submit_one(dict(post_data, op="register"))
+
+	async def deregister(self, request):
+		post_data = await request.json()
+
+		return await self._submit_one(dict(post_data, op="deregister"))
+
+	async def renew(self, request):
+		response = await self._submit_one(dict(op="renew",
+		                                       name=request.match_info['service'],
+		                                       node_id=request.match_info['node_id']))
+
+		if response.status == 404:
+			response = _json_response({"message": "node not found"}, status=404)
+
+		return response
+
+	async def batch(self, request):
+		post_data = await request.json()
+
+		try:
+			operations, results = parse_batch(post_data)
+		except ValueError as e:
+			return _json_response(dict(message=str(e)), status=400)
+
+		futures = [self.submit(post_data[i]) for i, _ in operations]
+
+		for (i, _), result in zip(operations, await asyncio.gather(*futures)):
+			results[i] = result
+
+		return _json_response({
+			"results": [dict(status=status, message=message) for status, message in results]
+		})
+
+	async def services(self, request):
+		error = self._not_synced() or await self._wait(request.query)
+		if error:
+			return error
+
+		return _json_response(self.mirror.services(), headers={"X-Catalog-Index": str(self.mirror.index)})
+
+	async def service(self, request):
+		error = self._not_synced() or await self._wait(request.query)
+		if error:
+			return error
+
+		service = self.mirror.service(request.match_info['service'])
+		headers = {"X-Catalog-Index": str(self.mirror.index)}
+
+		if service is None:
+			return _json_response({"message": "service name not found"}, status=204, headers=headers)
+
+		return _json_response([service], headers=headers)
+
+	async def resolve(self, request):
+		names = request.query.getall("name", [])
+
+		if not names or len(names) > MAX_RESOLVE:
+			return _json_response(dict(message="Between 1 and %s 'name' are required" % MAX_RESOLVE), status=400)
+
+		error = self._not_synced()
+		if error:
+			return error
+
+		found = []
+		missing = []
+
+		for name in names:
+			service = self.mirror.service(name)
+
+			if service is None:
+				missing.append(name)
+			else:
+				found.append(service)
+
+		return _json_response(dict(services=found, missing=missing),
+		                      headers={"X-Catalog-Index": str(self.mirror.index)})
+
+	async def stats(self, request):
+		"""
+		Get the mirror size and its replication state. Same format than the server one
+		"""
+		return _json_response(dict(index=self.mirror.index,
+		                           services=len(self.mirror),
+		                           commit=None,
+		                           replication=self.replication()))
+
+	async def proxy(self, request):
+		"""
+		Forward a read to the server, streaming its response: the change stream and the changes end-points.
+		"""
+		return await forward(request, self.upstream.session, self.upstream._build_url(request.rel_url.path_qs))
+
+
+def build_agent_app(agent):
+	"""
+	Build the application of the agent, with the same catalog end-points than the server.
+
+	:param agent: the agent
+	:type agent: Agent
+
+	:rtype: `aiohttp.web.Application`
+	"""
+	app = web.Application()
+
+	async def _start(app):
+		await agent.start()
+
+	async def _stop(app):
+		await agent.stop()
+
+	app.on_startup.append(_start)
+	app.on_cleanup.append(_stop)
+
+	app.router.add_route("POST", "/api/v1/catalog/register", agent.register)
+	app.router.add_route("POST", "/api/v1/catalog/deregister", agent.deregister)
+	app.router.add_route("POST", "/api/v1/catalog/batch", agent.batch)
+	app.router.add_route("PUT", "/api/v1/catalog/renew/{service}/{node_id}", agent.renew)
+	app.router.add_route("GET", "/api/v1/catalog/services", agent.services)
+	app.router.add_route("GET", "/api/v1/catalog/service/{service}", agent.service)
+	app.router.add_route("GET", "/api/v1/catalog/resolve", agent.resolve)
+	app.router.add_route("GET", "/api/v1/catalog/changes", agent.proxy)
+	app.router.add_route("GET", "/api/v1/catalog/stats", agent.stats)
+	app.router.add_route("GET", "/api/v1/catalog/stream", agent.proxy)
+
+	return app
+
+
+async def serve(agent, socket_path=None, ip="127.0.0.1", port=None):
+	"""
+	Run the agent, listening on a Unix socket, a TCP port or both, until it's cancelled.
+	"""
+	runner = web.AppRunner(build_agent_app(agent))
+	await runner.setup()
+
+	sites = []
+
+	if socket_path:
+		# Socket of a previous run
+		if os.path.exists(socket_path):
+			os.remove(socket_path)
+
+		sites.append(web.UnixSite(runner, socket_path))
+
+	if port:
+		sites.append(web.TCPSite(runner, ip, port))
+
+	try:
+		for site in sites:
+			await site.start()
+
+		# Any local process can use it
+		if socket_path:
+			os.chmod(socket_path, 0o666)
+
+		await asyncio.Event().wait()
+	finally:
+		await runner.cleanup()
+
+
+def main():
+
+	example = """
+Examples:
+
+	Run the agent of a host:
+	%(name)s -s registry.example.com:8000
+
+	Listen only on localhost, for containers without the Unix socket mounted:
+	%(name)s -s registry.example.com:8000 --socket ""
+
+	""" % dict(name="pyregistry-agent")
+
+	parser = argparse.ArgumentParser(description='Register Service Agent',
+	                                 formatter_class=argparse.RawTextHelpFormatter, epilog=example)
+
+	parser.add_argument('-s', '--server', dest="SERVER", required=True,
+	                    help="registry server address, as host:port")
+	parser.add_argument('--https', dest="HTTPS", action="store_true", help="use HTTPS with the server", default=False)
+	parser.add_argument('--socket', dest="SOCKET",
+	                    help="listen Unix socket. Empty to not use it. Default: %s" % DEFAULT_AGENT_SOCKET,
+	                    default=DEFAULT_AGENT_SOCKET)
+	parser.add_argument('-l', '--listen', dest="IP", help="listen IP. Default 127.0.0.1", default="127.0.0.1")
+	parser.add_argument('-p', '--port', dest="PORT", type=int, help="listen port. 0 to not use it. Default 8001",
+	                    default=8001)
+	parser.add_argument('--flush-interval', dest="FLUSH_INTERVAL", type=float,
+	                    help="seconds operations are held to send them to the server in a single call. Default: 0.05",
+	                    default=0.05)
+	parser.add_argument('--sync-wait', dest="SYNC_WAIT", type=float,
+	                    help="seconds each catalog sync waits for changes in the server. Default: 30", default=30)
+	parser.add_argument("-v", "--verbosity", dest="VERBOSE", action="count", help="verbosity level: -v, -vv, -vvv.",
+	                    default=3)
+
+	args = parser.parse_args()
+
+	log.setLevel(50 - (args.VERBOSE * 10))
+
+	host, _, port = args.SERVER.rpartition(":")
+
+	agent = Agent(AsyncRegisterClient(host, int(port), args.HTTPS, agent=False),
+	              flush_interval=args.FLUSH_INTERVAL,
+	              sync_wait=args.SYNC_WAIT)
+
+	try:
+		asyncio.run(serve(agent, args.SOCKET, args.IP, args.PORT))
+	except KeyboardInterrupt:
+		pass
+
+
+if __name__ == '__main__':
+	main()
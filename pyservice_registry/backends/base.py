@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+#
+# PyService-Registry - https://github.com/cr0hn/pyservice-registry
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+# following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the
+# following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the
+# following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote
+# products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+from pyservice_registry.models import Service
+
+
+class CatalogBackend(object):
+	"""
+	Base of the storage engines that are not blitzdb backends.
+
+	They implement the subset of the blitzdb backend interface used by the catalog: filter(), save(), delete(),
+	commit(), rollback() and the 'autocommit' flag. They can also write a single node, with save_node() and
+	delete_node(), instead of the whole service document.
+	"""
+
+	def __init__(self):
+		# Commit each write. The catalog disables it to group many writes in a single commit
+		self.autocommit = True
+
+	@staticmethod
+	def _document(name, description, nodes):
+		"""
+		Build the service document returned by filter()
+		"""
+		return Service({
+			"pk"         : name,
+			"name"       : name,
+			"description": description,
+			"nodes"      : nodes
+		})
+
+	def filter(self, cls, query):
+		"""
+		:return: all the stored services. Only empty queries are supported
+		:rtype: list(Service)
+		"""
+		raise NotImplementedError()
+
+	def save(self, service):
+		"""
+		Write the whole service document
+		"""
+		raise NotImplementedError()
+
+	def delete(self, service):
+		"""
+		Remove a service and all its nodes
+		"""
+		raise NotImplementedError()
+
+	def save_node(self, service, node):
+		"""
+		Write a new or changed node of a service, and the service description
+		"""
+		self.save(service)
+
+	def delete_node(self, service, node_id):
+		"""
+		Remove a node of a service
+		"""
+		self.save(service)
+
+	def commit(self):
+		"""
+		Make durable the writes done since the last commit
+		"""
+		pass
+
+	def rollback(self):
+		"""
+		Discard the writes done since the last commit, after one of them failed
+		"""
+		pass
+
+	def sync(self):
+		"""
+		Wait until the writes committed by the current thread are durable. Engines that share a sync between many
+		commits, like the write-ahead log, make their autocommit writes wait here: the catalog calls it once it has
+		released its write lock, so concurrent writes share the same sync.
+		"""
+		pass
+
+	def close(self):
+		pass
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+#
+# PyService-Registry - https://github.com/cr0hn/pyservice-registry
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+# following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the
+# following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the
+# following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote
+# products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+blitzdb file backend, with durable writes: it keeps track of the files written by its commits, and sync() fsyncs
+them, and their directories. blitzdb itself never fsyncs, so its commits can be lost by a crash.
+"""
+
+import os
+import threading
+
+from blitzdb import FileBackend as BlitzFileBackend
+from blitzdb.backends.file.store import Store, TransactionalStore
+
+
+class _TrackedWrites(Store):
+	"""
+	Store that reports each file it writes or removes. Subclasses set the 'wrote' callback.
+	"""
+
+	def store_blob(self, blob, key, *args, **kwargs):
+		ret = super(_TrackedWrites, self).store_blob(blob, key, *args, **kwargs)
+
+		self.wrote(self._get_path_for_key(key))
+
+		return ret
+
+	def delete_blob(self, key, *args, **kwargs):
+		super(_TrackedWrites, self).delete_blob(key, *args, **kwargs)
+
+		self.wrote(self._get_path_for_key(key))
+
+
+class _TrackedStore(_TrackedWrites):
+
+	def __init__(self, properties, wrote):
+		self.wrote = wrote
+
+		super(_TrackedStore, self).__init__(properties)
+
+
+class _TrackedTransactionalStore(TransactionalStore, _TrackedWrites):
+
+	def __init__(self, properties, wrote):
+		self.wrote = wrote
+
+		super(_TrackedTransactionalStore, self).__init__(properties)
+
+
+_TRACKED_STORES = {
+	Store             : _TrackedStore,
+	TransactionalStore: _TrackedTransactionalStore,
+}
+
+
+class FileBackend(BlitzFileBackend):
+	"""
+	blitzdb FileBackend whose writes are made durable by sync(). The catalog calls it after each write, and once per
+	batch.
+	"""
+
+	def __init__(self, *args, **kwargs):
+		# Files written, or removed, since the last sync
+		self._written = set()
+		self._written_lock = threading.Lock()
+
+		# Syncs are serialized: a sync returns once the files written before it are on disk, even if another sync took
+		# them
+		self._sync_lock = threading.Lock()
+
+		super(FileBackend, self).__init__(*args, **kwargs)
+
+	def _tracked(self, store_class):
+		tracked_class = _TRACKED_STORES.get(store_class)
+
+		if tracked_class is None:
+			return store_class
+
+		return lambda properties: tracked_class(properties, self._wrote)
+
+	@property
+	def StoreClass(self):
+		return self._tracked(super(FileBackend, self).StoreClass)
+
+	@property
+	def IndexStoreClass(self):
+		return self._tracked(super(FileBackend, self).IndexStoreClass)
+
+	def _wrote(self, path):
+		with self._written_lock:
+			self._written.add(path)
+
+	def sync(self):
+		"""
+		fsync the files written or removed since the last sync, and their directories.
+		"""
+		with self._sync_lock:
+			with self._written_lock:
+				paths, self._written = self._written, set()
+
+			directories = set()
+
+			for path in paths:
+				directories.add(os.path.dirname(path))
+
+				# Removed files only need their directory
+				if os.path.exists(path):
+					_fsync(path)
+
+			for directory in directories:
+				_fsync(directory)
+
+
+def _fsync(path):
+	"""
+	fsync a file or a directory. Directories can't be fsynced on every platform.
+	"""
+	try:
+		fd = os.open(path, os.O_RDONLY)
+	except OSError:
+		return
+
+	try:
+		os.fsync(fd)
+	except OSError:
+		pass
+	finally:
+		os.close(fd)
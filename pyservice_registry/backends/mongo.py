@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+#
+# PyService-Registry - https://github.com/cr0hn/pyservice-registry
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+# following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the
+# following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the
+# following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote
+# products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+from pymongo import ASCENDING, DeleteOne, ReplaceOne, UpdateOne
+
+from pyservice_registry.models import Service
+from pyservice_registry.backends.base import CatalogBackend
+
+# Collection where blitzdb MongoBackend stores the services, relative to the configured one
+_BLITZDB_COLLECTION = "service"
+
+# _id of the document that records the blitzdb catalog was already imported. It's not a service
+_IMPORT_MARKER = "_pyregistry_blitzdb_import"
+
+
+class NativeMongoBackend(CatalogBackend):
+	"""
+	MongoDB storage engine that writes nodes with update operators, instead of reading and saving the whole service
+	document as blitzdb does.
+
+	There's one document per service, with _id = service name and its nodes in an array:
+
+	- Registering a node is one round trip: a $pull of the old node, if any, and an upserting $addToSet of the new
+	  one, sent in the same bulk_write. There's no read-modify-write race.
+	- Removing a node is a single $pull.
+	- Writes done with autocommit disabled are queued and sent in a single bulk_write by commit().
+
+	A node is never stored twice in a service, because each register removes it before adding it again. The unique
+	index on (name, nodes.node_id) can't guarantee that by itself: a unique multikey index doesn't check the entries
+	of a single document array.
+	"""
+
+	def __init__(self, collection):
+		"""
+		:param collection: collection where services are stored
+		:type collection: `pymongo.collection.Collection`
+		"""
+		super(NativeMongoBackend, self).__init__()
+
+		self.collection = collection
+
+		# Write operations of the running transaction
+		self._pending = []
+
+		collection.create_index([("name", ASCENDING), ("nodes.node_id", ASCENDING)], unique=True)
+
+	def filter(self, cls, query):
+		"""
+		Load all the services. Catalogs stored by blitzdb MongoBackend are imported the first time.
+		"""
+		if self.collection.count_documents({"_id": _IMPORT_MARKER}, limit=1) == 0:
+			self._import_blitzdb()
+
+		return [
+			self._document(document["_id"],
+			               document.get("description"),
+			               {node.get("node_id"): node for node in document.get("nodes") or []})
+			for document in self.collection.find({"_id": {"$ne": _IMPORT_MARKER}}, {"description": 1, "nodes": 1})
+		]
+
+	def _import_blitzdb(self):
+		"""
+		Import the services stored by blitzdb MongoBackend, in any of their formats, and record it's done, so they are
+		never imported again, even once all their nodes are removed. Old documents are kept.
+
+		Collections with services, but without the marker, were imported by a previous version: they are only marked.
+		"""
+		marker = ReplaceOne({"_id": _IMPORT_MARKER}, {"_id": _IMPORT_MARKER}, upsert=True)
+
+		if self.collection.count_documents({"_id": {"$ne": _IMPORT_MARKER}}, limit=1):
+			self.collection.bulk_write([marker])
+			return
+
+		services = {}
+
+		for document in self.collection.database[self.collection.name][_BLITZDB_COLLECTION].find({}):
+			name = document.get("name")
+
+			service = services.get(name)
+			if service is None:
+				service = services[name] = Service({"name": name, "description": None, "nodes": {}})
+
+			service.merge(Service(document))
+
+		# Marker goes last: an interrupted import is done again
+		self.collection.bulk_write([ReplaceOne({"_id": name}, self._service_document(service), upsert=True)
+		                            for name, service in services.items()] + [marker], ordered=True)
+
+	@staticmethod
+	def _service_document(service):
+		return {
+			"_id"        : service.name,
+			"name"       : service.name,
+			"description": service.get("description"),
+			"nodes"      : list(service.get("nodes", {}).values())
+		}
+
+	def save(self, service):
+		self._write(ReplaceOne({"_id": service.name}, self._service_document(service), upsert=True))
+
+	def delete(self, service):
+		self._write(DeleteOne({"_id": service.name}))
+
+	def save_node(self, service, node):
+		name = service.name
+
+		self._write(UpdateOne({"_id": name}, {"$pull": {"nodes": {"node_id": node.get("node_id")}}}),
+		            UpdateOne({"_id": name},
+		                      {
+			                      "$set"     : {"name": name, "description": service.get("description")},
+			                      "$addToSet": {"nodes": node}
+		                      },
+		                      upsert=True))
+
+	def delete_node(self, service, node_id):
+		self._write(UpdateOne({"_id": service.name}, {"$pull": {"nodes": {"node_id": node_id}}}))
+
+	def _write(self, *operations):
+		self._pending.extend(operations)
+
+		if self.autocommit:
+			self.commit()
+
+	def rollback(self):
+		self._pending = []
+
+	def commit(self):
+		if not self._pending:
+			return
+
+		operations = self._pending
+		self._pending = []
+
+		self.collection.bulk_write(operations, ordered=True)
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+#
+# PyService-Registry - https://github.com/cr0hn/pyservice-registry
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+# following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the
+# following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the
+# following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote
+# products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import os
+import sqlite3
+import threading
+
+from pyservice_registry.backends.base import CatalogBackend
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS services (
+	name            TEXT PRIMARY KEY,
+	description     TEXT
+);
+
+CREATE TABLE IF NOT EXISTS nodes (
+	name            TEXT NOT NULL REFERENCES services (name) ON DELETE CASCADE,
+	node_id         TEXT NOT NULL,
+	address         TEXT,
+	service_port,
+	ttl             REAL,
+	weight          REAL,
+	PRIMARY KEY (name, node_id)
+);
+"""
+
+_UPSERT_SERVICE = "INSERT INTO services (name, description) VALUES (?, ?) " \
+                  "ON CONFLICT (name) DO UPDATE SET description = excluded.description"
+_DELETE_SERVICE = "DELETE FROM services WHERE name = ?"
+
+_UPSERT_NODE = "INSERT OR REPLACE INTO nodes (name, node_id, address, service_port, ttl, weight) " \
+               "VALUES (?, ?, ?, ?, ?, ?)"
+_DELETE_NODE = "DELETE FROM nodes WHERE name = ? AND node_id = ?"
+_DELETE_NODES = "DELETE FROM nodes WHERE name = ?"
+
+_SELECT_SERVICES = "SELECT name, description FROM services"
+_SELECT_NODES = "SELECT name, node_id, address, service_port, ttl, weight FROM nodes"
+
+# Optional node fields, stored in their own column
+_OPTIONAL_FIELDS = ("ttl", "weight")
+
+
+class SQLiteBackend(CatalogBackend):
+	"""
+	Embedded SQL storage engine, in a single SQLite database file.
+
+	- Services and nodes are stored in normalized tables, with primary keys on the service name and on (name,
+	  node_id), so each write only touches the rows of a node.
+	- The database runs in WAL mode: readers, like backup or inspection tools, don't block the writer.
+	- Statements are constant and cached, prepared, by the connection.
+	- Writes done with autocommit disabled are grouped in a single transaction, committed by commit(). It also
+	  fsyncs the write-ahead log of the database, so the transaction is durable even in NORMAL synchronous mode.
+	- Autocommit writes are made durable by sync(), that fsyncs the write-ahead log once for all the writes done
+	  before it.
+	"""
+
+	def __init__(self, path, synchronous="NORMAL"):
+		"""
+		:param path: database file path
+		:type path: str
+
+		:param synchronous: SQLite synchronous mode. With NORMAL, in WAL mode, commits are not fsynced one by one
+		                    but the database is never corrupted
+		:type synchronous: str
+		"""
+		super(SQLiteBackend, self).__init__()
+
+		self.path = path
+
+		# The connection is shared by the web server threads. Writes are serialized by the lock
+		self._lock = threading.Lock()
+		self._conn = sqlite3.connect(path, check_same_thread=False, cached_statements=32)
+
+		# Autocommit writes not fsynced yet. Syncs are serialized, but don't block the writes
+		self._unsynced = False
+		self._sync_lock = threading.Lock()
+
+		with self._lock:
+			self._conn.execute("PRAGMA journal_mode = WAL")
+			self._conn.execute("PRAGMA synchronous = %s" % synchronous)
+			self._conn.execute("PRAGMA foreign_keys = ON")
+			self._conn.executescript(_SCHEMA)
+			self._conn.commit()
+
+	@staticmethod
+	def _node_row(name, node):
+		return (name,
+		        node.get("node_id"),
+		        node.get("address"),
+		        node.get("service_port"),
+		        node.get("ttl"),
+		        node.get("weight"))
+
+	def filter(self, cls, query):
+		with self._lock:
+			services = {
+				name: self._document(name, description, {})
+				for name, description in self._conn.execute(_SELECT_SERVICES)
+			}
+
+			for name, node_id, address, service_port, ttl, weight in self._conn.execute(_SELECT_NODES):
+				node = {
+					"address"     : address,
+					"service_port": service_port,
+					"node_id"     : node_id
+				}
+
+				for field, value in zip(_OPTIONAL_FIELDS, (ttl, weight)):
+					if value is not None:
+						node[field] = value
+
+				services[name].nodes[node_id] = node
+
+		return list(services.values())
+
+	def save(self, service):
+		with self._lock:
+			self._conn.execute(_UPSERT_SERVICE, (service.name, service.get("description")))
+			self._conn.execute(_DELETE_NODES, (service.name,))
+			self._conn.executemany(_UPSERT_NODE, [self._node_row(service.name, node)
+			                                      for node in service.get("nodes", {}).values()])
+			self._autocommit()
+
+	def delete(self, service):
+		with self._lock:
+			self._conn.execute(_DELETE_SERVICE, (service.name,))
+			self._autocommit()
+
+	def save_node(self, service, node):
+		with self._lock:
+			self._conn.execute(_UPSERT_SERVICE, (service.name, service.get("description")))
+			self._conn.execute(_UPSERT_NODE, self._node_row(service.name, node))
+			self._autocommit()
+
+	def delete_node(self, service, node_id):
+		with self._lock:
+			self._conn.execute(_DELETE_NODE, (service.name, node_id))
+			self._autocommit()
+
+	def _autocommit(self):
+		if self.autocommit:
+			self._conn.commit()
+			self._unsynced = True
+
+	def commit(self):
+		with self._lock:
+			self._conn.commit()
+			self._fsync_wal()
+			self._unsynced = False
+
+	def sync(self):
+		with self._sync_lock:
+			with self._lock:
+				unsynced, self._unsynced = self._unsynced, False
+
+			if unsynced:
+				self._fsync_wal()
+
+	def _fsync_wal(self):
+		try:
+			fd = os.open(self.path + "-wal", os.O_RDONLY)
+		except FileNotFoundError:
+			return
+
+		try:
+			os.fsync(fd)
+		finally:
+			os.close(fd)
+
+	def rollback(self):
+		with self._lock:
+			self._conn.rollback()
+
+	def close(self):
+		with self._lock:
+			self._conn.commit()
+			self._conn.close()
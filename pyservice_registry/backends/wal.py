@@ -0,0 +1,439 @@
+# -*- coding: utf-8 -*-
+#
+# PyService-Registry - https://github.com/cr0hn/pyservice-registry
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+# following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the
+# following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the
+# following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote
+# products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import os
+import json
+import zlib
+import time
+import struct
+import logging
+import threading
+
+from pyservice_registry.backends.base import CatalogBackend
+
+log = logging.getLogger(__name__)
+
+# Record header: payload length and CRC32
+_HEADER = struct.Struct("<II")
+
+_SNAPSHOT_FILE = "snapshot.json"
+_LOG_PREFIX = "wal-"
+_LOG_SUFFIX = ".log"
+
+
+def _log_name(lsn):
+	"""
+	Name of the log segment that starts at a log sequence number. Names sort in the same order as the segments.
+	"""
+	return "%s%016d%s" % (_LOG_PREFIX, lsn, _LOG_SUFFIX)
+
+
+def _encode(record):
+	payload = json.dumps(record, separators=(",", ":")).encode()
+
+	return _HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def _read_records(path):
+	"""
+	Read the records of a log segment, stopping at the first torn or corrupted one.
+
+	:return: tuple as (records, size of the valid part of the file)
+	:rtype: tuple(list, int)
+	"""
+	with open(path, "rb") as f:
+		data = f.read()
+
+	records = []
+	offset = 0
+
+	while offset + _HEADER.size <= len(data):
+		length, crc = _HEADER.unpack_from(data, offset)
+
+		payload = data[offset + _HEADER.size:offset + _HEADER.size + length]
+
+		if len(payload) != length or zlib.crc32(payload) != crc:
+			break
+
+		try:
+			records.append(json.loads(payload.decode()))
+		except ValueError:
+			break
+
+		offset += _HEADER.size + length
+
+	return records, offset
+
+
+class WALBackend(CatalogBackend):
+	"""
+	Append-only storage engine: each mutation is a record appended to a write-ahead log, so a write costs a
+	sequential append instead of rewriting store and index files.
+
+	- Records carry a CRC. A record torn by a crash is detected and cut on recovery: the catalog is never corrupted.
+	- Commits are flushed to the OS at once. With a fsync interval, a background thread fsyncs once per interval, so
+	  many commits share the same fsync (group fsync): commit() returns after the next fsync, and autocommit writes
+	  wait for it in sync(). Without it, each commit is fsynced before it returns.
+	- Each 'snapshot_every' records, the compacted state is written to a snapshot, in a background thread, and a new
+	  log segment is started. Older segments are removed, so recovery only loads the snapshot and replays the log
+	  tail written after it.
+
+	Directory layout:
+
+		snapshot.json                 compacted state, with the last log sequence number (LSN) it includes
+		wal-<first LSN>.log           log segments
+	"""
+
+	def __init__(self, path, fsync_interval=0.01, snapshot_every=10000):
+		"""
+		:param path: directory of the log and the snapshots
+		:type path: str
+
+		:param fsync_interval: max seconds between fsyncs of the log. 0 to fsync each commit
+		:type fsync_interval: int|float
+
+		:param snapshot_every: log records written between snapshots
+		:type snapshot_every: int
+		"""
+		super(WALBackend, self).__init__()
+
+		self.path = path
+		self.fsync_interval = fsync_interval
+		self.snapshot_every = snapshot_every
+
+		self._lock = threading.Lock()
+
+		# name -> {"description": str, "nodes": {node_id: node}}
+		self._services = {}
+
+		# Records of the running transaction, as (record, encoded record) tuples. They are applied to the state once
+		# they are in the log
+		self._pending = []
+
+		# Last log sequence number and records written since the last snapshot
+		self._lsn = 0
+		self._records = 0
+
+		# Last LSN appended to the log, and last one made durable by a fsync. Writers wait for the next fsync with the
+		# condition
+		self._committed_lsn = 0
+		self._synced_lsn = 0
+		self._synced = threading.Condition(self._lock)
+
+		# Last LSN committed by each thread
+		self._local = threading.local()
+
+		self._snapshot_thread = None
+		self._closed = False
+
+		os.makedirs(path, exist_ok=True)
+
+		self._recover()
+
+		# Recovered records are on disk
+		self._committed_lsn = self._synced_lsn = self._lsn
+
+		if fsync_interval:
+			threading.Thread(target=self._sync_loop, name="wal-fsync", daemon=True).start()
+
+	# --------------------------------------------------------------------------
+	# Recovery
+	# --------------------------------------------------------------------------
+	def _segments(self):
+		"""
+		:return: log segments, as (first LSN, file name) tuples, sorted
+		:rtype: list(tuple)
+		"""
+		segments = []
+
+		for name in os.listdir(self.path):
+			if name.startswith(_LOG_PREFIX) and name.endswith(_LOG_SUFFIX):
+				try:
+					segments.append((int(name[len(_LOG_PREFIX):-len(_LOG_SUFFIX)]), name))
+				except ValueError:
+					pass
+
+		return sorted(segments)
+
+	def _recover(self):
+		"""
+		Load the last snapshot and replay the log records written after it.
+		"""
+		snapshot_lsn = 0
+
+		try:
+			with open(os.path.join(self.path, _SNAPSHOT_FILE), "r") as f:
+				snapshot = json.load(f)
+		except FileNotFoundError:
+			pass
+		else:
+			snapshot_lsn = snapshot["lsn"]
+			self._services = snapshot["services"]
+
+		self._lsn = snapshot_lsn
+
+		segments = self._segments()
+
+		for i, (_, name) in enumerate(segments):
+			path = os.path.join(self.path, name)
+
+			records, size = _read_records(path)
+
+			for record in records:
+				if record[0] > self._lsn:
+					self._apply(record)
+					self._lsn = record[0]
+					self._records += 1
+
+			if size != os.path.getsize(path):
+				# Torn or corrupted record: cut the log there. Next segments can't be applied over the gap
+				log.error("Write-ahead log '%s' is corrupted at offset %s. Discarding the records after it" % (path,
+				                                                                                             size))
+				with open(path, "r+b") as f:
+					f.truncate(size)
+
+				for _, next_name in segments[i + 1:]:
+					os.remove(os.path.join(self.path, next_name))
+
+				segments = segments[:i + 1]
+				break
+
+		if segments:
+			self._file = open(os.path.join(self.path, segments[-1][1]), "ab")
+		else:
+			self._file = open(os.path.join(self.path, _log_name(self._lsn + 1)), "ab")
+
+	def _apply(self, record):
+		"""
+		Apply a log record to the state: [lsn, operation, service name, operation arguments...]
+		"""
+		op, name = record[1], record[2]
+
+		if op == "node":
+			service = self._services.setdefault(name, {"description": None, "nodes": {}})
+			service["description"] = record[3]
+			service["nodes"][record[4].get("node_id")] = record[4]
+
+		elif op == "drop_node":
+			service = self._services.get(name)
+
+			if service is not None:
+				service["nodes"].pop(record[3], None)
+
+		elif op == "save":
+			self._services[name] = {"description": record[3], "nodes": dict(record[4])}
+
+		elif op == "delete":
+			self._services.pop(name, None)
+
+	# --------------------------------------------------------------------------
+	# Backend interface
+	# --------------------------------------------------------------------------
+	def filter(self, cls, query):
+		with self._lock:
+			return [
+				self._document(name, service["description"], dict(service["nodes"]))
+				for name, service in self._services.items()
+			]
+
+	def save(self, service):
+		self._write(["save", service.name, service.get("description"), service.get("nodes", {})])
+
+	def delete(self, service):
+		self._write(["delete", service.name])
+
+	def save_node(self, service, node):
+		self._write(["node", service.name, service.get("description"), node])
+
+	def delete_node(self, service, node_id):
+		self._write(["drop_node", service.name, node_id])
+
+	def commit(self):
+		with self._lock:
+			self._commit()
+
+		self.sync()
+
+	def sync(self):
+		"""
+		Wait until the records committed by the current thread are on disk: for the next shared fsync, with a fsync
+		interval.
+		"""
+		lsn = getattr(self._local, "lsn", 0)
+
+		with self._lock:
+			while self._synced_lsn < lsn and not self._closed:
+				self._synced.wait()
+
+	def _write(self, record):
+		with self._lock:
+			self._lsn += 1
+
+			record = [self._lsn] + record
+
+			self._pending.append((record, _encode(record)))
+
+			if self.autocommit:
+				self._commit()
+
+	def rollback(self):
+		# Their LSNs are not reused: the log can have gaps
+		with self._lock:
+			self._pending = []
+
+	def _commit(self):
+		"""
+		Append the records of the running transaction to the log. Must be called holding the lock.
+		"""
+		if not self._pending:
+			return
+
+		self._file.write(b"".join(encoded for _, encoded in self._pending))
+		self._file.flush()
+
+		for record, _ in self._pending:
+			self._apply(record)
+
+		self._records += len(self._pending)
+		self._pending = []
+
+		self._committed_lsn = self._local.lsn = self._lsn
+
+		if not self.fsync_interval:
+			os.fsync(self._file.fileno())
+			self._set_synced(self._committed_lsn)
+
+		if self._records >= self.snapshot_every and self._snapshot_thread is None:
+			self._snapshot_thread = threading.Thread(target=self.snapshot, name="wal-snapshot", daemon=True)
+			self._snapshot_thread.start()
+
+	def _sync_loop(self):
+		while not self._closed:
+			time.sleep(self.fsync_interval)
+
+			with self._lock:
+				if self._synced_lsn >= self._committed_lsn or self._closed:
+					continue
+
+				# Commits go on while the log is fsynced: the file could even be closed by a snapshot meanwhile
+				lsn = self._committed_lsn
+				fd = os.dup(self._file.fileno())
+
+			try:
+				os.fsync(fd)
+			finally:
+				os.close(fd)
+
+			with self._lock:
+				self._set_synced(lsn)
+
+	def _set_synced(self, lsn):
+		"""
+		Record the records up to a LSN are on disk, and wake up their writers. Must be called holding the lock.
+		"""
+		if lsn > self._synced_lsn:
+			self._synced_lsn = lsn
+
+		self._synced.notify_all()
+
+	# --------------------------------------------------------------------------
+	# Snapshots
+	# --------------------------------------------------------------------------
+	def snapshot(self):
+		"""
+		Write the compacted state to a snapshot, start a new log segment and remove the segments included in the
+		snapshot. Writes are only blocked while the state is copied, not while the snapshot is written.
+
+		Only committed records are included: the ones of a running transaction are left to it, and go to the new
+		segment if it's committed.
+		"""
+		try:
+			with self._lock:
+				lsn = self._committed_lsn
+				services = {
+					name: {"description": service["description"], "nodes": dict(service["nodes"])}
+					for name, service in self._services.items()
+				}
+
+				# Next records go to a new segment
+				os.fsync(self._file.fileno())
+				self._file.close()
+				self._file = open(os.path.join(self.path, _log_name(lsn + 1)), "ab")
+
+				self._records = 0
+				self._set_synced(lsn)
+
+			snapshot_path = os.path.join(self.path, _SNAPSHOT_FILE)
+			tmp_path = snapshot_path + ".tmp"
+
+			with open(tmp_path, "w") as f:
+				json.dump(dict(lsn=lsn, services=services), f, separators=(",", ":"))
+				f.flush()
+				os.fsync(f.fileno())
+
+			os.replace(tmp_path, snapshot_path)
+			self._sync_dir()
+
+			# Remove the segments fully included in the snapshot
+			for first_lsn, name in self._segments():
+				if first_lsn <= lsn:
+					os.remove(os.path.join(self.path, name))
+
+		except Exception as e:
+			log.error("Error writing catalog snapshot: %s" % e)
+		finally:
+			self._snapshot_thread = None
+
+	def _sync_dir(self):
+		"""
+		Make durable the renames done in the directory. Not supported on every platform.
+		"""
+		try:
+			fd = os.open(self.path, os.O_RDONLY)
+		except OSError:
+			return
+
+		try:
+			os.fsync(fd)
+		except OSError:
+			pass
+		finally:
+			os.close(fd)
+
+	def close(self):
+		with self._lock:
+			# A running transaction is not committed by closing the log
+			if self._pending:
+				log.warning("Closing the write-ahead log with %s records not committed: they are discarded" %
+				            len(self._pending))
+
+				self._pending = []
+
+			if not self._closed:
+				os.fsync(self._file.fileno())
+				self._file.close()
+				self._closed = True
+
+				self._set_synced(self._committed_lsn)
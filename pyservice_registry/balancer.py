@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+#
+# PyService-Registry - https://github.com/cr0hn/pyservice-registry
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+# following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the
+# following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the
+# following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote
+# products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import time
+import random
+import itertools
+import threading
+
+from contextlib import contextmanager
+
+
+class Endpoint(object):
+	"""
+	A node of a service, with the feedback of the calls made to it.
+	"""
+
+	__slots__ = ("address", "port", "weight", "inflight", "ewma", "successes", "failures")
+
+	def __init__(self, address, port, weight=1):
+		self.address = address
+		self.port = port
+		self.weight = weight
+
+		# Calls in progress
+		self.inflight = 0
+
+		# Exponentially weighted moving average of latency, in seconds. None until the first call ends
+		self.ewma = None
+
+		self.successes = 0
+		self.failures = 0
+
+	@property
+	def key(self):
+		return self.address, self.port
+
+	def __repr__(self):
+		return "Endpoint(%s:%s)" % (self.address, self.port)
+
+
+# --------------------------------------------------------------------------
+# Strategies
+# --------------------------------------------------------------------------
+class Strategy(object):
+	"""
+	Node selection strategy. update() is called only when the node list changes, so it's the place to precompute
+	the selection structures. pick() must be O(1).
+	"""
+
+	def __init__(self):
+		self.endpoints = []
+
+	def update(self, endpoints):
+		self.endpoints = endpoints
+
+	def pick(self):
+		raise NotImplementedError()
+
+
+class RoundRobin(Strategy):
+
+	def __init__(self):
+		super(RoundRobin, self).__init__()
+
+		self._counter = itertools.count()
+
+	def pick(self):
+		endpoints = self.endpoints
+
+		return endpoints[next(self._counter) % len(endpoints)]
+
+
+class WeightedRandom(Strategy):
+	"""
+	Random pick, proportional to node weights, using the alias method: O(n) to build the tables, O(1) to pick.
+	"""
+
+	def __init__(self):
+		super(WeightedRandom, self).__init__()
+
+		# endpoints, probabilities, aliases: replaced as a whole, so pick() never mixes two node lists
+		self._table = ([], [], [])
+
+	def update(self, endpoints):
+		n = len(endpoints)
+		total = float(sum(e.weight for e in endpoints))
+
+		probabilities = [e.weight * n / total for e in endpoints]
+		aliases = [i for i in range(n)]
+
+		small = [i for i, p in enumerate(probabilities) if p < 1.0]
+		large = [i for i, p in enumerate(probabilities) if p >= 1.0]
+
+		while small and large:
+			s = small.pop()
+			l = large.pop()
+
+			aliases[s] = l
+			probabilities[l] -= 1.0 - probabilities[s]
+
+			if probabilities[l] < 1.0:
+				small.append(l)
+			else:
+				large.append(l)
+
+		# Rounding leftovers
+		for i in small + large:
+			probabilities[i] = 1.0
+
+		self._table = (endpoints, probabilities, aliases)
+		self.endpoints = endpoints
+
+	def pick(self):
+		endpoints, probabilities, aliases = self._table
+
+		i = random.randrange(len(endpoints))
+
+		if random.random() < probabilities[i]:
+			return endpoints[i]
+		else:
+			return endpoints[aliases[i]]
+
+
+class PowerOfTwoChoices(Strategy):
+	"""
+	Pick two random nodes and keep the one with less calls in progress.
+	"""
+
+	def _cost(self, endpoint):
+		return endpoint.inflight
+
+	def pick(self):
+		endpoints = self.endpoints
+
+		if len(endpoints) == 1:
+			return endpoints[0]
+
+		a, b = random.sample(endpoints, 2)
+
+		return a if self._cost(a) <= self._cost(b) else b
+
+
+class LeastLatency(PowerOfTwoChoices):
+	"""
+	Pick two random nodes and keep the one with the lowest EWMA latency, weighted by its calls in progress. Nodes
+	without latency data yet are tried first.
+	"""
+
+	def _cost(self, endpoint):
+		if endpoint.ewma is None:
+			return 0
+
+		return endpoint.ewma * (endpoint.inflight + 1)
+
+
+STRATEGIES = {
+	"round_robin"    : RoundRobin,
+	"weighted_random": WeightedRandom,
+	"p2c"            : PowerOfTwoChoices,
+	"least_latency"  : LeastLatency,
+}
+
+
+# --------------------------------------------------------------------------
+# Balancer
+# --------------------------------------------------------------------------
+class Balancer(object):
+	"""
+	Pick a node of a service for each call, using a selection strategy.
+
+	The node list is taken from the registry at most once each 'refresh_interval' seconds, and the strategy
+	structures are only rebuilt when it changes. Callers should report the result of each call, so the strategies
+	based on load or latency can use it:
+
+	>>> balancer = client.balancer("my-service", strategy="least_latency")
+	>>> with balancer.endpoint() as e:
+	...     requests.get("http://%s:%s/" % (e.address, e.port))
+	"""
+
+	def __init__(self, client, service_name, strategy="round_robin", refresh_interval=5, alpha=0.3,
+	             failure_latency=1.0):
+		"""
+		:param client: registry client
+		:type client: `pyservice_registry.client.RegisterClient`
+
+		:param service_name: service name
+		:type service_name: str
+
+		:param strategy: one of: round_robin, weighted_random, p2c, least_latency
+		:type strategy: str
+
+		:param refresh_interval: seconds between node list refreshes
+		:type refresh_interval: int|float
+
+		:param alpha: EWMA smoothing factor, between 0 and 1. Higher values forget old latencies faster
+		:type alpha: float
+
+		:param failure_latency: latency, in seconds, accounted for each failed call
+		:type failure_latency: float
+		"""
+		try:
+			self.strategy = STRATEGIES[strategy]()
+		except KeyError:
+			raise ValueError("Unknown strategy '%s'. Valid values: %s" % (strategy, ", ".join(sorted(STRATEGIES))))
+
+		self.client = client
+		self.service_name = service_name
+		self.refresh_interval = refresh_interval
+		self.alpha = alpha
+		self.failure_latency = failure_latency
+
+		self._lock = threading.Lock()
+
+		# (address, port) -> Endpoint. Feedback is kept while the node is registered
+		self._endpoints = {}
+		self._nodes = None
+		self._next_refresh = 0
+
+	def refresh(self, force=False):
+		"""
+		Reload the node list, if refresh interval elapsed, and rebuild strategy structures if it changed. If the
+		registry can't be reached, or it fails, the last known nodes are used.
+
+		:raise LookupError: if service is not registered, or it has no known nodes
+		"""
+		now = time.monotonic()
+
+		if not force and now < self._next_refresh:
+			return
+
+		try:
+			details = self.client.service_details(self.service_name, raise_errors=True)
+		except Exception as e:
+			# Registry unreachable or failing: keep using the last known nodes
+			if self._nodes:
+				self._next_refresh = now + self.refresh_interval
+				return
+
+			# Nothing to use yet: next call tries again
+			raise LookupError("Can't get the nodes of service '%s': %s" % (self.service_name, e))
+
+		self._next_refresh = now + self.refresh_interval
+
+		# Service is not registered
+		if isinstance(details, str):
+			nodes = []
+		else:
+			nodes = [n for service in details for n in service.get("nodes", [])]
+
+		if nodes != self._nodes:
+			with self._lock:
+				endpoints = {}
+
+				for node in nodes:
+					key = (node.get("address"), node.get("service_port"))
+
+					endpoint = self._endpoints.get(key) or Endpoint(key[0], key[1])
+					endpoint.weight = node.get("weight") or 1
+
+					endpoints[key] = endpoint
+
+				self._endpoints = endpoints
+				self._nodes = nodes
+
+				self.strategy.update(list(endpoints.values()))
+
+		if not nodes:
+			raise LookupError(details if isinstance(details, str) else "Service '%s' has no nodes" % self.service_name)
+
+	def pick(self):
+		"""
+		Pick a node for a call. The call must be reported with report() once it ends.
+
+		:return: the node to call
+		:rtype: Endpoint
+
+		:raise LookupError: if service is not registered, or it has no known nodes
+		"""
+		self.refresh()
+
+		if not self.strategy.endpoints:
+			raise LookupError("Service '%s' has no nodes" % self.service_name)
+
+		endpoint = self.strategy.pick()
+
+		with self._lock:
+			endpoint.inflight += 1
+
+		return endpoint
+
+	def report(self, endpoint, success=True, latency=None):
+		"""
+		Report the result of a call.
+
+		:param endpoint: the node returned by pick()
+		:type endpoint: Endpoint
+
+		:param success: the call succeed
+		:type success: bool
+
+		:param latency: call latency, in seconds
+		:type latency: float
+		"""
+		if not success:
+			latency = max(latency or 0, self.failure_latency)
+
+		with self._lock:
+			endpoint.inflight = max(endpoint.inflight - 1, 0)
+
+			if success:
+				endpoint.successes += 1
+			else:
+				endpoint.failures += 1
+
+			if latency is not None:
+				if endpoint.ewma is None:
+					endpoint.ewma = latency
+				else:
+					endpoint.ewma += self.alpha * (latency - endpoint.ewma)
+
+	@contextmanager
+	def endpoint(self):
+		"""
+		Pick a node, and report the call result and latency when the context ends. Exceptions are failures.
+		"""
+		endpoint = self.pick()
+		start = time.monotonic()
+
+		try:
+			yield endpoint
+		except Exception:
+			self.report(endpoint, False, time.monotonic() - start)
+			raise
+		else:
+			self.report(endpoint, True, time.monotonic() - start)
+
+	@property
+	def endpoints(self):
+		return list(self._endpoints.values())
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+#
+# PyService-Registry - https://github.com/cr0hn/pyservice-registry
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+# following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the
+# following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the
+# following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote
+# products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+try:
+	import ujson as json
+except ImportError:
+	import json
+
+import threading
+
+from collections import OrderedDict
+
+
+def etag_matches(if_none_match, etag):
+	"""
+	Check if an entity tag is in the value of an If-None-Match header.
+
+	:param if_none_match: header value. Ex: '"a1-3", W/"a1-4"'
+	:type if_none_match: str|None
+
+	:param etag: entity tag, quoted
+	:type etag: str
+
+	:rtype: bool
+	"""
+	if not if_none_match:
+		return False
+
+	for tag in if_none_match.split(","):
+		tag = tag.strip()
+
+		# If-None-Match uses the weak comparison
+		if tag.startswith("W/"):
+			tag = tag[2:]
+
+		if tag == etag or tag == "*":
+			return True
+
+	return False
+
+
+class ResponseCache(object):
+	"""
+	Cache of the encoded responses of catalog reads: the services list and the details of each service.
+
+	Each entry is stored with the catalog index it was built from. An entry is only rebuilt when the register,
+	deregister or expiration that touched it moves that index, so, most of the time, a read is a dict lookup.
+
+	Service entries are bounded: the least recently used ones are dropped first.
+
+	Entity tags are built from the catalog epoch and the index, so conditional requests can be answered without
+	building nor looking up any response.
+	"""
+
+	def __init__(self, catalog, max_services=1024):
+		"""
+		:param catalog: catalog index
+		:type catalog: `pyservice_registry.catalog.Catalog`
+
+		:param max_services: max number of cached service responses
+		:type max_services: int
+		"""
+		self.catalog = catalog
+		self.max_services = max_services
+
+		self._lock = threading.Lock()
+
+		# (index, body)
+		self._services = None
+
+		# name -> (index, body)
+		self._service = OrderedDict()
+
+	@staticmethod
+	def encode(data):
+		return json.dumps(data).encode(errors="ignore")
+
+	def etag(self, index):
+		"""
+		:return: entity tag of a response built from the given index
+		:rtype: str
+		"""
+		return '"%s-%d"' % (self.catalog.epoch, index)
+
+	def services_etag(self):
+		"""
+		:return: entity tag of the services list response
+		:rtype: str
+		"""
+		return self.etag(self.catalog.services_index)
+
+	def service_etag(self, name):
+		"""
+		:return: entity tag of the service details response. None if service is not in the catalog
+		:rtype: str|None
+		"""
+		if name not in self.catalog:
+			return None
+
+		return self.etag(self.catalog.service_index(name))
+
+	def services(self):
+		"""
+		:return: services list response, as (index, body)
+		:rtype: tuple(int, bytes)
+		"""
+		index = self.catalog.services_index
+
+		entry = self._services
+
+		if entry is None or entry[0] != index:
+			entry = self._services = (index, self.encode(self.catalog.services()))
+
+		return entry
+
+	def service(self, name):
+		"""
+		:return: service details response, as (index, body)
+		:rtype: tuple(int, bytes)
+
+		:raise Service.DoesNotExist: if service is not in the catalog
+		"""
+		index = self.catalog.service_index(name)
+
+		with self._lock:
+			entry = self._service.get(name)
+
+			if entry is not None and entry[0] == index:
+				self._service.move_to_end(name)
+				return entry
+
+		entry = (index, self.encode([self.catalog.service(name)]))
+
+		with self._lock:
+			self._service[name] = entry
+			self._service.move_to_end(name)
+
+			while len(self._service) > self.max_services:
+				self._service.popitem(last=False)
+
+		return entry
+
+	def __len__(self):
+		return len(self._service)
@@ -0,0 +1,1144 @@
+# -*- coding: utf-8 -*-
+#
+# PyService-Registry - https://github.com/cr0hn/pyservice-registry
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+# following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the
+# following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the
+# following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote
+# products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import time
+import uuid
+import asyncio
+import collections
+import logging
+import threading
+
+from contextlib import contextmanager
+
+from blitzdb.backends.base import NotInTransaction
+
+from pyservice_registry.locks import RWLock
+from pyservice_registry.models import Service
+from pyservice_registry.leases import LeaseScheduler
+from pyservice_registry.snapshot import dump
+
+log = logging.getLogger(__name__)
+
+# Attempts to load the catalog in the background, and seconds before the second one. It's doubled on each attempt
+LOAD_ATTEMPTS = 5
+LOAD_RETRY_BACKOFF = 1
+
+
+def _public(node):
+	"""
+	:return: node data, without private fields
+	:rtype: dict
+	"""
+	return {n_name: n_data for n_name, n_data in node.items() if n_name != "node_id"}
+
+
+class Catalog(object):
+	"""
+	In-memory index of the service catalog.
+
+	The backend is loaded only once, when the catalog is built. After that, all the reads are served from memory and
+	the writes go through to the backend, so the index is always the authoritative copy of the catalog.
+
+	Two indexes are maintained:
+
+	- name -> Service document (one per service, with its nodes by node_id)
+	- (name, node_id) -> node
+
+	Nodes registered with a TTL hold a lease, that must be renewed before it expires. Expired nodes are removed by
+	expire().
+
+	Each change increments the catalog index, and the index of the changed service is set to the new value. Clients
+	can watch an index: they are woken up when it moves past the value they already know.
+
+	It's thread safe. Writes are serialized, and the indexes are guarded by a readers-writer lock: reads run at once
+	and only wait for the in-memory part of a write, never for its backend I/O.
+
+	If a snapshot is given, the catalog is loaded from the backend in a background thread and, meanwhile, reads are
+	served from the snapshot and writes wait. Once loaded, all the indexes move forward, so cached responses and
+	watchers built from the snapshot are refreshed. A failed load is tried again, with a backoff: if it keeps failing,
+	the writes fail with its error.
+	"""
+
+	def __init__(self, backend, snapshot=None, changes_size=10000):
+		"""
+		:param backend: persistent storage: a blitzdb backend or one of the engines of `pyservice_registry.backends`
+		:type backend: `blitzdb.backends.base.Backend` | `pyservice_registry.backends.base.CatalogBackend`
+
+		:param snapshot: snapshot used to answer reads while the catalog is loaded. None to load it at once
+		:type snapshot: `pyservice_registry.snapshot.Snapshot`
+
+		:param changes_size: max change events kept to answer changes() requests
+		:type changes_size: int
+		"""
+		self.backend = backend
+
+		# Serializes the writes, including their backend I/O
+		self._lock = threading.RLock()
+
+		# Guards the in-memory indexes: held for reading by the reads, and for writing while they are changed
+		self._rwlock = RWLock()
+
+		# name -> Service
+		self._services = {}
+
+		# (name, node_id) -> node
+		self._nodes = {}
+
+		# Node leases, by (name, node_id)
+		self._leases = LeaseScheduler()
+
+		# Indexes start again from 0 on each run. The epoch identifies the run
+		self.epoch = uuid.uuid4().hex[:12]
+
+		# Global index, last index of the services list (names and descriptions) and last index of each service
+		self.index = 0
+		self.services_index = 0
+		self._indexes = {}
+
+		# Index of the services that never changed since the catalog was loaded
+		self._base_index = 0
+
+		# Services to write at the end of the running batch: name -> Service
+		self._deferred = None
+
+		# Services changed by the running batch (name -> Service, None if removed), and the functions that publish its
+		# changes once it's committed
+		self._staged = None
+		self._published = None
+
+		# Index watchers: service name (None for global index) -> set of callbacks
+		self._watchers = {}
+
+		# Change event listeners, with a lock of their own: they are added while the catalog is loaded
+		self._listeners = []
+		self._listeners_lock = threading.Lock()
+
+		# Last change events. The log has all the changes made after the horizon index
+		self._changes = collections.deque(maxlen=changes_size)
+		self._changes_horizon = 0
+
+		# Read-only snapshot, only used while the catalog is loaded
+		self._snapshot = snapshot
+		self._ready = threading.Event()
+
+		# Set once the background load ends, successfully or not, with its error if it failed
+		self._load_done = threading.Event()
+		self._load_error = None
+
+		if snapshot is None:
+			self.load()
+			self._ready.set()
+			self._load_done.set()
+		else:
+			threading.Thread(target=self._warm_up, name="catalog-warm-up", daemon=True).start()
+
+	# --------------------------------------------------------------------------
+	# Index handling
+	# --------------------------------------------------------------------------
+	def load(self):
+		"""
+		(Re)load the whole catalog from the backend.
+
+		Catalogs stored with the old format (one document per registered node) are migrated on the fly: all the
+		documents of a service are merged into the first one, and the others are removed.
+		"""
+		# The backend is read without blocking the readers and the watchers: the new indexes are swapped in at the end
+		with self._lock:
+			services = {}
+			nodes = {}
+			leases = LeaseScheduler()
+
+			for document in self.backend.filter(Service, {}):
+				name = document.get("name")
+
+				try:
+					service = services[name]
+				except KeyError:
+					service = Service({
+						"pk"         : document.pk,
+						"name"       : name,
+						"description": document.get("description"),
+						"nodes"      : {}
+					})
+					service.merge(document)
+
+					if not isinstance(document.get("nodes"), dict):
+						self.backend.save(service)
+
+					services[name] = service
+				else:
+					service.merge(document)
+
+					self.backend.save(service)
+					self.backend.delete(document)
+
+			for name, service in services.items():
+				for node_id, node in service.nodes.items():
+					nodes[(name, node_id)] = node
+
+					# Leases start again from load time
+					if node.get("ttl"):
+						leases.add((name, node_id), node.get("ttl"))
+
+			with self._rwlock.write():
+				self._services = services
+				self._nodes = nodes
+				self._leases = leases
+
+	def _warm_up(self):
+		"""
+		Load the catalog from the backend and stop serving reads from the snapshot. Failed loads are tried again, with
+		a backoff. If all of them fail, the writes fail with the load error.
+		"""
+		start = time.monotonic()
+		backoff = LOAD_RETRY_BACKOFF
+
+		for attempt in range(1, LOAD_ATTEMPTS + 1):
+			try:
+				self.load()
+				break
+			except Exception as e:
+				if attempt == LOAD_ATTEMPTS:
+					log.critical("Error loading the catalog, after %s attempts: %s. Writes will fail, and reads are "
+					             "answered from the snapshot" % (attempt, e))
+
+					self._load_error = e
+					self._load_done.set()
+					return
+
+				log.error("Error loading the catalog: %s. Trying again in %s seconds" % (e, backoff))
+
+				time.sleep(backoff)
+				backoff *= 2
+
+		with self._lock, self._rwlock.write():
+			self.index += 1
+			self.services_index = self.index
+			self._base_index = self.index
+
+			self._snapshot = None
+			self._ready.set()
+
+			watchers = self._watchers
+			self._watchers = {}
+
+			self._notify({"index": self.index, "type": "resync"})
+
+		self._load_done.set()
+
+		for callbacks in watchers.values():
+			for callback in callbacks:
+				callback()
+
+		log.info("Catalog loaded in %.3f seconds" % (time.monotonic() - start))
+
+	def wait_ready(self, timeout=None):
+		"""
+		Wait until the catalog is loaded from the backend, or its load fails.
+
+		:return: True if catalog is loaded
+		:rtype: bool
+		"""
+		self._load_done.wait(timeout)
+
+		return self._ready.is_set()
+
+	def _wait_loaded(self):
+		"""
+		Wait until the catalog is loaded, before a write.
+
+		:raise RuntimeError: if catalog couldn't be loaded
+		"""
+		self._load_done.wait()
+
+		if self._load_error is not None:
+			raise RuntimeError("Catalog couldn't be loaded: %s" % self._load_error)
+
+	@contextmanager
+	def _batch(self):
+		"""
+		Group all the backend writes done inside the context in a single commit. Backends that can't write single
+		nodes get each changed service only once, at the end. If anything fails, the writes not committed yet are
+		discarded.
+		"""
+		autocommit = self.backend.autocommit
+
+		self.backend.autocommit = False
+		self._deferred = {}
+		try:
+			yield
+
+			for service in self._deferred.values():
+				self.backend.save(service)
+
+			if autocommit:
+				self.backend.commit()
+		except Exception:
+			self._rollback()
+			raise
+		finally:
+			self._deferred = None
+			self.backend.autocommit = autocommit
+
+	def _rollback(self):
+		"""
+		Discard the backend writes not committed yet, after one of them failed.
+		"""
+		rollback = getattr(self.backend, "rollback", None)
+
+		if rollback is None:
+			return
+
+		try:
+			rollback()
+		except NotInTransaction:
+			# Nothing to discard: blitzdb backends in autocommit mode
+			pass
+		except Exception as e:
+			log.error("Error discarding catalog writes: %s" % e)
+
+	# --------------------------------------------------------------------------
+	# Writes
+	# --------------------------------------------------------------------------
+	#
+	# Services seen by the readers are never changed in place: each write changes a copy, stores it in the backend
+	# and, only if that succeeded, publishes it under the write lock, with the index bump. A failed write leaves the
+	# catalog as it was.
+	#
+	def _current(self, name):
+		"""
+		:return: a service as seen by the running write, with the changes of the running batch. None if it's not in the
+		         catalog
+		:rtype: Service|None
+		"""
+		if self._staged is not None and name in self._staged:
+			return self._staged[name]
+
+		return self._services.get(name)
+
+	@staticmethod
+	def _copy(service):
+		return Service(dict(service.attributes, nodes=dict(service.nodes)))
+
+	def _publish(self, name, service, publish):
+		"""
+		Make a stored change visible, or keep it until the end of the running batch.
+
+		:param service: service after the change. None if it was removed
+		:type service: Service|None
+
+		:param publish: function that applies the change to the indexes. It's called holding the write lock
+		:type publish: function
+		"""
+		if self._staged is None:
+			with self._rwlock.write():
+				publish()
+		else:
+			self._staged[name] = service
+			self._published.append(publish)
+
+	def register(self, name, description, node, ttl=None, weight=None):
+		"""
+		Add a node to a service, or update it if it's already registered. Registering the same node twice is
+		harmless: the backend is only written if something changed.
+
+		If a TTL is given, the node is removed once its lease expires. Registering a node again also renews its
+		lease.
+
+		:param name: service name
+		:type name: str
+
+		:param description: service description
+		:type description: str
+
+		:param node: node info. It must contain, at least, the 'node_id' key
+		:type node: dict
+
+		:param ttl: lease time to live, in seconds. None for nodes that never expire
+		:type ttl: int|float
+
+		:param weight: relative node weight, used by client-side load balancers. None for the default weight
+		:type weight: int|float
+
+		:return: True if node was added. False if it already exits
+		:rtype: bool
+		"""
+		key = (name, node.get("node_id"))
+
+		if ttl:
+			node = dict(node, ttl=ttl)
+
+		if weight:
+			node = dict(node, weight=weight)
+
+		self._wait_loaded()
+
+		with self._lock:
+			# Writes of a batch are made durable by its commit
+			batched = self._deferred is not None
+
+			current = self._current(name)
+			previous = None if current is None else current.nodes.get(key[1])
+
+			if current is None:
+				service = Service({
+					"name"       : name,
+					"description": description,
+					"nodes"      : {}
+				})
+				service.upsert_node(node)
+
+				listing = True
+				changed = True
+			elif previous == node and (description is None or current.get("description") == description):
+				# Only the lease is renewed
+				service = current
+				listing = False
+				changed = False
+			else:
+				service = self._copy(current)
+				service.upsert_node(node)
+
+				listing = False
+
+				if description is not None and service.get("description") != description:
+					service.description = description
+					listing = True
+
+				changed = True
+
+			if changed:
+				try:
+					self._store_node(service, node)
+				except Exception:
+					self._rollback()
+					raise
+
+			def publish():
+				self._services[name] = service
+				self._nodes[key] = node
+
+				if ttl:
+					self._leases.add(key, ttl)
+				else:
+					self._leases.remove(key)
+
+				if changed:
+					self._bump(name, listing, self._event("added" if previous is None else "updated", service, node,
+					                                              previous))
+
+			self._publish(name, service, publish)
+
+		if changed and not batched:
+			self._sync()
+
+		return previous is None
+
+	def batch(self, operations):
+		"""
+		Apply many registers, deregisters and lease renewals, in order, with a single backend commit. Changes are
+		visible once all of them are committed. If the commit fails, none of them is applied.
+
+		Each operation is a dict with the 'op' key, 'register', 'deregister' or 'renew', and the params of the method:
+
+		- {"op": "register", "name": ..., "description": ..., "node": ..., "ttl": ..., "weight": ...}
+		- {"op": "deregister", "name": ..., "node_id": ...}
+		- {"op": "renew", "name": ..., "node_id": ...}
+
+		:param operations: operations to apply
+		:type operations: list(dict)
+
+		:return: result of each operation: 'added', 'updated', 'removed', 'renewed' or 'not_found'
+		:rtype: list(str)
+		"""
+		results = []
+
+		self._wait_loaded()
+
+		with self._lock:
+			self._staged = {}
+			self._published = []
+
+			try:
+				with self._batch():
+					for operation in operations:
+						if operation["op"] == "register":
+							added = self.register(operation["name"],
+							                      operation.get("description"),
+							                      operation["node"],
+							                      ttl=operation.get("ttl"),
+							                      weight=operation.get("weight"))
+
+							results.append("added" if added else "updated")
+						elif operation["op"] == "renew":
+							results.append("renewed" if self._stage_renew(operation["name"], operation["node_id"])
+							               else "not_found")
+						else:
+							try:
+								self.deregister(operation["name"], operation["node_id"])
+
+								results.append("removed")
+							except Service.DoesNotExist:
+								results.append("not_found")
+
+				published = self._published
+			finally:
+				self._staged = None
+				self._published = None
+
+			with self._rwlock.write():
+				for publish in published:
+					publish()
+
+		self._sync()
+
+		return results
+
+	def _stage_renew(self, name, node_id):
+		"""
+		Renew a lease at the end of the running batch, if the node is registered at that point of the batch.
+
+		:return: True if node is registered. False otherwise
+		:rtype: bool
+		"""
+		current = self._current(name)
+
+		if current is None or node_id not in current.nodes:
+			return False
+
+		self._published.append(lambda: self._leases.renew((name, node_id)))
+
+		return True
+
+	def renew(self, name, node_id):
+		"""
+		Renew the lease of a node. It doesn't touch the backend.
+
+		:return: True if node is registered, and its lease, if it has one, has not expired. False otherwise
+		:rtype: bool
+		"""
+		key = (name, node_id)
+
+		# Leases start when the catalog is loaded: renewing them before is harmless
+		snapshot = self._snapshot
+		if snapshot is not None:
+			return snapshot.node(name, node_id) is not None
+
+		with self._rwlock.write():
+			node = self._nodes.get(key)
+
+			if node is None:
+				return False
+
+			if not node.get("ttl"):
+				return True
+
+			# An expired lease is gone, even if expire() hasn't removed the node yet
+			return self._leases.renew(key)
+
+	def deregister(self, name, node_id):
+		"""
+		Remove a node from a service. When the last node of a service is removed, the service is removed too.
+
+		:param name: service name
+		:type name: str
+
+		:param node_id: node ID
+		:type node_id: str
+
+		:raise Service.DoesNotExist: if service is not in the catalog
+		"""
+		self._wait_loaded()
+
+		with self._lock:
+			batched = self._deferred is not None
+
+			current = self._current(name)
+
+			if current is None:
+				raise Service.DoesNotExist()
+
+			node = current.nodes.get(node_id)
+
+			if node is None:
+				return
+
+			service = self._copy(current)
+			service.remove_node(node_id)
+
+			try:
+				self._store_removal(service, [node_id])
+			except Exception:
+				self._rollback()
+				raise
+
+			def publish():
+				self._forget_node(name, node_id)
+
+				if service.nodes:
+					self._services[name] = service
+				else:
+					del self._services[name]
+
+				self._bump(name, not service.nodes, self._event("removed", service, node))
+
+			self._publish(name, service if service.nodes else None, publish)
+
+		if not batched:
+			self._sync()
+
+	def expire(self):
+		"""
+		Remove the nodes with an expired lease. All the backend writes are grouped in a single commit. If it fails,
+		the nodes are kept, with a new lease.
+
+		:return: expired nodes, as (name, node_id) tuples
+		:rtype: list(tuple)
+		"""
+		self._wait_loaded()
+
+		with self._lock:
+			with self._rwlock.write():
+				expired = self._leases.expired()
+
+			if not expired:
+				return expired
+
+			# name -> service without its expired nodes
+			services = {}
+			events = []
+
+			for name, node_id in expired:
+				service = services.get(name)
+
+				if service is None:
+					service = services[name] = self._copy(self._services[name])
+
+				node = service.nodes.pop(node_id)
+				events.append((name, node_id, self._event("expired", service, node)))
+
+			try:
+				with self._batch():
+					for name, service in services.items():
+						self._store_removal(service, [node_id for n, node_id in expired if n == name])
+			except Exception:
+				with self._rwlock.write():
+					for key in expired:
+						self._leases.add(key, self._nodes[key].get("ttl"))
+				raise
+
+			with self._rwlock.write():
+				for name, service in services.items():
+					if service.nodes:
+						self._services[name] = service
+					else:
+						del self._services[name]
+
+				for name, node_id, event in events:
+					self._forget_node(name, node_id)
+					self._bump(name, not services[name].nodes, event)
+
+		self._sync()
+
+		return expired
+
+	def run_expiration(self, interval=1.0):
+		"""
+		Start a daemon thread that removes the expired nodes each interval.
+
+		:param interval: seconds between checks
+		:type interval: int|float
+
+		:return: the running thread
+		:rtype: threading.Thread
+		"""
+		def _loop():
+			while True:
+				time.sleep(interval)
+
+				try:
+					for name, node_id in self.expire():
+						log.info("Node '%s' of service '%s' expired" % (node_id, name))
+				except Exception as e:
+					log.error("Error expiring nodes: %s" % e)
+
+		t = threading.Thread(target=_loop, name="catalog-expiration", daemon=True)
+		t.start()
+
+		return t
+
+	def save_snapshot(self, path, sync=True):
+		"""
+		Write a snapshot of the catalog, to answer reads at once on the next start.
+
+		:param path: snapshot file path
+		:type path: str
+
+		:param sync: flush the file to disk
+		:type sync: bool
+		"""
+		if not self._ready.is_set():
+			return
+
+		with self._rwlock.read():
+			index = self.index
+			services = {
+				name: (service.get("description"), dict(service.nodes))
+				for name, service in self._services.items()
+			}
+			indexes = dict(self._indexes)
+			services_index = self.services_index
+			base_index = self._base_index
+
+		dump(services, path, index, sync, indexes, services_index, base_index, self.epoch)
+
+	def run_snapshots(self, path, interval=60):
+		"""
+		Start a daemon thread that writes a snapshot each interval, if the catalog changed.
+
+		:param path: snapshot file path
+		:type path: str
+
+		:param interval: seconds between snapshots
+		:type interval: int|float
+
+		:return: the running thread
+		:rtype: threading.Thread
+		"""
+		def _loop():
+			last_index = None
+
+			while True:
+				time.sleep(interval)
+
+				try:
+					index = self.index
+
+					if index != last_index and self._ready.is_set():
+						self.save_snapshot(path)
+						last_index = index
+				except Exception as e:
+					log.error("Error writing catalog snapshot: %s" % e)
+
+		t = threading.Thread(target=_loop, name="catalog-snapshots", daemon=True)
+		t.start()
+
+		return t
+
+	def _bump(self, name, listing=False, event=None):
+		"""
+		Move the global index and the index of a service forward, wake up their watchers and send the change event
+		to the listeners.
+
+		:param listing: the services list changed too: a service was added or removed, or its description changed
+		:type listing: bool
+
+		:param event: change event, without its index
+		:type event: dict
+		"""
+		self.index += 1
+		self._indexes[name] = self.index
+
+		if listing:
+			self.services_index = self.index
+
+		for callbacks in (self._watchers.pop(name, None), self._watchers.pop(None, None)):
+			if callbacks:
+				for callback in callbacks:
+					callback()
+
+		if event is not None:
+			event["index"] = self.index
+			self._notify(event)
+
+	@staticmethod
+	def _event(event_type, service, node, previous=None):
+		"""
+		Build a change event of a node. Nodes are sent without their private data, like they are read.
+
+		:param event_type: added, updated, removed or expired
+		:type event_type: str
+
+		:param previous: node data before an update
+		:type previous: dict
+
+		:rtype: dict
+		"""
+		event = {
+			"type"       : event_type,
+			"service"    : service.get("name"),
+			"description": service.get("description"),
+			"node"       : _public(node)
+		}
+
+		if previous is not None:
+			event["previous"] = _public(previous)
+
+		return event
+
+	def _notify(self, event):
+		if event["type"] == "resync":
+			# Changes before a reload are meaningless
+			self._changes.clear()
+			self._changes_horizon = event["index"]
+		else:
+			if len(self._changes) == self._changes.maxlen:
+				self._changes_horizon = self._changes[0]["index"]
+
+			self._changes.append(event)
+
+		with self._listeners_lock:
+			listeners = list(self._listeners)
+
+		for listener in listeners:
+			try:
+				listener(event)
+			except Exception as e:
+				log.error("Error sending catalog change event: %s" % e)
+
+	def _forget_node(self, name, node_id):
+		"""
+		:return: removed node
+		:rtype: dict
+		"""
+		key = (name, node_id)
+
+		self._leases.remove(key)
+
+		return self._nodes.pop(key)
+
+	def _store_node(self, service, node):
+		"""
+		Write a new or changed node of a service to the backend. Backends that can write a single node don't get the
+		whole service document.
+		"""
+		save_node = getattr(self.backend, "save_node", None)
+
+		if save_node is None:
+			self._save_service(service)
+		else:
+			save_node(service, node)
+
+	def _sync(self):
+		"""
+		Wait until the backend writes of the current thread are durable. It's called without the write lock, so
+		backends that share a sync between many writes, like the write-ahead log, sync them all at once.
+		"""
+		sync = getattr(self.backend, "sync", None)
+
+		if sync is not None:
+			sync()
+
+	def _save_service(self, service):
+		"""
+		Write the whole service document, or defer it to the end of the running batch.
+		"""
+		if self._deferred is None:
+			self.backend.save(service)
+		else:
+			self._deferred[service.name] = service
+
+	def _store_removal(self, service, node_ids):
+		"""
+		Write the removal of some nodes of a service to the backend, or remove the service if it has no nodes left.
+		"""
+		if not service.nodes:
+			self.backend.delete(service)
+
+			if self._deferred is not None:
+				self._deferred.pop(service.name, None)
+			return
+
+		delete_node = getattr(self.backend, "delete_node", None)
+
+		if delete_node is None:
+			self._save_service(service)
+		else:
+			for node_id in node_ids:
+				delete_node(service, node_id)
+
+	# --------------------------------------------------------------------------
+	# Reads
+	# --------------------------------------------------------------------------
+	def services(self):
+		"""
+		:return: list of services, by their name and description
+		:rtype: list(dict)
+		"""
+		snapshot = self._snapshot
+		if snapshot is not None:
+			return snapshot.services()
+
+		with self._rwlock.read():
+			return [
+				{
+					"name"       : s.get("name"),
+					"description": s.get("description")
+				}
+				for s in self._services.values()
+			]
+
+	def service(self, name):
+		"""
+		Get service details, removing private node data.
+
+		:param name: service name
+		:type name: str
+
+		:return: dict with the service name, description and its nodes
+		:rtype: dict
+
+		:raise Service.DoesNotExist: if service is not in the catalog
+		"""
+		snapshot = self._snapshot
+		if snapshot is not None:
+			return snapshot.service(name)
+
+		with self._rwlock.read():
+			try:
+				service = self._services[name]
+			except KeyError:
+				raise Service.DoesNotExist()
+
+			return {
+				"name"       : service.get("name"),
+				"description": service.get("description"),
+				"nodes"      : [_public(node) for node in service.nodes.values()]
+			}
+
+	def resolve(self, names):
+		"""
+		Get the details of many services, in a single pass over the index.
+
+		:param names: service names
+		:type names: list(str)
+
+		:return: tuple as (details of the services found, in the same format than service(); names not found)
+		:rtype: tuple(list(dict), list(str))
+		"""
+		found = []
+		missing = []
+
+		snapshot = self._snapshot
+		if snapshot is not None:
+			for name in names:
+				try:
+					found.append(snapshot.service(name))
+				except Service.DoesNotExist:
+					missing.append(name)
+
+			return found, missing
+
+		with self._rwlock.read():
+			for name in names:
+				try:
+					found.append(self.service(name))
+				except Service.DoesNotExist:
+					missing.append(name)
+
+		return found, missing
+
+	def changes(self, since=None, epoch=None):
+		"""
+		Get the changes made after a catalog index, to keep a mirror of the catalog up to date. If they are not
+		available anymore, because the change log was trimmed or the catalog was restarted, the whole catalog is
+		returned instead.
+
+		:param since: last index known by the mirror. None to get the whole catalog
+		:type since: int|None
+
+		:param epoch: catalog epoch known by the mirror
+		:type epoch: str|None
+
+		:return: dict with the catalog 'epoch' and 'index', and 'changes', with the change events in order, or
+		         'services', with the details of all the services, if it's a full copy
+		:rtype: dict
+		"""
+		snapshot = self._snapshot
+		if snapshot is not None:
+			return {
+				"epoch"   : self.epoch,
+				"index"   : self.index,
+				"services": [snapshot.service(service["name"]) for service in snapshot.services()]
+			}
+
+		with self._rwlock.read():
+			ret = {
+				"epoch": self.epoch,
+				"index": self.index
+			}
+
+			if since is not None and epoch == self.epoch and self._changes_horizon <= since <= self.index:
+				# Events are in index order: skip the already known ones from the end
+				changes = []
+
+				for event in reversed(self._changes):
+					if event["index"] <= since:
+						break
+					changes.append(event)
+
+				changes.reverse()
+
+				ret["changes"] = changes
+			else:
+				ret["services"] = [self.service(name) for name in list(self._services)]
+
+			return ret
+
+	def service_index(self, name):
+		"""
+		:return: index of the last change of a service. The load index if it has never changed
+		:rtype: int
+		"""
+		return self._indexes.get(name, self._base_index)
+
+	# --------------------------------------------------------------------------
+	# Watches
+	# --------------------------------------------------------------------------
+	def watch(self, name, index, callback):
+		"""
+		Call a function, only once, when the index moves past the given value.
+
+		An index greater than the current one means the catalog was restarted: it's treated as already changed.
+
+		:param name: service to watch. None to watch the global index
+		:type name: str|None
+
+		:param index: last index known by the watcher
+		:type index: int
+
+		:param callback: function, without parameters, called by the thread that changes the catalog
+		:type callback: function
+
+		:return: False if the index is already past the given value, and the callback won't be called
+		:rtype: bool
+		"""
+		with self._rwlock.write():
+			current = self.index if name is None else self.service_index(name)
+
+			if current != index:
+				return False
+
+			self._watchers.setdefault(name, set()).add(callback)
+
+		return True
+
+	def unwatch(self, name, callback):
+		with self._rwlock.write():
+			callbacks = self._watchers.get(name)
+
+			if callbacks:
+				callbacks.discard(callback)
+
+				if not callbacks:
+					del self._watchers[name]
+
+	def listen(self, listener):
+		"""
+		Receive all the change events of the catalog. The listener is called, in change order, by the thread that
+		changes the catalog, so it must return at once. Events are dicts like:
+
+		{"index": 42, "type": "added", "service": "users", "description": "...", "node": {...}}
+
+		Types are 'added', 'updated' (with a 'previous' node), 'removed', 'expired' and 'resync', sent when the whole
+		catalog was reloaded.
+
+		:param listener: function called with each event
+		:type listener: function
+		"""
+		with self._listeners_lock:
+			self._listeners.append(listener)
+
+	def unlisten(self, listener):
+		with self._listeners_lock:
+			try:
+				self._listeners.remove(listener)
+			except ValueError:
+				pass
+
+	def wait(self, name, index, timeout):
+		"""
+		Block the current thread until the index moves past the given value or the timeout expires.
+
+		:param timeout: max seconds to wait
+		:type timeout: int|float
+		"""
+		event = threading.Event()
+
+		if self.watch(name, index, event.set):
+			if not event.wait(timeout):
+				self.unwatch(name, event.set)
+
+	async def wait_async(self, name, index, timeout):
+		"""
+		Coroutine version of wait(). Waiters only hold a future and a timer in the event loop, not a thread.
+
+		:param timeout: max seconds to wait
+		:type timeout: int|float
+		"""
+		loop = asyncio.get_event_loop()
+		future = loop.create_future()
+
+		def _done():
+			if not future.done():
+				future.set_result(None)
+
+		def _wake():
+			loop.call_soon_threadsafe(_done)
+
+		if not self.watch(name, index, _wake):
+			return
+
+		timer = loop.call_later(timeout, _done)
+		try:
+			await future
+		finally:
+			timer.cancel()
+			self.unwatch(name, _wake)
+
+	def node(self, name, node_id):
+		"""
+		:return: node info or None if node is not in the catalog
+		:rtype: dict|None
+		"""
+		snapshot = self._snapshot
+		if snapshot is not None:
+			return snapshot.node(name, node_id)
+
+		return self._nodes.get((name, node_id))
+
+	def __contains__(self, name):
+		snapshot = self._snapshot
+		if snapshot is not None:
+			return name in snapshot
+
+		return name in self._services
+
+	def __len__(self):
+		snapshot = self._snapshot
+		if snapshot is not None:
+			return len(snapshot)
+
+		return len(self._services)
@@ -23,38 +23,62 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
 
+import os
 import json
 import sys
+import time
 import socket
 import logging
 import argparse
-
-from urllib.parse import urljoin
+import threading
 
 import hashlib
+import tempfile
 import requests
 
+from urllib.parse import urlencode
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool
+
 
 logging.basicConfig(level=logging.INFO, format='[ Service Register client] %(asctime)s - %(message)s')
 log = logging.getLogger(__name__)
 
 
-def get_hardware_id():
-	"""
-	Get an unique hardware ID, based on CPU info. All the times called, the value will be the same.
+# Node identity is computed only once, and persisted in this file
+NODE_ID_FILE = os.environ.get("PYSERVICE_REGISTRY_NODE_ID_FILE",
+                              os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")),
+                                           "pyservice-registry",
+                                           "node_id"))
 
-	>>> get_hardware_id()
-	'f8ef57d64aae6f3c45200b39di422bd6ca625d9a79655cb3aa6e171ef6f93013aa16c2df2f2b0359dfaf1782ba6fda94300506cdd9b21fdaf1264fbd0e47abb89'
+_node_id = None
 
-	:return: string with the hardware ID
-	:rtype: str
-	"""
+# Local agent of the host: a Unix socket path or a 'host:port' address. 'none' to never use it
+AGENT_ENV = "PYREGISTRY_AGENT"
+
+# Unix socket the agent listens on, by default
+DEFAULT_AGENT_SOCKET = os.path.join(tempfile.gettempdir(), "pyregistry-agent.sock")
+
+# Host name of the URLs of requests sent over the agent Unix socket
+AGENT_HOST = "pyregistry-agent"
+
+# Seconds an agent is used, or not, before it's checked again
+AGENT_CHECK_INTERVAL = 30
+
+# Resolved addresses: host -> (address, expiration time)
+_addresses = {}
+
+
+def _compute_hardware_id():
 	import cpuinfo
 
 	_ci = cpuinfo.get_cpu_info()
 
+	# Newer py-cpuinfo versions renamed 'brand' as 'brand_raw'
 	cpu_inf = ("%s%s%s%s" % (_ci['hz_actual'],
-	                         _ci['brand'],
+	                         _ci.get('brand', _ci.get('brand_raw')),
 	                         "".join(_ci['flags']),
 	                         _ci['arch'])).replace(" ", "")
 
@@ -64,14 +88,394 @@ def get_hardware_id():
 	return d.hexdigest()
 
 
-class RegisterClient(object):
+def get_hardware_id(refresh=False):
+	"""
+	Get an unique hardware ID, based on CPU info. All the times called, the value will be the same.
+
+	Getting CPU info is slow, so the ID is computed only once: it's kept in memory and in NODE_ID_FILE, for the next
+	processes. Call reset_hardware_id() or use 'refresh' to compute it again.
+
+	>>> get_hardware_id()
+	'f8ef57d64aae6f3c45200b39di422bd6ca625d9a79655cb3aa6e171ef6f93013aa16c2df2f2b0359dfaf1782ba6fda94300506cdd9b21fdaf1264fbd0e47abb89'
+
+	:param refresh: ignore the stored ID and compute it again
+	:type refresh: bool
+
+	:return: string with the hardware ID
+	:rtype: str
+	"""
+	global _node_id
+
+	if refresh:
+		reset_hardware_id()
+
+	if _node_id is not None:
+		return _node_id
+
+	try:
+		with open(NODE_ID_FILE, "r") as f:
+			_node_id = f.read().strip() or None
+	except (IOError, OSError):
+		pass
+
+	if _node_id is None:
+		_node_id = _compute_hardware_id()
+
+		try:
+			os.makedirs(os.path.dirname(NODE_ID_FILE), exist_ok=True)
+
+			tmp_file = "%s.%s" % (NODE_ID_FILE, os.getpid())
+			with open(tmp_file, "w") as f:
+				f.write(_node_id)
+			os.replace(tmp_file, NODE_ID_FILE)
+		except (IOError, OSError) as e:
+			log.debug("Can't store node ID in '%s': %s" % (NODE_ID_FILE, e))
+
+	return _node_id
+
+
+def reset_hardware_id():
+	"""
+	Forget the stored hardware ID, in memory and in NODE_ID_FILE.
+	"""
+	global _node_id
+
+	_node_id = None
+
+	try:
+		os.remove(NODE_ID_FILE)
+	except (IOError, OSError):
+		pass
+
+
+def resolve_address(host=None, ttl=60):
+	"""
+	Resolve a host name to an IP address. Resolved addresses are cached for 'ttl' seconds.
+
+	:param host: host name. None for the local host
+	:type host: str
+
+	:param ttl: seconds a resolved address is cached
+	:type ttl: int|float
+
+	:return: IP address
+	:rtype: str
+	"""
+	if host is None:
+		host = socket.gethostname()
+
+	now = time.monotonic()
+
+	try:
+		address, expiration = _addresses[host]
+
+		if now < expiration:
+			return address
+	except KeyError:
+		pass
+
+	address = socket.gethostbyname(host)
+	_addresses[host] = (address, now + ttl)
+
+	return address
+
+
+def find_agent():
+	"""
+	Find the local agent of this host. Its address is read from the PYREGISTRY_AGENT environment var or, if it's not
+	set, the default Unix socket is used if it exists. Clients check it answers, and mirrors their registry server,
+	before they use it.
+
+	:return: Unix socket path or (host, port) tuple. None if there's no agent
+	:rtype: str|tuple(str, int)|None
+	"""
+	address = os.environ.get(AGENT_ENV, "")
+
+	if address.lower() == "none":
+		return None
+
+	if not address:
+		return DEFAULT_AGENT_SOCKET if os.path.exists(DEFAULT_AGENT_SOCKET) else None
+
+	if os.sep in address:
+		return address
+
+	host, _, port = address.rpartition(":")
+
+	return host or "127.0.0.1", int(port)
+
+
+class _UnixConnection(HTTPConnection):
+
+	def __init__(self, *args, socket_path=None, **kwargs):
+		super(_UnixConnection, self).__init__(*args, **kwargs)
+
+		self.socket_path = socket_path
+
+	def _new_conn(self):
+		sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		sock.settimeout(self.timeout)
+		sock.connect(self.socket_path)
+
+		return sock
+
+
+class _UnixConnectionPool(HTTPConnectionPool):
+	ConnectionCls = _UnixConnection
+
+
+class UnixAdapter(HTTPAdapter):
+	"""
+	requests transport adapter that sends all the requests to a Unix socket, like the one of the local agent.
+	"""
+
+	def __init__(self, socket_path, pool_maxsize=10, max_retries=0):
+		self.socket_path = socket_path
+
+		self._pool = None
+
+		super(UnixAdapter, self).__init__(pool_connections=1, pool_maxsize=pool_maxsize, max_retries=max_retries)
+
+	def get_connection_with_tls_context(self, request, verify, proxies=None, cert=None):
+		return self.get_connection(request.url, proxies)
+
+	def get_connection(self, url, proxies=None):
+		if self._pool is None:
+			self._pool = _UnixConnectionPool(AGENT_HOST,
+			                                 maxsize=self._pool_maxsize,
+			                                 block=self._pool_block,
+			                                 socket_path=self.socket_path)
+
+		return self._pool
+
+	def close(self):
+		super(UnixAdapter, self).close()
+
+		if self._pool is not None:
+			self._pool.close()
+
+
+class RegistryError(Exception):
+	"""
+	The registry server answered with an unexpected error
+	"""
+
+
+class EventParser(object):
+	"""
+	Incremental parser of a Server-Sent Events stream, like the catalog change stream. Only the event data is used:
+	it already has the event index and type.
+	"""
+
+	def __init__(self):
+		self._data = []
+
+	def feed(self, line):
+		"""
+		:param line: a line of the stream, without the line break
+		:type line: str
+
+		:return: the decoded event data, if the line completes an event. None otherwise
+		:rtype: dict|None
+		"""
+		if not line:
+			if not self._data:
+				return None
+
+			data = "\n".join(self._data)
+			self._data = []
+
+			return json.loads(data)
+
+		if line.startswith("data:"):
+			self._data.append(line[6:] if line.startswith("data: ") else line[5:])
+
+		return None
+
+
+class _Call(object):
+	"""
+	A load in progress. Concurrent callers wait for it, instead of starting their own.
+	"""
+
+	__slots__ = ("done", "value", "error")
+
+	def __init__(self):
+		self.done = threading.Event()
+		self.value = None
+		self.error = None
+
+
+class ServiceCache(object):
+	"""
+	Client-side cache of service details.
+
+	- Entries younger than 'ttl' are served from the cache.
+	- Stale entries are served from the cache too, while a background thread refreshes them, but only for
+	  'max_stale' seconds more. After that, the caller waits for a fresh value.
+	- Concurrent misses of the same service are collapsed into a single request.
+	"""
+
+	def __init__(self, ttl, max_stale=None, clock=time.monotonic):
+		"""
+		:param ttl: seconds an entry is fresh
+		:type ttl: int|float
+
+		:param max_stale: seconds a stale entry can be served while it's refreshed. Default: same as ttl
+		:type max_stale: int|float
+
+		:param clock: function returning the current time, in seconds
+		:type clock: function
+		"""
+		self.ttl = ttl
+		self.max_stale = ttl if max_stale is None else max_stale
+		self.clock = clock
+
+		self._lock = threading.Lock()
+
+		# key -> (value, load time)
+		self._entries = {}
+
+		# key -> _Call
+		self._inflight = {}
+
+		self.hits = 0
+		self.stale_hits = 0
+		self.misses = 0
+		self.load_errors = 0
+
+	def get(self, key, loader):
+		"""
+		Get a value from the cache, loading it if it's needed.
+
+		:param key: cache key
+		:type key: str
+
+		:param loader: function that loads the value of the key. Exceptions are not cached
+		:type loader: function
+
+		:return: cached or loaded value
+		"""
+		now = self.clock()
+
+		with self._lock:
+			entry = self._entries.get(key)
+
+			if entry is not None:
+				age = now - entry[1]
+
+				if age < self.ttl:
+					self.hits += 1
+					return entry[0]
+
+				if age < self.ttl + self.max_stale:
+					self.stale_hits += 1
+
+					if key not in self._inflight:
+						call = self._inflight[key] = _Call()
+
+						threading.Thread(target=self._load, args=(key, loader, call), daemon=True).start()
+
+					return entry[0]
+
+			self.misses += 1
+
+			call = self._inflight.get(key)
+
+			if call is None:
+				call = self._inflight[key] = _Call()
+				owner = True
+			else:
+				owner = False
+
+		if owner:
+			self._load(key, loader, call)
+		else:
+			call.done.wait()
+
+		if call.error is not None:
+			raise call.error
+
+		return call.value
+
+	def _load(self, key, loader, call):
+		try:
+			call.value = loader(key)
+
+			with self._lock:
+				self._entries[key] = (call.value, self.clock())
+		except Exception as e:
+			call.error = e
+
+			with self._lock:
+				self.load_errors += 1
+		finally:
+			with self._lock:
+				del self._inflight[key]
+
+			call.done.set()
+
+	def invalidate(self, key=None):
+		"""
+		Remove a key from the cache. If key is None, remove all of them.
+		"""
+		with self._lock:
+			if key is None:
+				self._entries.clear()
+			else:
+				self._entries.pop(key, None)
+
+	def stats(self):
+		"""
+		:return: cache counters
+		:rtype: dict
+		"""
+		return dict(hits=self.hits,
+		            stale_hits=self.stale_hits,
+		            misses=self.misses,
+		            load_errors=self.load_errors,
+		            size=len(self._entries))
+
+
+class BaseRegisterClient(object):
+	"""
+	Request building and response parsing of the registry API, shared by the synchronous and the asyncio clients.
+	Subclasses only have to send the requests.
+	"""
 
 	route_register = "/api/v1/catalog/register"
 	route_deregister = "/api/v1/catalog/deregister"
+	route_renew = "/api/v1/catalog/renew/"
+	route_batch = "/api/v1/catalog/batch"
+	route_resolve = "/api/v1/catalog/resolve"
+	route_stream = "/api/v1/catalog/stream"
+	route_changes = "/api/v1/catalog/changes"
+	route_stats = "/api/v1/catalog/stats"
 	route_services_list = "/api/v1/catalog/services"
 	route_details = "/api/v1/catalog/service/"
 
-	def __init__(self, host, port, https=False):
+	json_headers = {'content-type': 'application/json'}
+
+	# Max seconds without receiving anything from a change stream. Server sends keep-alives more often
+	stream_read_timeout = 60
+
+	def __init__(self, host, port, https=False, agent=False):
+		"""
+		:param host: registry server host
+		:type host: str
+
+		:param port: registry server port
+		:type port: int
+
+		:param https: use HTTPS
+		:type https: bool
+
+		:param agent: send the requests through the local agent of the host: True to use it if there's one (see
+		              find_agent()), False to never use it, or its Unix socket path or (host, port) address. Requests
+		              are sent to the server when the agent is not available, is not synced yet or mirrors another
+		              server
+		:type agent: bool|str|tuple(str, int)
+		"""
 
 		if not isinstance(host, str):
 			raise TypeError("Expected str, got '%s' instead" % type(host))
@@ -82,34 +486,120 @@ class RegisterClient(object):
 		self.host = host
 		self.https = https
 
-	def _build_url(self, uri, https=False):
+		if agent is True:
+			agent = find_agent()
+
+		self.agent = agent or None
+
+		self.server_url = "%s://%s:%s" % ("https" if self.https else "http", self.host, self.port)
+
+		if isinstance(self.agent, tuple):
+			self.agent_url = "http://%s:%s" % self.agent
+		elif self.agent:
+			self.agent_url = "http://%s" % AGENT_HOST
+		else:
+			self.agent_url = None
+
+		# Requests are built for the agent, and sent to the server if the agent can't be used
+		self.base_url = self.agent_url or self.server_url
+
+		# Agent state: if it can be used, and monotonic time of its next check
+		self._agent_usable = False
+		self._agent_check_at = 0
 
-		return urljoin("%s://%s:%s" % ("https" if self.https else "http",
-		                               self.host,
-		                               self.port),
-		               uri)
+		# Last response of each conditional GET: url -> (etag, parsed body)
+		self._validators = {}
 
-	def register(self, service_name, service_port=8080, service_description=None, node_id=None, service_address=None):
+	def _build_url(self, uri):
+		return self.base_url + uri
+
+	# --------------------------------------------------------------------------
+	# Agent
+	# --------------------------------------------------------------------------
+	def _to_agent(self, url):
 		"""
-		:param service_name:
-		:type service_name:
+		:return: True if a request must be sent to the agent. None if the agent must be checked first
+		:rtype: bool|None
+		"""
+		if self.agent_url is None or not url.startswith(self.agent_url):
+			return False
 
-		:param service_port:
-		:type service_port:
+		if time.monotonic() >= self._agent_check_at:
+			return None
 
-		:param service_description:
-		:type service_description:
+		return self._agent_usable
 
-		:param node_id:
-		:type node_id:
+	def _to_server(self, url):
+		"""
+		:return: same URL, in the registry server
+		:rtype: str
+		"""
+		if self.agent_url is not None and url.startswith(self.agent_url):
+			return self.server_url + url[len(self.agent_url):]
 
-		:param service_address:
-		:type service_address:
+		return url
 
-		:return: None: all is oks. string: an error was raised
-		:rtype: None|str
+	def _agent_checked(self, status, text):
+		"""
+		Check the stats of the agent: it must mirror the registry server of this client.
+
+		:return: True if agent can be used
+		:rtype: bool
+		"""
+		leader = None
+
+		if status == 200:
+			try:
+				leader = json.loads(text)["replication"]["leader"]
+			except (ValueError, KeyError, TypeError):
+				pass
+
+		if isinstance(leader, str) and leader.rstrip("/").lower() == self.server_url.lower():
+			self._agent_usable = True
+			self._agent_check_at = time.monotonic() + AGENT_CHECK_INTERVAL
+		else:
+			self._agent_failed("it mirrors '%s', not '%s'" % (leader, self.server_url))
+
+		return self._agent_usable
+
+	def _agent_failed(self, reason):
+		"""
+		Send the requests to the server, until the agent is checked again
+		"""
+		if self._agent_usable or not self._agent_check_at:
+			log.warning("Local agent can't be used (%s): requests are sent to the server" % reason)
+
+		self._agent_usable = False
+		self._agent_check_at = time.monotonic() + AGENT_CHECK_INTERVAL
+
+	@staticmethod
+	def _agent_unavailable(status):
+		"""
+		:return: True if the agent answer means the request must be sent to the server: it's not synced yet, or it
+		         can't reach the server
+		:rtype: bool
 		"""
+		return status == 503
 
+	# --------------------------------------------------------------------------
+	# Requests
+	# --------------------------------------------------------------------------
+	def _register_request(self, service_name, service_port=8080, service_description=None, node_id=None,
+	                      service_address=None, ttl=None, weight=None):
+		"""
+		:return: tuple as (url, body)
+		:rtype: tuple(str, bytes)
+		"""
+		return self._build_url(self.route_register), json.dumps(self._register_data(
+			service_name, service_port, service_description, node_id, service_address, ttl, weight
+		)).encode(errors="ignore")
+
+	def _register_data(self, service_name, service_port=8080, service_description=None, node_id=None,
+	                   service_address=None, ttl=None, weight=None):
+		"""
+		:return: register request data
+		:rtype: dict
+		"""
 		if not isinstance(service_name, str):
 			raise TypeError("Expected str, got '%s' instead" % type(service_name))
 
@@ -129,26 +619,66 @@ class RegisterClient(object):
 			_service_id = node_id
 
 		# Local IP
-		if not service_address:
-			_service_address = socket.gethostbyname(socket.gethostname())
-		else:
-			_service_address = socket.gethostbyname(service_address)
-
-		ret = requests.post(self._build_url(self.route_register),
-		                    data=json.dumps(dict(
-			                    name=service_name,
-			                    description=service_description,
-			                    address=_service_address,
-			                    service_port=_service_port,
-			                    node_id=_service_id
-		                    )).encode(errors="ignore"), headers = {'content-type': 'application/json'})
-
-		if ret.status_code == 200:
-			return None
+		_service_address = resolve_address(service_address or None)
+
+		return dict(
+			name=service_name,
+			description=service_description,
+			address=_service_address,
+			service_port=_service_port,
+			node_id=_service_id,
+			ttl=ttl,
+			weight=weight
+		)
+
+	def _deregister_request(self, service_name, node_id=None):
+		"""
+		:return: tuple as (url, body)
+		:rtype: tuple(str, bytes)
+		"""
+		return self._build_url(self.route_deregister), json.dumps(self._deregister_data(
+			service_name, node_id
+		)).encode(errors="ignore")
+
+	def _deregister_data(self, service_name, node_id=None):
+		"""
+		:return: deregister request data
+		:rtype: dict
+		"""
+		if not isinstance(service_name, str):
+			raise TypeError("Expected str, got '%s' instead" % type(service_name))
+
+		if not node_id:
+			_node_id = get_hardware_id()
 		else:
-			return ret.text
+			_node_id = node_id
 
-	def deregister(self, service_name, node_id=None):
+		return dict(
+			name=service_name,
+			node_id=_node_id
+		)
+
+	def _batch_request(self, registers=(), deregisters=()):
+		"""
+		:param registers: params of each register() call
+		:type registers: list(dict)
+
+		:param deregisters: params of each deregister() call
+		:type deregisters: list(dict)
+
+		:return: tuple as (url, body, operations)
+		:rtype: tuple(str, bytes, list(dict))
+		"""
+		operations = [dict(self._register_data(**params), op="register") for params in registers]
+		operations.extend(dict(self._deregister_data(**params), op="deregister") for params in deregisters)
+
+		return self._build_url(self.route_batch), json.dumps(operations).encode(errors="ignore"), operations
+
+	def _renew_request(self, service_name, node_id=None):
+		"""
+		:return: tuple as (url, node_id)
+		:rtype: tuple(str, str)
+		"""
 		if not isinstance(service_name, str):
 			raise TypeError("Expected str, got '%s' instead" % type(service_name))
 
@@ -157,40 +687,574 @@ class RegisterClient(object):
 		else:
 			_node_id = node_id
 
-		ret = requests.post(self._build_url(self.route_deregister),
-		                    data=json.dumps(dict(
-			                    name=service_name,
-			                    node_id=_node_id
-		                    )).encode(errors="ignore"))
+		return "%s%s/%s" % (self._build_url(self.route_renew), service_name, _node_id), _node_id
+
+	def _details_url(self, name):
+		if not isinstance(name, str):
+			raise TypeError("Expected str, got '%s' instead" % type(name))
+
+		return "%s%s" % (self._build_url(self.route_details), name)
+
+	def _stream_url(self, services=None):
+		if not services:
+			return self._build_url(self.route_stream)
+
+		return "%s?%s" % (self._build_url(self.route_stream), urlencode([("service", name) for name in services]))
+
+	def _changes_url(self, since=None, epoch=None, wait=None):
+		params = []
+
+		if since is not None:
+			params.append(("since", since))
+		if epoch is not None:
+			params.append(("epoch", epoch))
+		if wait:
+			params.append(("wait", "%sms" % int(wait * 1000)))
+
+		if not params:
+			return self._build_url(self.route_changes)
+
+		return "%s?%s" % (self._build_url(self.route_changes), urlencode(params))
+
+	def _resolve_url(self, names):
+		for name in names:
+			if not isinstance(name, str):
+				raise TypeError("Expected str, got '%s' instead" % type(name))
+
+		return "%s?%s" % (self._build_url(self.route_resolve), urlencode([("name", name) for name in names]))
 
-		if ret.status_code == 200:
+	def _conditional_headers(self, url):
+		"""
+		:return: headers for a conditional GET of an URL
+		:rtype: dict
+		"""
+		validator = self._validators.get(url)
+
+		if validator:
+			return {'If-None-Match': validator[0]}
+		else:
+			return {}
+
+	# --------------------------------------------------------------------------
+	# Responses
+	# --------------------------------------------------------------------------
+	@staticmethod
+	def _parse_register(status, text):
+		if status in (200, 201):
+			return None
+		else:
+			return text
+
+	@staticmethod
+	def _parse_deregister(status, text, service_name):
+		if status == 200:
 			return None
-		elif ret.status_code == 404:
+		elif status == 404:
 			return "Service '%s' is not registered in server" % service_name
 		else:
-			return ret.text
+			return text
+
+	@staticmethod
+	def _parse_renew(status, text, service_name, node_id):
+		if status == 200:
+			return None
+		elif status == 404:
+			return "Node '%s' of service '%s' is not registered in server" % (node_id, service_name)
+		else:
+			return text
+
+	@classmethod
+	def _parse_batch(cls, status, text, operations):
+		"""
+		:return: result of each operation. None: all is oks. string: an error was raised
+		:rtype: list(None|str)
+		"""
+		if status != 200:
+			return [text] * len(operations)
+
+		ret = []
+
+		for operation, result in zip(operations, json.loads(text)["results"]):
+			if operation["op"] == "register":
+				ret.append(cls._parse_register(result["status"], result["message"]))
+			else:
+				ret.append(cls._parse_deregister(result["status"], result["message"], operation["name"]))
+
+		return ret
+
+	def _parse_conditional(self, url, status, headers, text):
+		"""
+		Parse the response of a conditional GET. On 304 Not Modified responses, the last body is reused.
+
+		:return: tuple as (status code, parsed body for 200 responses or response text otherwise)
+		:rtype: tuple(int, object)
+		"""
+		if status == 304:
+			validator = self._validators.get(url)
+
+			if validator:
+				return 200, validator[1]
+
+		if status != 200:
+			self._validators.pop(url, None)
+			return status, text
+
+		data = json.loads(text)
+
+		etag = headers.get("ETag")
+		if etag:
+			self._validators[url] = (etag, data)
+
+		return 200, data
+
+	@staticmethod
+	def _parse_resolve(status, text, names):
+		"""
+		:return: service name -> service details, as returned by service_details(), or an error string
+		:rtype: dict
+		"""
+		if status != 200:
+			return {name: text for name in names}
+
+		data = json.loads(text)
+
+		ret = {service["name"]: [service] for service in data["services"]}
+
+		for name in data["missing"]:
+			ret[name] = "Service '%s' is not registered in server" % name
+
+		return ret
+
+	@staticmethod
+	def _parse_changes(status, text):
+		"""
+		:raise RegistryError: on server errors
+		"""
+		if status != 200:
+			raise RegistryError(text)
+
+		return json.loads(text)
+
+	@staticmethod
+	def _parse_details(status, data, name):
+		"""
+		:raise RegistryError: on unexpected server errors
+		"""
+		if status == 200:
+			return data
+		elif status in (204, 404):
+			return "Service '%s' is not registered in server" % name
+		else:
+			raise RegistryError(data)
+
+
+class RegisterClient(BaseRegisterClient):
+
+	def __init__(self, host, port, https=False, cache_ttl=None, cache_max_stale=None,
+	             pool_size=10, timeout=(3.05, 10), retries=3, retry_backoff=0.2, agent=True):
+		"""
+		:param host: registry server host
+		:type host: str
+
+		:param port: registry server port
+		:type port: int
+
+		:param https: use HTTPS
+		:type https: bool
+
+		:param cache_ttl: enable the service details cache. Seconds an entry is fresh
+		:type cache_ttl: int|float
+
+		:param cache_max_stale: seconds a stale entry can be served while it's refreshed. Default: same as cache_ttl
+		:type cache_max_stale: int|float
+
+		:param pool_size: max keep-alive connections to the server
+		:type pool_size: int
+
+		:param timeout: request timeout in seconds, or a (connect timeout, read timeout) tuple
+		:type timeout: float|tuple
+
+		:param retries: max retries of idempotent reads, on connection errors or 502/503/504 responses
+		:type retries: int
+
+		:param retry_backoff: backoff factor between retries, in seconds: backoff * 2 ^ (retry - 1)
+		:type retry_backoff: float
+
+		:param agent: send the requests through the local agent of the host: True to use it if there's one, False to
+		              never use it, or its Unix socket path or (host, port) address
+		:type agent: bool|str|tuple(str, int)
+		"""
+		super(RegisterClient, self).__init__(host, port, https, agent)
+
+		# Service details cache
+		self.cache = ServiceCache(cache_ttl, cache_max_stale) if cache_ttl else None
+
+		self.timeout = timeout
+
+		# Load balancers, by (service name, strategy)
+		self._balancers = {}
+		self._balancers_lock = threading.Lock()
+
+		# Persistent session: connections are pooled and kept alive. Only reads are retried
+		max_retries = Retry(total=retries,
+		                    backoff_factor=retry_backoff,
+		                    status_forcelist=(502, 503, 504),
+		                    allowed_methods=frozenset(["GET", "HEAD"]),
+		                    raise_on_status=False)
+
+		self.session = requests.Session()
+
+		# Requests the agent can't answer are not retried in it, but sent to the server
+		if isinstance(self.agent, str):
+			self.session.mount(self.agent_url, UnixAdapter(self.agent, pool_size))
+		elif self.agent:
+			self.session.mount(self.agent_url, HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+
+		self.session.mount(self.server_url, HTTPAdapter(pool_connections=1,
+		                                                pool_maxsize=pool_size,
+		                                                max_retries=max_retries))
+
+	def close(self):
+		"""
+		Close the pooled connections
+		"""
+		self.session.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_val, exc_tb):
+		self.close()
+
+	def _request(self, method, url, **kwargs):
+		"""
+		Send a request to the agent, if it can be used, or to the server.
+
+		:rtype: `requests.Response`
+		"""
+		to_agent = self._to_agent(url)
+
+		if to_agent is None:
+			try:
+				ret = self.session.get(self.agent_url + self.route_stats, timeout=self.timeout)
+			except requests.RequestException as e:
+				self._agent_failed(e)
+			else:
+				self._agent_checked(ret.status_code, ret.text)
+
+			to_agent = self._agent_usable
+
+		if to_agent:
+			try:
+				ret = self.session.request(method, url, **kwargs)
+			except requests.ConnectionError as e:
+				self._agent_failed(e)
+			else:
+				if not self._agent_unavailable(ret.status_code):
+					return ret
+
+				ret.close()
+
+		return self.session.request(method, self._to_server(url), **kwargs)
+
+	def register(self, service_name, service_port=8080, service_description=None, node_id=None, service_address=None,
+	             ttl=None, weight=None):
+		"""
+		:param service_name:
+		:type service_name:
+
+		:param service_port:
+		:type service_port:
+
+		:param service_description:
+		:type service_description:
+
+		:param node_id:
+		:type node_id:
+
+		:param service_address:
+		:type service_address:
+
+		:param ttl: lease time to live, in seconds. If set, the node must call renew() before it expires
+		:type ttl: int|float
+
+		:param weight: relative node weight, used by client-side load balancers. Default is 1
+		:type weight: int|float
+
+		:return: None: all is oks. string: an error was raised
+		:rtype: None|str
+		"""
+		url, body = self._register_request(service_name, service_port, service_description, node_id,
+		                                   service_address, ttl, weight)
+
+		ret = self._request("POST", url, data=body, headers=self.json_headers, timeout=self.timeout)
+
+		error = self._parse_register(ret.status_code, ret.text)
+		if error is None:
+			self._invalidate(service_name)
+
+		return error
+
+	def deregister(self, service_name, node_id=None):
+		url, body = self._deregister_request(service_name, node_id)
+
+		ret = self._request("POST", url, data=body, headers=self.json_headers, timeout=self.timeout)
+
+		error = self._parse_deregister(ret.status_code, ret.text, service_name)
+		if error is None:
+			self._invalidate(service_name)
+
+		return error
+
+	def register_many(self, services):
+		"""
+		Register many nodes, with a single request. Server applies them with a single database commit.
+
+		>>> client.register_many([dict(service_name="users", service_port=8080, node_id=node_id) for node_id in ids])
+
+		:param services: params of each register() call
+		:type services: list(dict)
+
+		:return: result of each register. None: all is oks. string: an error was raised
+		:rtype: list(None|str)
+		"""
+		return self._batch(registers=services)
+
+	def deregister_many(self, services):
+		"""
+		De-register many nodes, with a single request.
+
+		:param services: params of each deregister() call
+		:type services: list(dict)
+
+		:return: result of each deregister. None: all is oks. string: an error was raised
+		:rtype: list(None|str)
+		"""
+		return self._batch(deregisters=services)
+
+	def _batch(self, registers=(), deregisters=()):
+		url, body, operations = self._batch_request(registers, deregisters)
+
+		ret = self._request("POST", url, data=body, headers=self.json_headers, timeout=self.timeout)
+
+		errors = self._parse_batch(ret.status_code, ret.text, operations)
+
+		for operation, error in zip(operations, errors):
+			if error is None:
+				self._invalidate(operation["name"])
+
+		return errors
+
+	def renew(self, service_name, node_id=None):
+		"""
+		Renew the lease of a node registered with a TTL.
+
+		:return: None: all is oks. string: an error was raised
+		:rtype: None|str
+		"""
+		url, _node_id = self._renew_request(service_name, node_id)
+
+		ret = self._request("PUT", url, timeout=self.timeout)
+
+		return self._parse_renew(ret.status_code, ret.text, service_name, _node_id)
+
+	def _invalidate(self, service_name):
+		"""
+		Forget the cached details of a service changed by this client
+		"""
+		if self.cache is not None:
+			self.cache.invalidate(service_name)
+
+	def _conditional_get(self, url):
+		"""
+		GET an URL sending the ETag of its last response. If server answers 304 Not Modified, the last body is reused.
+
+		:return: tuple as (status code, parsed body for 200 responses or response text otherwise)
+		:rtype: tuple(int, object)
+		"""
+		ret = self._request("GET", url, headers=self._conditional_headers(url), timeout=self.timeout)
+
+		return self._parse_conditional(url, ret.status_code, ret.headers, ret.text)
 
 	def list_services(self):
-		ret = requests.get(self._build_url(self.route_services_list))
+		_, data = self._conditional_get(self._build_url(self.route_services_list))
+
+		return data
+
+	def _load_service_details(self, name):
+		status, data = self._conditional_get(self._details_url(name))
+
+		return self._parse_details(status, data, name)
+
+	def service_details(self, name, raise_errors=False):
+		"""
+		Get the details of a service. If the cache is enabled, they could come from it.
+
+		:param name: service name
+		:type name: str
 
-		return json.loads(ret.text)
+		:param raise_errors: raise the server errors, instead of returning them as a string
+		:type raise_errors: bool
 
-	def service_details(self, name):
+		:return: service details. string: service is not registered or an error was raised
+		:rtype: list|str
+
+		:raise RegistryError: on unexpected server errors, if 'raise_errors' is set
+		"""
 		if not isinstance(name, str):
 			raise TypeError("Expected str, got '%s' instead" % type(name))
 
-		ret = requests.get("%s%s" % (self._build_url(self.route_details), name))
+		try:
+			if self.cache is None:
+				return self._load_service_details(name)
+			else:
+				return self.cache.get(name, self._load_service_details)
+		except RegistryError as e:
+			if raise_errors:
+				raise
 
-		if ret.status_code == 200:
-			return json.loads(ret.text)
-		elif ret.status_code == 404:
-			return "Service '%s' is not registered in server" % name
-		else:
-			return ret.text
+			return str(e)
+
+	def resolve_many(self, names):
+		"""
+		Get the details of many services, with a single request. It's the fastest way to resolve the dependencies of
+		an application at startup.
+
+		:param names: service names
+		:type names: list(str)
+
+		:return: service name -> service details, as returned by service_details(), or an error string
+		:rtype: dict
+		"""
+		if not names:
+			return {}
+
+		ret = self._request("GET", self._resolve_url(names), timeout=self.timeout)
+
+		return self._parse_resolve(ret.status_code, ret.text, names)
+
+	def changes(self, since=None, epoch=None, wait=None):
+		"""
+		Get the catalog changes made after an index, to keep a mirror of the catalog up to date. See
+		`pyservice_registry.mirror.CatalogMirror`, that applies them.
+
+		:param since: last catalog index known. None to get the whole catalog
+		:type since: int
+
+		:param epoch: catalog epoch known, as returned with the changes
+		:type epoch: str
+
+		:param wait: if there are no changes yet, seconds to wait for them
+		:type wait: float
+
+		:return: dict with the catalog 'epoch' and 'index', and 'changes', with the change events in order, or
+		         'services', with the details of all the services, if the changes are not available anymore
+		:rtype: dict
+
+		:raise RegistryError: on server errors
+		"""
+		timeout = self.timeout
+
+		if wait:
+			connect_timeout, read_timeout = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+			timeout = (connect_timeout, read_timeout + wait)
+
+		ret = self._request("GET", self._changes_url(since, epoch, wait), timeout=timeout)
+
+		return self._parse_changes(ret.status_code, ret.text)
+
+	def subscribe(self, services=None):
+		"""
+		Iterate over the catalog change events, as they happen. Only the aiohttp server engine has the change stream.
+
+		>>> for event in client.subscribe(["users"]):
+		...     print(event["index"], event["type"], event["node"])
+
+		A 'resync' event means events were lost, because they were not read fast enough: the catalog must be read
+		again, and next events with an index already seen must be skipped.
+
+		:param services: service names to receive events of. None for all of them
+		:type services: list(str)
+
+		:return: events, as dicts with: index, type (added, updated, removed, expired or resync), service,
+		         description, node and previous node, for updates
+		:rtype: generator(dict)
+
+		:raise RegistryError: if server doesn't have the change stream
+		"""
+		connect_timeout = self.timeout[0] if isinstance(self.timeout, tuple) else self.timeout
+
+		with self._request("GET", self._stream_url(services),
+		                   stream=True,
+		                   timeout=(connect_timeout, self.stream_read_timeout)) as ret:
+
+			if ret.status_code != 200:
+				raise RegistryError(ret.text)
+
+			parser = EventParser()
+
+			for line in ret.iter_lines(decode_unicode=True):
+				event = parser.feed(line)
+
+				if event is not None:
+					yield event
+
+	def cache_stats(self):
+		"""
+		:return: service details cache counters. None if cache is not enabled
+		:rtype: dict|None
+		"""
+		return None if self.cache is None else self.cache.stats()
+
+	def balancer(self, service_name, strategy="round_robin", **kwargs):
+		"""
+		Get the load balancer of a service. Balancers are shared, so the feedback of calls made through them is
+		kept between calls to this method.
+
+		:param service_name: service name
+		:type service_name: str
+
+		:param strategy: one of: round_robin, weighted_random, p2c, least_latency
+		:type strategy: str
+
+		:param kwargs: other `pyservice_registry.balancer.Balancer` params. Only used when balancer is created
+		:type kwargs: dict
+
+		:rtype: `pyservice_registry.balancer.Balancer`
+		"""
+		from pyservice_registry.balancer import Balancer
+
+		key = (service_name, strategy)
+
+		with self._balancers_lock:
+			try:
+				return self._balancers[key]
+			except KeyError:
+				balancer = self._balancers[key] = Balancer(self, service_name, strategy, **kwargs)
+				return balancer
+
+	def pick(self, service_name, strategy="round_robin"):
+		"""
+		Pick a node of a service. The call should be reported to the balancer, or made in a context of
+		`balancer().endpoint()`, for load or latency based strategies.
+
+		:return: the node to call
+		:rtype: `pyservice_registry.balancer.Endpoint`
+
+		:raise LookupError: if service is not registered
+		"""
+		return self.balancer(service_name, strategy).pick()
 
 
 def cmd_run(args):
 
+	if args.action == "node-id":
+		if args.RESET:
+			reset_hardware_id()
+
+		log.critical("Node ID: %s" % get_hardware_id())
+		return
+
 	client = RegisterClient(host=args.HOST, port=args.PORT)
 
 	if args.action == "register":
@@ -199,7 +1263,9 @@ def cmd_run(args):
 		                      service_port=args.SERVICE_PORT,
 		                      node_id=args.NODE_ID,
 		                      service_description=args.SERVICE_DESCRIPTION,
-		                      service_address=args.SERVICE_ADDRESS)
+		                      service_address=args.SERVICE_ADDRESS,
+		                      ttl=args.TTL,
+		                      weight=args.WEIGHT)
 		if ret:
 			log.critical("Error: %s" % ret)
 		log.critical("Done!")
@@ -213,6 +1279,15 @@ def cmd_run(args):
 
 		log.critical("Done!")
 
+	elif args.action == "renew":
+		log.critical("Renewing lease of service '%s'..." % args.SERVICE_NAME)
+		ret = client.renew(args.SERVICE_NAME, args.NODE_ID)
+
+		if ret:
+			log.critical("Error: %s" % ret)
+
+		log.critical("Done!")
+
 	elif args.action == "list":
 		log.critical("Listing registered services...")
 		log.critical("Services:")
@@ -258,15 +1333,28 @@ def main():
 	parser_register.add_argument("-A", "--service-address", dest="SERVICE_ADDRESS")
 	parser_register.add_argument("-P", "--service-port", type=int, dest="SERVICE_PORT")
 	parser_register.add_argument("-D", "--service-description", dest="SERVICE_DESCRIPTION")
+	parser_register.add_argument("-T", "--ttl", type=float, dest="TTL", help="lease time to live, in seconds")
+	parser_register.add_argument("-W", "--weight", type=float, dest="WEIGHT",
+	                             help="relative node weight, used by client-side load balancers")
 
 	# Deregister options
 	parser_deregister = subparser.add_parser('deregister', help='deregister a service')
 	parser_deregister.add_argument("-n", "--name", dest="SERVICE_NAME", required=True)
 	parser_deregister.add_argument("-I", "--id", dest="NODE_ID")
 
+	# Renew options
+	parser_renew = subparser.add_parser('renew', help='renew the lease of a service node')
+	parser_renew.add_argument("-n", "--name", dest="SERVICE_NAME", required=True)
+	parser_renew.add_argument("-I", "--id", dest="NODE_ID")
+
 	# List options
 	subparser.add_parser('list', help='list services')
 
+	# Node ID options
+	parser_node_id = subparser.add_parser('node-id', help='show the stored node ID of this host')
+	parser_node_id.add_argument("--reset", dest="RESET", action="store_true", default=False,
+	                            help="compute the node ID again")
+
 	# Details options
 	parser_details = subparser.add_parser('details', help='show service details')
 	parser_details.add_argument("-n", "--service-name", dest="SERVICE_NAME", required=True)
@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+#
+# PyService-Registry - https://github.com/cr0hn/pyservice-registry
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+# following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the
+# following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the
+# following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote
+# products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import asyncio
+
+import aiohttp
+
+from pyservice_registry.client import BaseRegisterClient, RegistryError, EventParser
+
+
+class AsyncRegisterClient(BaseRegisterClient):
+	"""
+	asyncio version of RegisterClient. All the instances calls share a pool of keep-alive connections, so many
+	requests can be in flight at once.
+
+	Requests are built and responses are parsed the same way than in RegisterClient. Cancelling a call cancels its
+	request, and calls taking more than 'timeout' seconds raise asyncio.TimeoutError.
+
+	>>> async with AsyncRegisterClient("127.0.0.1", 8000) as client:
+	...     await client.service_details("my-service")
+	"""
+
+	def __init__(self, host, port, https=False, pool_size=100, timeout=10, agent=True):
+		"""
+		:param host: registry server host
+		:type host: str
+
+		:param port: registry server port
+		:type port: int
+
+		:param https: use HTTPS
+		:type https: bool
+
+		:param pool_size: max connections to the server. Requests over this limit wait for a free connection
+		:type pool_size: int
+
+		:param timeout: max seconds of each call, including the wait for a free connection
+		:type timeout: int|float
+
+		:param agent: send the requests through the local agent of the host: True to use it if there's one, False to
+		              never use it, or its Unix socket path or (host, port) address
+		:type agent: bool|str|tuple(str, int)
+		"""
+		super(AsyncRegisterClient, self).__init__(host, port, https, agent)
+
+		self.pool_size = pool_size
+		self.timeout = aiohttp.ClientTimeout(total=timeout)
+
+		self._session = None
+		self._agent_session = None
+
+	@property
+	def session(self):
+		"""
+		Shared session of the server. It's created on first use, inside the running event loop.
+		"""
+		if self._session is None or self._session.closed:
+			self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.pool_size),
+			                                      timeout=self.timeout)
+
+		return self._session
+
+	@property
+	def agent_session(self):
+		"""
+		Shared session of the agent. The server one, if agent doesn't listen on a Unix socket.
+		"""
+		if not isinstance(self.agent, str):
+			return self.session
+
+		if self._agent_session is None or self._agent_session.closed:
+			self._agent_session = aiohttp.ClientSession(connector=aiohttp.UnixConnector(self.agent,
+			                                                                            limit=self.pool_size),
+			                                            timeout=self.timeout)
+
+		return self._agent_session
+
+	async def close(self):
+		"""
+		Close the pooled connections
+		"""
+		for session in (self._session, self._agent_session):
+			if session is not None:
+				await session.close()
+
+	async def __aenter__(self):
+		return self
+
+	async def __aexit__(self, exc_type, exc_val, exc_tb):
+		await self.close()
+
+	async def _send(self, method, url, **kwargs):
+		"""
+		Send a request to the agent, if it can be used, or to the server.
+
+		:return: the response. It must be released
+		:rtype: `aiohttp.ClientResponse`
+		"""
+		to_agent = self._to_agent(url)
+
+		if to_agent is None:
+			try:
+				async with self.agent_session.get(self.agent_url + self.route_stats) as ret:
+					self._agent_checked(ret.status, await ret.text())
+			except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+				self._agent_failed(e)
+
+			to_agent = self._agent_usable
+
+		if to_agent:
+			try:
+				ret = await self.agent_session.request(method, url, **kwargs)
+			except aiohttp.ClientConnectionError as e:
+				self._agent_failed(e)
+			else:
+				if not self._agent_unavailable(ret.status):
+					return ret
+
+				ret.release()
+
+		return await self.session.request(method, self._to_server(url), **kwargs)
+
+	async def _request(self, method, url, **kwargs):
+		"""
+		:return: tuple as (status code, headers, response text)
+		:rtype: tuple(int, dict, str)
+		"""
+		ret = await self._send(method, url, **kwargs)
+
+		try:
+			return ret.status, ret.headers, await ret.text()
+		finally:
+			ret.release()
+
+	async def register(self, service_name, service_port=8080, service_description=None, node_id=None,
+	                   service_address=None, ttl=None, weight=None):
+		"""
+		Same as RegisterClient.register()
+
+		:return: None: all is oks. string: an error was raised
+		:rtype: None|str
+		"""
+		# Node ID and address resolution could block
+		loop = asyncio.get_event_loop()
+		url, body = await loop.run_in_executor(None,
+		                                       lambda: self._register_request(service_name, service_port,
+		                                                                      service_description, node_id,
+		                                                                      service_address, ttl, weight))
+
+		status, _, text = await self._request("POST", url, data=body, headers=self.json_headers)
+
+		return self._parse_register(status, text)
+
+	async def register_many(self, services):
+		"""
+		Same as RegisterClient.register_many()
+
+		:return: result of each register. None: all is oks. string: an error was raised
+		:rtype: list(None|str)
+		"""
+		return await self._batch(registers=services)
+
+	async def deregister_many(self, services):
+		"""
+		Same as RegisterClient.deregister_many()
+
+		:return: result of each deregister. None: all is oks. string: an error was raised
+		:rtype: list(None|str)
+		"""
+		return await self._batch(deregisters=services)
+
+	async def _batch(self, registers=(), deregisters=()):
+		# Node ID and address resolution could block
+		loop = asyncio.get_event_loop()
+		url, body, operations = await loop.run_in_executor(None,
+		                                                   lambda: self._batch_request(registers, deregisters))
+
+		status, _, text = await self._request("POST", url, data=body, headers=self.json_headers)
+
+		return self._parse_batch(status, text, operations)
+
+	async def deregister(self, service_name, node_id=None):
+		"""
+		Same as RegisterClient.deregister()
+
+		:return: None: all is oks. string: an error was raised
+		:rtype: None|str
+		"""
+		loop = asyncio.get_event_loop()
+		url, body = await loop.run_in_executor(None, self._deregister_request, service_name, node_id)
+
+		status, _, text = await self._request("POST", url, data=body, headers=self.json_headers)
+
+		return self._parse_deregister(status, text, service_name)
+
+	async def renew(self, service_name, node_id=None):
+		"""
+		Same as RegisterClient.renew()
+
+		:return: None: all is oks. string: an error was raised
+		:rtype: None|str
+		"""
+		loop = asyncio.get_event_loop()
+		url, _node_id = await loop.run_in_executor(None, self._renew_request, service_name, node_id)
+
+		status, _, text = await self._request("PUT", url)
+
+		return self._parse_renew(status, text, service_name, _node_id)
+
+	async def _conditional_get(self, url):
+		status, headers, text = await self._request("GET", url, headers=self._conditional_headers(url))
+
+		return self._parse_conditional(url, status, headers, text)
+
+	async def list_services(self):
+		_, data = await self._conditional_get(self._build_url(self.route_services_list))
+
+		return data
+
+	async def service_details(self, name):
+		"""
+		Same as RegisterClient.service_details()
+
+		:return: service details. string: service is not registered or an error was raised
+		:rtype: list|str
+		"""
+		status, data = await self._conditional_get(self._details_url(name))
+
+		try:
+			return self._parse_details(status, data, name)
+		except RegistryError as e:
+			return str(e)
+
+	async def subscribe(self, services=None):
+		"""
+		Same as RegisterClient.subscribe(), as an asynchronous iterator:
+
+		>>> async for event in client.subscribe(["users"]):
+		...     print(event["index"], event["type"], event["node"])
+
+		:raise RegistryError: if server doesn't have the change stream
+		"""
+		timeout = aiohttp.ClientTimeout(total=None, sock_read=self.stream_read_timeout)
+
+		ret = await self._send("GET", self._stream_url(services), timeout=timeout)
+
+		try:
+			if ret.status != 200:
+				raise RegistryError(await ret.text())
+
+			parser = EventParser()
+
+			async for line in ret.content:
+				event = parser.feed(line.decode(errors="ignore").rstrip("\r\n"))
+
+				if event is not None:
+					yield event
+		finally:
+			ret.release()
+
+	async def changes(self, since=None, epoch=None, wait=None):
+		"""
+		Same as RegisterClient.changes()
+
+		:raise RegistryError: on server errors
+		"""
+		kwargs = {}
+
+		if wait and self.timeout.total:
+			kwargs["timeout"] = aiohttp.ClientTimeout(total=self.timeout.total + wait)
+
+		status, _, text = await self._request("GET", self._changes_url(since, epoch, wait), **kwargs)
+
+		return self._parse_changes(status, text)
+
+	async def resolve_many(self, names):
+		"""
+		Same as RegisterClient.resolve_many()
+
+		:return: service name -> service details, as returned by service_details(), or an error string
+		:rtype: dict
+		"""
+		if not names:
+			return {}
+
+		status, _, text = await self._request("GET", self._resolve_url(names))
+
+		return self._parse_resolve(status, text, names)
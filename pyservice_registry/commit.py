@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+#
+# PyService-Registry - https://github.com/cr0hn/pyservice-registry
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+# following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the
+# following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the
+# following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote
+# products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Group commit of the catalog writes: the writes received within a short window are applied with a single backend
+commit, so concurrent requests share the disk or database round trip instead of paying one each.
+"""
+
+import time
+import queue
+import logging
+import threading
+import collections
+
+from concurrent.futures import Future
+
+from pyservice_registry.models import Service
+
+
+log = logging.getLogger(__name__)
+
+
+def _summary(values):
+	"""
+	:return: mean, 50th and 99th percentiles and max of some values. None if there are no values
+	:rtype: dict|None
+	"""
+	if not values:
+		return None
+
+	values = sorted(values)
+
+	return {
+		"mean": sum(values) / len(values),
+		"p50" : values[len(values) // 2],
+		"p99" : values[min(len(values) - 1, int(len(values) * 0.99))],
+		"max" : values[-1]
+	}
+
+
+class GroupCommit(object):
+	"""
+	Write pipeline of the catalog. The first write of a group waits up to 'window' seconds for more writes, or until
+	the group has 'max_ops' operations. Then, all of them are applied in arrival order with `Catalog.batch()`, so
+	they share a single backend commit. Each write is acknowledged once its group is committed and durable. If a group
+	fails, its requests are committed one by one, so a bad request only fails itself.
+
+	It has the same write methods than the catalog. Asynchronous callers use submit(), that doesn't block.
+	"""
+
+	def __init__(self, catalog, window=0.005, max_ops=500, samples=1000):
+		"""
+		:param catalog: catalog index
+		:type catalog: `pyservice_registry.catalog.Catalog`
+
+		:param window: max seconds a write waits for others to join its group
+		:type window: float
+
+		:param max_ops: operations that close a group before the window ends
+		:type max_ops: int
+
+		:param samples: last groups and writes used to compute the metrics
+		:type samples: int
+		"""
+		self.catalog = catalog
+		self.window = window
+		self.max_ops = max_ops
+
+		self._queue = queue.Queue()
+
+		# Metrics
+		self._stats_lock = threading.Lock()
+		self._groups = 0
+		self._operations = 0
+		self._group_sizes = collections.deque(maxlen=samples)
+		self._commit_times = collections.deque(maxlen=samples)
+		self._ack_times = collections.deque(maxlen=samples)
+
+	def start(self):
+		"""
+		:return: the running thread
+		:rtype: threading.Thread
+		"""
+		t = threading.Thread(target=self._loop, name="catalog-group-commit", daemon=True)
+		t.start()
+
+		return t
+
+	def submit(self, operations):
+		"""
+		Queue write operations, in `Catalog.batch()` format, to apply them in the next group.
+
+		:return: future of the result of each operation, as returned by `Catalog.batch()`
+		:rtype: `concurrent.futures.Future`
+		"""
+		future = Future()
+
+		if operations:
+			self._queue.put((operations, future, time.monotonic()))
+		else:
+			future.set_result([])
+
+		return future
+
+	def _loop(self):
+		while True:
+			group = [self._queue.get()]
+			count = len(group[0][0])
+
+			deadline = group[0][2] + self.window
+
+			while count < self.max_ops:
+				remaining = deadline - time.monotonic()
+
+				try:
+					item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+				except queue.Empty:
+					break
+
+				group.append(item)
+				count += len(item[0])
+
+			self._commit(group, count)
+
+	def _commit(self, group, count):
+		operations = [operation for item in group for operation in item[0]]
+
+		start = time.monotonic()
+
+		try:
+			results = self._apply(operations)
+		except Exception as e:
+			log.error("Error committing %s catalog writes: %s. Committing them one request at a time" % (count, e))
+
+			self._commit_each(group)
+			return
+
+		done = time.monotonic()
+
+		position = 0
+
+		for item_operations, future, _ in group:
+			future.set_result(results[position:position + len(item_operations)])
+			position += len(item_operations)
+
+		with self._stats_lock:
+			self._groups += 1
+			self._operations += count
+			self._group_sizes.append(count)
+			self._commit_times.append(done - start)
+			self._ack_times.extend(done - enqueued for _, _, enqueued in group)
+
+	def _apply(self, operations):
+		"""
+		Apply operations with a single commit. A failed commit applies none of them. `Catalog.batch()` returns once
+		the commit is durable, like the writes made without the group commit.
+		"""
+		return self.catalog.batch(operations)
+
+	def _commit_each(self, group):
+		"""
+		Commit the writes of each request of a failed group on its own, so a bad request only fails itself.
+		"""
+		for operations, future, _ in group:
+			try:
+				future.set_result(self._apply(operations))
+			except Exception as e:
+				future.set_exception(e)
+
+	# --------------------------------------------------------------------------
+	# Catalog write methods
+	# --------------------------------------------------------------------------
+	def register(self, name, description, node, ttl=None, weight=None):
+		"""
+		Same as `Catalog.register()`, in the next group
+		"""
+		results = self.submit([dict(op="register", name=name, description=description, node=node, ttl=ttl,
+		                            weight=weight)]).result()
+
+		return results[0] == "added"
+
+	def deregister(self, name, node_id):
+		"""
+		Same as `Catalog.deregister()`, in the next group
+
+		:raise Service.DoesNotExist: if service is not in the catalog
+		"""
+		if self.submit([dict(op="deregister", name=name, node_id=node_id)]).result()[0] == "not_found":
+			raise Service.DoesNotExist()
+
+	def batch(self, operations):
+		"""
+		Same as `Catalog.batch()`, in the next group
+		"""
+		return self.submit(operations).result()
+
+	# --------------------------------------------------------------------------
+	# Metrics
+	# --------------------------------------------------------------------------
+	def stats(self):
+		"""
+		:return: group commit metrics: settings, totals, and size, commit time and write acknowledge time (from the
+		         write arrival), in seconds, of the last groups
+		:rtype: dict
+		"""
+		with self._stats_lock:
+			return {
+				"window"        : self.window,
+				"max_ops"       : self.max_ops,
+				"groups"        : self._groups,
+				"operations"    : self._operations,
+				"pending"       : self._queue.qsize(),
+				"group_size"    : _summary(self._group_sizes),
+				"commit_seconds": _summary(self._commit_times),
+				"ack_seconds"   : _summary(self._ack_times)
+			}
@@ -47,3 +47,36 @@ def crossdomain(origin="*", methods=None, headers=None,
 		f.provide_automatic_options = False
 		return update_wrapper(wrapped_function, f)
 	return decorator
+
+
+_DURATION_UNITS = (("ms", 0.001), ("s", 1), ("m", 60), ("h", 3600))
+
+
+def parse_duration(value):
+	"""
+	Parse a duration, like the ones used in blocking queries: '500ms', '30s', '5m'. Values without unit are seconds.
+
+	>>> parse_duration("30s")
+	30.0
+
+	:param value: duration text
+	:type value: str
+
+	:return: duration in seconds
+	:rtype: float
+
+	:raise ValueError: if value is not a valid duration
+	"""
+	value = value.strip().lower()
+
+	for unit, factor in _DURATION_UNITS:
+		if value.endswith(unit):
+			ret = float(value[:-len(unit)]) * factor
+			break
+	else:
+		ret = float(value)
+
+	if ret < 0:
+		raise ValueError("Duration can't be negative")
+
+	return ret
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+#
+# PyService-Registry - https://github.com/cr0hn/pyservice-registry
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+# following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the
+# following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the
+# following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote
+# products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import time
+import heapq
+import itertools
+
+
+class Lease(object):
+	"""
+	Lease of a node: it's alive until its deadline, unless it's renewed before.
+	"""
+
+	__slots__ = ("ttl", "deadline")
+
+	def __init__(self, ttl, deadline):
+		self.ttl = ttl
+		self.deadline = deadline
+
+
+class LeaseScheduler(object):
+	"""
+	Keep track of node leases and find the expired ones.
+
+	Leases are kept in a heap ordered by deadline. Renewing a lease only moves its deadline forward, without touching
+	the heap: when an old heap entry reaches the top, it's re-scheduled with the current deadline of its lease. So:
+
+	- renew() is O(1)
+	- expired() only visits the entries whose deadline has passed, never all the registered leases
+	"""
+
+	def __init__(self, clock=time.monotonic):
+		"""
+		:param clock: function returning the current time, in seconds
+		:type clock: function
+		"""
+		self.clock = clock
+
+		# key -> Lease
+		self._leases = {}
+
+		# (deadline, sequence, key, lease)
+		self._heap = []
+		self._sequence = itertools.count()
+
+	def _push(self, key, lease):
+		heapq.heappush(self._heap, (lease.deadline, next(self._sequence), key, lease))
+
+	def add(self, key, ttl):
+		"""
+		Add (or replace) the lease of a key.
+
+		:param key: lease key
+		:type key: hashable
+
+		:param ttl: time to live, in seconds
+		:type ttl: int|float
+		"""
+		lease = Lease(ttl, self.clock() + ttl)
+
+		self._leases[key] = lease
+		self._push(key, lease)
+
+	def renew(self, key):
+		"""
+		Renew the lease of a key.
+
+		:return: True if key has a lease. False otherwise
+		:rtype: bool
+		"""
+		try:
+			lease = self._leases[key]
+		except KeyError:
+			return False
+
+		lease.deadline = self.clock() + lease.ttl
+
+		return True
+
+	def remove(self, key):
+		"""
+		Remove the lease of a key. Its heap entry is discarded the next time it reaches the top of the heap.
+		"""
+		self._leases.pop(key, None)
+
+	def expired(self):
+		"""
+		Pop the expired keys.
+
+		:return: list of expired keys
+		:rtype: list
+		"""
+		now = self.clock()
+		heap = self._heap
+		leases = self._leases
+
+		ret = []
+
+		while heap and heap[0][0] <= now:
+			_, _, key, lease = heapq.heappop(heap)
+
+			# Removed or replaced lease
+			if leases.get(key) is not lease:
+				continue
+
+			if lease.deadline > now:
+				# Renewed after it was scheduled
+				self._push(key, lease)
+			else:
+				del leases[key]
+				ret.append(key)
+
+		return ret
+
+	def __contains__(self, key):
+		return key in self._leases
+
+	def __len__(self):
+		return len(self._leases)
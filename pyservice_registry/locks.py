@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+#
+# PyService-Registry - https://github.com/cr0hn/pyservice-registry
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+# following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the
+# following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the
+# following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote
+# products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+import threading
+
+from contextlib import contextmanager
+
+
+class RWLock(object):
+	"""
+	Readers-writer lock: many threads can read at once, while writers hold the lock alone.
+
+	- Writers are preferred: once a writer waits, new readers wait too, so a steady flow of reads can't starve writes.
+	- It's reentrant: a thread can read again while it reads, and read or write again while it writes. A reader can't
+	  become a writer.
+
+	>>> lock = RWLock()
+	>>> with lock.read():
+	...     pass
+	"""
+
+	def __init__(self):
+		self._cond = threading.Condition(threading.Lock())
+
+		self._readers = 0
+		self._waiting_writers = 0
+
+		self._writer = None
+		self._writer_depth = 0
+
+		# Read holds of each thread: True for the one that counts it as a reader, False for the nested ones
+		self._local = threading.local()
+
+	def acquire_read(self):
+		holds = getattr(self._local, "holds", None)
+		if holds is None:
+			holds = self._local.holds = []
+
+		if holds or self._writer == threading.get_ident():
+			holds.append(False)
+			return
+
+		with self._cond:
+			while self._writer is not None or self._waiting_writers:
+				self._cond.wait()
+
+			self._readers += 1
+
+		holds.append(True)
+
+	def release_read(self):
+		if not self._local.holds.pop():
+			return
+
+		with self._cond:
+			self._readers -= 1
+
+			if not self._readers:
+				self._cond.notify_all()
+
+	def acquire_write(self):
+		me = threading.get_ident()
+
+		with self._cond:
+			if self._writer == me:
+				self._writer_depth += 1
+				return
+
+			if getattr(self._local, "holds", None):
+				raise RuntimeError("A reader can't become a writer")
+
+			self._waiting_writers += 1
+			try:
+				while self._writer is not None or self._readers:
+					self._cond.wait()
+			finally:
+				self._waiting_writers -= 1
+
+			self._writer = me
+			self._writer_depth = 1
+
+	def release_write(self):
+		with self._cond:
+			self._writer_depth -= 1
+
+			if not self._writer_depth:
+				self._writer = None
+				self._cond.notify_all()
+
+	@contextmanager
+	def read(self):
+		self.acquire_read()
+		try:
+			yield
+		finally:
+			self.release_read()
+
+	@contextmanager
+	def write(self):
+		self.acquire_write()
+		try:
+			yield
+		finally:
+			self.release_write()
@@ -23,18 +23,33 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
 
-import asyncio
+from aiohttp import web
 
 
-@asyncio.coroutine
-def middleware_login(app, handler):
+@web.middleware
+async def middleware_login(request, handler):
 
-	@asyncio.coroutine
-	def middleware_handler(request):
+	r = await handler(request)
 
+	return r
 
-		r = yield from handler(request)
 
+@web.middleware
+async def middleware_crossdomain(request, handler):
+	"""
+	Add the same cross-domain headers than the Flask end-points.
+	"""
+	if request.method == "OPTIONS":
+		r = web.Response()
+	else:
+		r = await handler(request)
+
+	# Streaming responses set their own headers, before they are sent
+	if r.prepared:
 		return r
 
-	return middleware_handler
\ No newline at end of file
+	r.headers['Access-Control-Allow-Origin'] = "*"
+	r.headers['Access-Control-Allow-Methods'] = "GET, HEAD, OPTIONS, POST, PUT"
+	r.headers['Access-Control-Max-Age'] = "21600"
+
+	return r
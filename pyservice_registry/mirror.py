@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+#
+# PyService-Registry - https://github.com/cr0hn/pyservice-registry
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+# following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the
+# following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the
+# following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote
+# products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Local copy of the catalog, kept up to date with the changes end-point of the server.
+"""
+
+import threading
+
+
+class CatalogMirror(object):
+	"""
+	Copy of the catalog, updated with the changes made after the last index it knows. Only the first sync, or a sync
+	after the server lost the changes the mirror needs (it was restarted or the mirror was too far behind), gets the
+	whole catalog.
+
+	>>> mirror = CatalogMirror()
+	>>> mirror.apply(client.changes(mirror.index, mirror.epoch))
+	>>> mirror.service("users")
+
+	It's thread safe: it can be read while it's updated.
+	"""
+
+	def __init__(self):
+		self.epoch = None
+		self.index = None
+
+		# Service name -> {"name": ..., "description": ..., "nodes": [...]}
+		self._services = {}
+		self._lock = threading.Lock()
+
+	def sync(self, client, wait=None):
+		"""
+		Get the last changes from a registry server and apply them.
+
+		:param client: registry client
+		:type client: `pyservice_registry.client.RegisterClient`
+
+		:param wait: if there are no changes yet, seconds to wait for them
+		:type wait: float
+
+		:return: True if the whole catalog was copied
+		:rtype: bool
+
+		:raise RegistryError: on server errors
+		"""
+		return self.apply(client.changes(self.index, self.epoch, wait))
+
+	def apply(self, data):
+		"""
+		Apply a response of the changes end-point.
+
+		:param data: changes, as returned by the client changes() method
+		:type data: dict
+
+		:return: True if the whole catalog was copied
+		:rtype: bool
+		"""
+		with self._lock:
+			full_copy = "services" in data
+
+			if full_copy:
+				self._services = {service["name"]: service for service in data["services"]}
+			else:
+				for event in data["changes"]:
+					self._apply_event(event)
+
+			self.epoch = data["epoch"]
+			self.index = data["index"]
+
+			return full_copy
+
+	def _apply_event(self, event):
+		name = event["service"]
+
+		service = self._services.get(name)
+		if service is None:
+			service = self._services[name] = {"name": name, "description": event["description"], "nodes": []}
+
+		# Details are replaced, not modified, so the ones already returned don't change
+		nodes = list(service["nodes"])
+
+		if event["type"] == "added":
+			nodes.append(event["node"])
+		elif event["type"] == "updated":
+			if event.get("previous") in nodes:
+				nodes.remove(event["previous"])
+			nodes.append(event["node"])
+		elif event["node"] in nodes:
+			# removed or expired
+			nodes.remove(event["node"])
+
+		if nodes:
+			self._services[name] = {"name": name, "description": event["description"], "nodes": nodes}
+		else:
+			del self._services[name]
+
+	# --------------------------------------------------------------------------
+	# Reads
+	# --------------------------------------------------------------------------
+	def services(self):
+		"""
+		:return: services, as dicts with their name and description
+		:rtype: list(dict)
+		"""
+		with self._lock:
+			return [{"name": service["name"], "description": service["description"]}
+			        for service in self._services.values()]
+
+	def service(self, name):
+		"""
+		:return: service details, as returned by the server. None if it's not in the catalog
+		:rtype: dict|None
+		"""
+		with self._lock:
+			return self._services.get(name)
+
+	def __contains__(self, name):
+		return name in self._services
+
+	def __len__(self):
+		return len(self._services)
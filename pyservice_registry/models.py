@@ -27,5 +27,68 @@ from blitzdb import Document
 
 
 class Service(Document):
-	pass
+	"""
+	A service of the catalog. There is only one document per service name, and its nodes are indexed by their node_id:
+
+	{
+		"name": "SERVICE NAME",
+		"description": "SERVICE DESCRIPTION",
+		"nodes": {
+			"NODE_ID": {
+				"address": "IP OR DOMAIN_NAME",
+				"service_port": "PORT",
+				"node_id": "NODE_ID"
+			}
+		}
+	}
+	"""
+
+	def upsert_node(self, node):
+		"""
+		Add a node or replace it, if there's another one with the same node_id.
+
+		:param node: node info. It must contain, at least, the 'node_id' key
+		:type node: dict
+
+		:return: True if the service changed
+		:rtype: bool
+		"""
+		nodes = self.get("nodes")
+
+		if nodes is None:
+			nodes = self.nodes = {}
+
+		node_id = node.get("node_id")
+
+		if nodes.get(node_id) == node:
+			return False
+
+		nodes[node_id] = node
+		return True
+
+	def remove_node(self, node_id):
+		"""
+		:return: True if the node was in the service
+		:rtype: bool
+		"""
+		return self.get("nodes", {}).pop(node_id, None) is not None
+
+	def merge(self, other):
+		"""
+		Merge nodes of other service document, with the same name, into this one. It's used to migrate catalogs stored
+		with the old format: one document per node, with a list of nodes.
+
+		:param other: service document to merge
+		:type other: Service
+		"""
+		nodes = other.get("nodes") or {}
+
+		if isinstance(nodes, dict):
+			nodes = nodes.values()
+
+		for node in nodes:
+			self.upsert_node(node)
+
+		if other.get("description") is not None:
+			self.description = other.get("description")
 
@@ -7,21 +7,235 @@ from uuid import UUID
 from flask import Response, request
 
 from pyservice_registry.models import Service
-from pyservice_registry.helpers import crossdomain
+from pyservice_registry.cache import etag_matches
+from pyservice_registry.helpers import crossdomain, parse_duration
 
+# Blocking queries: default and max wait time, in seconds
+DEFAULT_WAIT = 300
+MAX_WAIT = 600
 
-def _check_input_params(input_vars):
+# Max operations of a batch request, and max services of a resolve request
+MAX_BATCH = 1000
+MAX_RESOLVE = 1000
+
+# Catalog.batch() results -> (status, message)
+BATCH_RESULTS = {
+	"added"    : (201, "service added"),
+	"updated"  : (200, "service updated"),
+	"removed"  : (200, "service removed"),
+	"renewed"  : (200, "lease renewed"),
+	"not_found": (404, "service not found"),
+}
+
+
+def _null_error(input_vars):
 	"""
-	Check all input values are filled
+	:return: error message if some input value is not filled. None otherwise
+	:rtype: str|None
 	"""
 	for name, value in input_vars.items():
 		if not value:
-			return Response(json.dumps(dict(message="'%s' can't be null" % name)).encode(errors="ignore"),
-			                content_type="application/json",
-			                status=400)
+			return "'%s' can't be null" % name
 	return None
 
 
+def _positive_number_error(name, value):
+	"""
+	:return: error message if an optional input value is not a positive number. None otherwise
+	:rtype: str|None
+	"""
+	if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0):
+		return "'%s' must be a positive number" % name
+	return None
+
+
+def _check_input_params(input_vars):
+	"""
+	Check all input values are filled
+	"""
+	error = _null_error(input_vars)
+	if error:
+		return Response(json.dumps(dict(message=error)).encode(errors="ignore"),
+		                content_type="application/json",
+		                status=400)
+	return None
+
+
+def _check_positive_number(name, value):
+	"""
+	Check an optional input value, like the lease TTL or the node weight, is a positive number
+	"""
+	error = _positive_number_error(name, value)
+	if error:
+		return Response(json.dumps(dict(message=error)).encode(errors="ignore"),
+		                content_type="application/json",
+		                status=400)
+	return None
+
+
+def parse_changes_params(args):
+	"""
+	Get the parameters of a changes request: 'since', 'epoch' and 'wait'.
+
+	:return: tuple as (since, epoch, wait). since is None to get the whole catalog
+	:rtype: tuple(int|None, str|None, float)
+
+	:raise ValueError: if some value is not valid
+	"""
+	since = args.get("since", None)
+
+	try:
+		if since is not None:
+			since = int(since)
+
+		wait = min(parse_duration(args.get("wait", "0")), MAX_WAIT)
+	except ValueError:
+		raise ValueError("'since' and 'wait' must be a number and a duration")
+
+	return since, args.get("epoch", None), wait
+
+
+def parse_batch(post_data):
+	"""
+	Validate the operations of a batch request.
+
+	:param post_data: decoded request body: a list of operations
+	:type post_data: list(dict)
+
+	:return: tuple as (valid operations, in Catalog.batch() format, with their position in the request; results, with
+	         a (400, message) tuple for each invalid operation and None for the valid ones)
+	:rtype: tuple(list(tuple(int, dict)), list)
+
+	:raise ValueError: if body is not a list of operations, or it's too long
+	"""
+	if not isinstance(post_data, list):
+		raise ValueError("Body must be a list of operations")
+
+	if len(post_data) > MAX_BATCH:
+		raise ValueError("Max %s operations per batch" % MAX_BATCH)
+
+	operations = []
+	results = [None] * len(post_data)
+
+	for i, item in enumerate(post_data):
+		if not isinstance(item, dict):
+			results[i] = (400, "operation must be an object")
+			continue
+
+		op = item.get("op")
+
+		if op == "register":
+			input_vars = dict(
+				service_name=item.get('name', None),
+				address=item.get('address', None),
+				service_port=item.get('service_port', None),
+				node_id=item.get('node_id', None)
+			)
+
+			error = (_null_error(input_vars) or
+			         _positive_number_error("ttl", item.get("ttl")) or
+			         _positive_number_error("weight", item.get("weight")))
+
+			operation = dict(op=op,
+			                 name=input_vars["service_name"],
+			                 description=item.get("description", None),
+			                 node={
+				                 "address"     : input_vars["address"],
+				                 "service_port": input_vars["service_port"],
+				                 "node_id"     : input_vars["node_id"],
+			                 },
+			                 ttl=item.get("ttl"),
+			                 weight=item.get("weight"))
+
+		elif op in ("deregister", "renew"):
+			input_vars = dict(
+				service_name=item.get('name', None),
+				node_id=item.get('node_id', None)
+			)
+
+			error = _null_error(input_vars)
+
+			operation = dict(op=op, name=input_vars["service_name"], node_id=input_vars["node_id"])
+
+		else:
+			error = "'op' must be 'register', 'deregister' or 'renew'"
+
+		if error:
+			results[i] = (400, error)
+		else:
+			operations.append((i, operation))
+
+	return operations, results
+
+
+def apply_batch(apply, operations):
+	"""
+	Apply the operations of a batch request with a single commit. If it fails, each operation is applied with a
+	commit of its own, so a storage failure only fails the operations it hits.
+
+	:param apply: `Catalog.batch()` or `GroupCommit.batch()`
+	:type apply: callable
+
+	:return: result of each operation, as returned by `Catalog.batch()`, or the exception that made it fail
+	:rtype: list(str|Exception)
+	"""
+	try:
+		return apply(operations)
+	except Exception:
+		pass
+
+	results = []
+
+	for operation in operations:
+		try:
+			results.extend(apply([operation]))
+		except Exception as e:
+			results.append(e)
+
+	return results
+
+
+def batch_response(operations, results, catalog_results):
+	"""
+	Build the body of a batch response: the status and message of each operation, in request order. Failed
+	operations get a 500 status.
+
+	:rtype: dict
+	"""
+	for (i, _), result in zip(operations, catalog_results):
+		if isinstance(result, Exception):
+			results[i] = (500, "operation failed: %s" % (str(result) or type(result).__name__))
+		else:
+			results[i] = BATCH_RESULTS[result]
+
+	return {
+		"results": [dict(status=status, message=message) for status, message in results]
+	}
+
+
+def _blocking_params(args):
+	"""
+	Get the blocking query parameters: 'index' and 'wait'.
+
+	:return: tuple as (index, wait, error_response). index is None for non-blocking queries
+	:rtype: tuple(int|None, float, Response|None)
+	"""
+	index = args.get("index", None)
+
+	if index is None:
+		return None, 0, None
+
+	try:
+		index = int(index)
+		wait = min(parse_duration(args.get("wait", str(DEFAULT_WAIT))), MAX_WAIT)
+	except ValueError:
+		return None, 0, Response(json.dumps(dict(message="'index' and 'wait' must be a number and a duration")),
+		                         content_type="application/json",
+		                         status=400)
+
+	return index, wait, None
+
+
 def routes_catalog(app):
 	"""
 	Add catalog end-points to the app
@@ -30,6 +244,13 @@ def routes_catalog(app):
 	:type app: `asyncio.web.Application`
 	"""
 
+	def _writer():
+		"""
+		:return: the group commit pipeline, if it's enabled, or the catalog
+		:rtype: `pyservice_registry.commit.GroupCommit` | `pyservice_registry.catalog.Catalog`
+		"""
+		return app.config.get('APP_COMMIT') or app.config['APP_CATALOG']
+
 	# --------------------------------------------------------------------------
 	# Entry points
 	# --------------------------------------------------------------------------
@@ -37,7 +258,7 @@ def routes_catalog(app):
 	@crossdomain("*")
 	def register():
 		"""
-	    This call register a new service in database
+	    This call register a new service node in database. If the node is already registered, it's updated.
 	    ---
 	    tags:
 	      - Catalog
@@ -62,7 +283,19 @@ def routes_catalog(app):
 	        type: string
 	        required: true
 	        description: unique node ID. Must be in UUID format.
+	      - name: ttl
+	        in: post
+	        type: number
+	        required: false
+	        description: lease time to live, in seconds. If set, node must be renewed before it expires
+	      - name: weight
+	        in: post
+	        type: number
+	        required: false
+	        description: relative node weight, used by client-side load balancers. Default is 1
 	    responses:
+	      200:
+	        description: service node updated
 	      201:
 	        description: service added
 	        schema:
@@ -72,8 +305,6 @@ def routes_catalog(app):
 		        message: MESSAGE TEXT
 	      400:
 	        description: some error in input format of data
-	      409:
-	        description: service already exits
 	    """
 		post_data = json.loads(request.data.decode(errors="ignore"))
 
@@ -89,6 +320,14 @@ def routes_catalog(app):
 		if in_check:
 			return in_check
 
+		ttl = post_data.get('ttl', None)
+		weight = post_data.get('weight', None)
+
+		for name, value in (("ttl", ttl), ("weight", weight)):
+			number_check = _check_positive_number(name, value)
+			if number_check:
+				return number_check
+
 		try:
 			UUID(input_vars.get("node_id"))
 		except ValueError as e:
@@ -96,40 +335,27 @@ def routes_catalog(app):
 			         content_type="application/json",
 			         status=400)
 
-		# Get DB instance
-		db = app.config['APP_DB']
-
-		# Try to find in database
-		try:
-			db.get(Service, {
-				"name" : input_vars.get("service_name"),
-				"nodes": {
-					"address"     : input_vars.get("address"),
-					"service_port": input_vars.get("service_port"),
-					"node_id"     : input_vars.get("node_id"),
-				}
-			})
+		added = _writer().register(input_vars.get("service_name"),
+		                           post_data.get('description', None),
+		                           {
+			                           "address"     : input_vars.get("address"),
+			                           "service_port": input_vars.get("service_port"),
+			                           "node_id"     : input_vars.get("node_id"),
+		                           },
+		                           ttl=ttl,
+		                           weight=weight)
 
-			response = Response(json.dumps({"warn": "service already exits"}).encode(errors="ignore"),
-			                    content_type="application/json",
-			                    status=409)
-		except Service.DoesNotExist:
-			# Service not in database -> store it
-			db.save(Service({
-				"name"       : input_vars.get("service_name"),
-				"description": post_data.get('description', None),
-				"nodes"      : [
-					{
-						"address"     : input_vars.get("address"),
-						"service_port": input_vars.get("service_port"),
-						"node_id"     : input_vars.get("node_id"),
-					}
-				]
-			}))
+		headers = {"X-Catalog-Index": str(app.config['APP_CATALOG'].index)}
 
+		if added:
 			response = Response(json.dumps({"message": "service added"}).encode(errors="ignore"),
 			                    content_type="application/json",
-			                    status=201)
+			                    status=201,
+			                    headers=headers)
+		else:
+			response = Response(json.dumps({"message": "service updated"}).encode(errors="ignore"),
+			                    content_type="application/json",
+			                    headers=headers)
 
 		return response
 
@@ -178,29 +404,12 @@ def routes_catalog(app):
 		if in_check:
 			return in_check
 
-		# Get DB instance
-		db = app.config['APP_DB']
-
-		# Try to find in database
 		try:
-			res = db.get(Service, {"name": input_vars.get("service_name")})
-
-			# Try to find the service with node_id
-			post_to_remove = None
-			for i, node in enumerate(res['nodes']):
-				if node.get("node_id", None) == input_vars.get("node_id"):
-					post_to_remove = i
-
-			# Found element?
-			if post_to_remove is not None:
-				res['nodes'].pop(post_to_remove)
-
-				# If this is the unique existing node, remove it
-				if not res['nodes']:
-					res.delete()
+			_writer().deregister(input_vars.get("service_name"), input_vars.get("node_id"))
 
 			response = Response(json.dumps({"message": "service removed"}).encode(errors="ignore"),
-			                    content_type="application/json")
+			                    content_type="application/json",
+			                    headers={"X-Catalog-Index": str(app.config['APP_CATALOG'].index)})
 		except Service.DoesNotExist:
 			response = Response(json.dumps({"message": "service not found"}).encode(errors="ignore"),
 			                    content_type="application/json",
@@ -208,11 +417,55 @@ def routes_catalog(app):
 
 		return response
 
-	@app.route("/api/v1/catalog/services", methods=["GET"])
+	@app.route("/api/v1/catalog/batch", methods=["POST"])
 	@crossdomain("*")
-	def services():
+	def batch():
 		"""
-		This call List available services by their name and description
+		This call applies many register, deregister and renew operations, with a single database commit
+	    ---
+	    tags:
+	      - Catalog
+	    parameters:
+	      - name: body
+	        in: body
+	        required: true
+	        description: list of operations. Each one has the 'op' key, 'register', 'deregister' or 'renew', and the
+	                     same fields than the register, deregister or renew call
+	    responses:
+	      200:
+	        description: operations applied. The status of each one is returned, in request order
+	        schema:
+	          type: object
+	        examples:
+		      application/json:
+		        results:
+		          - status: 201
+		            message: service added
+		          - status: 200
+		            message: service removed
+	      400:
+	        description: body is not a list of operations, or it's too long
+		"""
+		post_data = json.loads(request.data.decode(errors="ignore"))
+
+		try:
+			operations, results = parse_batch(post_data)
+		except ValueError as e:
+			return Response(json.dumps(dict(message=str(e))).encode(errors="ignore"),
+			                content_type="application/json",
+			                status=400)
+
+		catalog_results = apply_batch(_writer().batch, [operation for _, operation in operations])
+
+		return Response(json.dumps(batch_response(operations, results, catalog_results)).encode(errors="ignore"),
+		                content_type="application/json",
+		                headers={"X-Catalog-Index": str(app.config['APP_CATALOG'].index)})
+
+	@app.route("/api/v1/catalog/renew/<service_name>/<node_id>", methods=["PUT"])
+	@crossdomain("*")
+	def renew(service_name, node_id):
+		"""
+		This call renew the lease of a registered node. It's the lightweight heartbeat of nodes registered with a TTL
 	    ---
 	    tags:
 	      - Catalog
@@ -221,8 +474,57 @@ def routes_catalog(app):
 	        in: path
 	        type: string
 	        required: true
-	        description: name of service
+	        description: the service name
+	      - name: node_id
+	        in: path
+	        type: string
+	        required: true
+	        description: unique node ID
+	    responses:
+	      200:
+	        description: lease renewed
+	      404:
+	        description: node not registered. It must be registered again
+		"""
+
+		# Get catalog instance
+		catalog = app.config['APP_CATALOG']
+
+		if catalog.renew(service_name, node_id):
+			return Response(b'{"message": "lease renewed"}',
+			                content_type="application/json")
+		else:
+			return Response(b'{"message": "node not found"}',
+			                content_type="application/json",
+			                status=404)
+
+	@app.route("/api/v1/catalog/services", methods=["GET"])
+	@crossdomain("*")
+	def services():
+		"""
+		This call List available services by their name and description
+	    ---
+	    tags:
+	      - Catalog
+	    parameters:
+	      - name: index
+	        in: query
+	        type: integer
+	        required: false
+	        description: blocking query. Wait until the catalog index (X-Catalog-Index header) moves past this value
+	      - name: wait
+	        in: query
+	        type: string
+	        required: false
+	        description: blocking query max wait time. Ex. 500ms, 30s, 5m. Default 5m
+	      - name: If-None-Match
+	        in: header
+	        type: string
+	        required: false
+	        description: ETag of the last response. If the list didn't change, the response is a 304
 	    responses:
+	      304:
+	        description: services list didn't change
 	      200:
 	        description: listed available services
 	        schema:
@@ -238,22 +540,35 @@ def routes_catalog(app):
 
 		"""
 
-		# Get DB instance
-		db = app.config['APP_DB']
+		index, wait, error = _blocking_params(request.args)
+		if error:
+			return error
 
-		response = []
+		# Get catalog instance
+		catalog = app.config['APP_CATALOG']
 
-		# Get all services
-		for s in db.filter(Service, {}):
-			response.append({
-				"name"       : s.get("name"),
-				"description": s.get("description")
-			})
+		if index is not None:
+			catalog.wait(None, index, wait)
 
-		return Response(json.dumps(response).encode(errors="ignore"),
-		                content_type="application/json")
+		cache = app.config['APP_CACHE']
+
+		headers = {
+			"X-Catalog-Index": str(catalog.index),
+			"ETag"           : cache.services_etag()
+		}
+
+		# Conditional request
+		if etag_matches(request.headers.get("If-None-Match"), headers["ETag"]):
+			return Response(status=304, headers=headers)
+
+		services_index, body = cache.services()
+		headers["ETag"] = cache.etag(services_index)
+
+		return Response(body,
+		                content_type="application/json",
+		                headers=headers)
 
-	@app.route("/api/v1/catalog/service/<sevice_name>", methods=["GET"])
+	@app.route("/api/v1/catalog/service/<service_name>", methods=["GET"])
 	@crossdomain("*")
 	def service(service_name=None):
 		"""
@@ -267,7 +582,24 @@ def routes_catalog(app):
 	        type: string
 	        required: true
 	        description: name of service which we want the details
+	      - name: index
+	        in: query
+	        type: integer
+	        required: false
+	        description: blocking query. Wait until the service index (X-Catalog-Index header) moves past this value
+	      - name: wait
+	        in: query
+	        type: string
+	        required: false
+	        description: blocking query max wait time. Ex. 500ms, 30s, 5m. Default 5m
+	      - name: If-None-Match
+	        in: header
+	        type: string
+	        required: false
+	        description: ETag of the last response. If the service didn't change, the response is a 304
 	    responses:
+	      304:
+	        description: service didn't change
 	      200:
 	        description: everything was good
 	        schema:
@@ -297,49 +629,205 @@ def routes_catalog(app):
 			                content_type="application/json",
 			                status=204)
 
-		# Get DB instance
-		db = app.config['APP_DB']
-
-		# Try to find in database
-		try:
-			service_info = db.get(Service, {"name": service_name})
-
-			response_data = []
-
-			# Get all services
-			if service_info:
-
-				# Basic info
-				info = {
-					"name"       : service_info.get("name"),
-					"description": service_info.get("description"),
-					"nodes"      : []
-				}
+		index, wait, error = _blocking_params(request.args)
+		if error:
+			return error
 
-				# Get node info, removing private data
-				for node in service_info.get("nodes", []):
+		# Get catalog instance
+		catalog = app.config['APP_CATALOG']
 
-					node_info = {}
+		if index is not None:
+			catalog.wait(service_name, index, wait)
 
-					for n_name, n_data in node.items():
-						if n_name != "node_id":
-							node_info[n_name] = n_data
+		cache = app.config['APP_CACHE']
 
-					# Append to service_name nodes
-					info['nodes'].append(node_info)
+		# Conditional request
+		etag = cache.service_etag(service_name)
+		if etag and etag_matches(request.headers.get("If-None-Match"), etag):
+			return Response(status=304, headers={
+				"X-Catalog-Index": str(catalog.service_index(service_name)),
+				"ETag"           : etag
+			})
 
-				# Append to response
-				response_data.append(info)
+		try:
+			current_index, body = cache.service(service_name)
 
-			response = Response(json.dumps(response_data).encode(errors="ignore"),
-			                    content_type="application/json")
+			response = Response(body,
+			                    content_type="application/json",
+			                    headers={"ETag": cache.etag(current_index)})
 
 		except Service.DoesNotExist:
+			current_index = catalog.service_index(service_name)
+
 			response = Response(json.dumps({"message": "service name not found"}).encode(errors="ignore"),
 			                    content_type="application/json",
 			                    status=204)
 
+		response.headers["X-Catalog-Index"] = str(current_index)
+
 		return response
 
+	@app.route("/api/v1/catalog/resolve", methods=["GET"])
+	@crossdomain("*")
+	def resolve():
+		"""
+		This call get the details of many services at once
+	    ---
+	    tags:
+	      - Catalog
+	    parameters:
+	      - name: name
+	        in: query
+	        type: string
+	        required: true
+	        description: name of a service. Repeat it for each service. Ex. ?name=users&name=billing
+	    responses:
+	      200:
+	        description: details of the services found, and names of the missing ones
+	        schema:
+	          type: object
+	        examples:
+		      application/json: |-
+		        {
+		            "services": [
+		                {
+		                    "name": "SERVICE NAME",
+		                    "description": "SERVICE DESCRIPTION",
+		                    "nodes": [
+		                        {
+		                            "address": "IP OR DOMAIN_NAME",
+		                            "service_port": "PORT"
+		                        }
+		                    ]
+		                }
+		            ],
+		            "missing": ["SERVICE NAME"]
+		        }
+	      400:
+	        description: no service names, or too many of them
+		"""
+		names = request.args.getlist("name")
+
+		if not names or len(names) > MAX_RESOLVE:
+			return Response(json.dumps(dict(message="Between 1 and %s 'name' are required" % MAX_RESOLVE)),
+			                content_type="application/json",
+			                status=400)
+
+		# Get catalog instance
+		catalog = app.config['APP_CATALOG']
+
+		found, missing = catalog.resolve(names)
+
+		return Response(json.dumps(dict(services=found, missing=missing)).encode(errors="ignore"),
+		                content_type="application/json",
+		                headers={"X-Catalog-Index": str(catalog.index)})
+
+	@app.route("/api/v1/catalog/changes", methods=["GET"])
+	@crossdomain("*")
+	def changes():
+		"""
+		This call get the catalog changes made after an index, to keep a mirror of the catalog up to date
+	    ---
+	    tags:
+	      - Catalog
+	    parameters:
+	      - name: since
+	        in: query
+	        type: integer
+	        required: false
+	        description: last catalog index known by the mirror. Without it, the whole catalog is returned
+	      - name: epoch
+	        in: query
+	        type: string
+	        required: false
+	        description: catalog epoch known by the mirror, returned with the changes
+	      - name: wait
+	        in: query
+	        type: string
+	        required: false
+	        description: if there are no changes yet, wait for them up to this time. Ex. 500ms, 30s, 5m
+	    responses:
+	      200:
+	        description: changes made after the index, or the whole catalog if they are not available anymore
+	        schema:
+	          type: object
+	        examples:
+		      application/json: |-
+		        {
+		            "epoch": "EPOCH",
+		            "index": 42,
+		            "changes": [
+		                {
+		                    "index": 42,
+		                    "type": "added",
+		                    "service": "SERVICE NAME",
+		                    "description": "SERVICE DESCRIPTION",
+		                    "node": {
+		                        "address": "IP OR DOMAIN_NAME",
+		                        "service_port": "PORT"
+		                    }
+		                }
+		            ]
+		        }
+	      400:
+	        description: some error in input format of data
+		"""
+		try:
+			since, epoch, wait = parse_changes_params(request.args)
+		except ValueError as e:
+			return Response(json.dumps(dict(message=str(e))),
+			                content_type="application/json",
+			                status=400)
+
+		# Get catalog instance
+		catalog = app.config['APP_CATALOG']
+
+		if since is not None and wait and epoch == catalog.epoch:
+			catalog.wait(None, since, wait)
+
+		data = catalog.changes(since, epoch)
+
+		return Response(json.dumps(data).encode(errors="ignore"),
+		                content_type="application/json",
+		                headers={"X-Catalog-Index": str(data["index"])})
+
+	@app.route("/api/v1/catalog/stats", methods=["GET"])
+	@crossdomain("*")
+	def stats():
+		"""
+		This call get the catalog size and the group commit metrics, to tune its window
+	    ---
+	    tags:
+	      - Catalog
+	    responses:
+	      200:
+	        description: catalog index, number of services and group commit metrics, or null if it's not enabled
+	        schema:
+	          type: object
+	        examples:
+		      application/json: |-
+		        {
+		            "index": 42,
+		            "services": 3,
+		            "commit": {
+		                "window": 0.005,
+		                "max_ops": 500,
+		                "groups": 10,
+		                "operations": 80,
+		                "pending": 0,
+		                "group_size": {"mean": 8.0, "p50": 8, "p99": 12, "max": 12},
+		                "commit_seconds": {"mean": 0.002, "p50": 0.002, "p99": 0.004, "max": 0.004},
+		                "ack_seconds": {"mean": 0.006, "p50": 0.006, "p99": 0.009, "max": 0.009}
+		            }
+		        }
+		"""
+		catalog = app.config['APP_CATALOG']
+		commit = app.config.get('APP_COMMIT')
+
+		return Response(json.dumps(dict(index=catalog.index,
+		                                services=len(catalog),
+		                                commit=None if commit is None else commit.stats())),
+		                content_type="application/json")
+
 		# app.add_url_rule("/api/v1/catalog/register")
 		# app.add_url_route("/api/v1/catalog/deregister")
\ No newline at end of file
@@ -1,10 +1,31 @@
-import json
+try:
+	import ujson as json
+except ImportError:
+	import json
+
 import asyncio
 
 import aiohttp
+
 from aiohttp import web
 
 from pyservice_registry.models import Service
+from pyservice_registry.stream import encode_event
+from pyservice_registry.cache import etag_matches
+from pyservice_registry.helpers import parse_duration
+from pyservice_registry.routes.catalog import DEFAULT_WAIT, MAX_WAIT, MAX_RESOLVE, parse_batch, batch_response, \
+	parse_changes_params
+
+
+# Seconds between keep-alive comments of idle change streams
+STREAM_KEEPALIVE = 15
+
+
+def _json_response(data, status=200, headers=None):
+	return web.Response(body=json.dumps(data).encode(errors="ignore"),
+	                    content_type="application/json",
+	                    status=status,
+	                    headers=headers)
 
 
 def _check_input_params(input_vars):
@@ -13,20 +34,162 @@ def _check_input_params(input_vars):
 	"""
 	for name, value in input_vars.items():
 		if not value:
-			return web.HTTPBadRequest(body=json.dumps(dict(error="'%s' can't be null" % name)).encode(errors="ignore"),
-			                          content_type="application/json")
+			return _json_response(dict(message="'%s' can't be null" % name), status=400)
 	return None
 
 
+def _check_positive_number(name, value):
+	"""
+	Check an optional input value, like the lease TTL or the node weight, is a positive number
+	"""
+	if value is None:
+		return None
+
+	if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+		return _json_response(dict(message="'%s' must be a positive number" % name), status=400)
+	return None
+
+
+def _blocking_params(query):
+	"""
+	Get the blocking query parameters: 'index' and 'wait'.
+
+	:return: tuple as (index, wait, error_response). index is None for non-blocking queries
+	:rtype: tuple(int|None, float, Response|None)
+	"""
+	index = query.get("index", None)
+
+	if index is None:
+		return None, 0, None
+
+	try:
+		index = int(index)
+		wait = min(parse_duration(query.get("wait", str(DEFAULT_WAIT))), MAX_WAIT)
+	except ValueError:
+		return None, 0, _json_response(dict(message="'index' and 'wait' must be a number and a duration"), status=400)
+
+	return index, wait, None
+
+
+def _run_blocking(request, func, *args, **kwargs):
+	"""
+	Run a function that touches the storage backend in the bounded executor of the app, so it doesn't stall the
+	event loop.
+	"""
+	loop = asyncio.get_event_loop()
+
+	return loop.run_in_executor(request.app['APP_EXECUTOR'], lambda: func(*args, **kwargs))
+
+
+async def _apply(request, operations):
+	"""
+	Apply write operations, in `Catalog.batch()` format: in the next group commit, if it's enabled, or in the storage
+	executor, with a commit of their own.
+
+	:return: result of each operation, as returned by `Catalog.batch()`
+	:rtype: list(str)
+	"""
+	commit = request.app['APP_COMMIT']
+
+	if commit is None:
+		return await _run_blocking(request, request.app['APP_CATALOG'].batch, operations)
+
+	return await asyncio.wrap_future(commit.submit(operations))
+
+
+async def _apply_batch(request, operations):
+	"""
+	Same as `pyservice_registry.routes.catalog.apply_batch()`, with _apply()
+
+	:return: result of each operation, as returned by `Catalog.batch()`, or the exception that made it fail
+	:rtype: list(str|Exception)
+	"""
+	try:
+		return await _apply(request, operations)
+	except Exception:
+		pass
+
+	results = []
+
+	for operation in operations:
+		try:
+			results.extend(await _apply(request, [operation]))
+		except Exception as e:
+			results.append(e)
+
+	return results
+
+
+async def forward(request, session, url, stream=True):
+	"""
+	Forward a request to another registry server, like the writer of a multi-process server.
+
+	:param session: session connected to the server
+	:type session: `aiohttp.ClientSession`
+
+	:param url: URL of the request in the server
+	:type url: str
+
+	:param stream: stream the response, like the change stream. Otherwise, it's read at once and it can be changed
+	               before it's sent
+	:type stream: bool
+
+	:rtype: `aiohttp.web.StreamResponse`
+	"""
+	body = await request.read() if request.can_read_body else None
+
+	# Conditional requests and resumed change streams are answered by the server
+	request_headers = {name: request.headers[name] for name in ("Content-Type", "If-None-Match", "Last-Event-ID")
+	                   if name in request.headers}
+
+	try:
+		upstream_response = await session.request(request.method,
+		                                          url,
+		                                          data=body,
+		                                          headers=request_headers,
+		                                          timeout=aiohttp.ClientTimeout(total=None))
+	except (aiohttp.ClientError, asyncio.TimeoutError):
+		return _json_response({"message": "registry server is not available"}, status=503)
+
+	# Header names are matched without case: they may not be received as they were sent. Ex: 'Etag'
+	headers = {name: upstream_response.headers[name]
+	           for name in ("Content-Type", "Cache-Control", "ETag", "X-Catalog-Index")
+	           if name in upstream_response.headers}
+
+	try:
+		if not stream:
+			try:
+				upstream_body = await upstream_response.read()
+			except aiohttp.ClientError:
+				return _json_response({"message": "registry server is not available"}, status=503)
+
+			return web.Response(status=upstream_response.status, body=upstream_body, headers=headers)
+
+		response = web.StreamResponse(status=upstream_response.status, headers=headers)
+		await response.prepare(request)
+
+		try:
+			async for chunk in upstream_response.content.iter_any():
+				await response.write(chunk)
+
+			await response.write_eof()
+		except (ConnectionResetError, aiohttp.ClientError):
+			# The client or the server closed the stream
+			pass
+
+		return response
+	finally:
+		upstream_response.release()
+
+
 # --------------------------------------------------------------------------
 # Entry points
 # --------------------------------------------------------------------------
-@asyncio.coroutine
-def register(request):
+async def register(request):
 	"""
-	Register a new service
+	Register a new service node, or update it if it's already registered
 	"""
-	post_data = yield from request.json()
+	post_data = await request.json()
 
 	input_vars = dict(
 		service_name=post_data.get('name', None),
@@ -40,47 +203,41 @@ def register(request):
 	if in_check:
 		return in_check
 
-	# Get DB instance
-	db = request.app['APP_DB']
+	ttl = post_data.get('ttl', None)
+	weight = post_data.get('weight', None)
 
-	# Try to find in database
-	try:
-		db.get(Service, {
-			"name"               : input_vars.get("service_name"),
-			"nodes": {
-				"address"        : input_vars.get("address"),
-				"service_port"   : input_vars.get("service_port"),
-				"node_id"        : input_vars.get("node_id"),
-			}
-		})
+	for name, value in (("ttl", ttl), ("weight", weight)):
+		number_check = _check_positive_number(name, value)
+		if number_check:
+			return number_check
 
-		response = web.HTTPConflict(body=json.dumps({"warn": "service already exits"}).encode(errors="ignore"), content_type="application/json")
-	except Service.DoesNotExist:
-		# Service not in database -> store it
-		db.save(Service({
-			"name"                   : input_vars.get("service_name"),
-			"description"            : post_data.get('description', None),
-			"nodes": [
-				{
-					"address"        : input_vars.get("address"),
-					"service_port"   : input_vars.get("service_port"),
-					"node_id"        : input_vars.get("node_id"),
-				}
-			]
-		}))
-
-		response = web.HTTPOk(body=json.dumps({"ok": "service added"}).encode(errors="ignore"),
-		                      content_type="application/json")
+	# Get catalog instance
+	catalog = request.app['APP_CATALOG']
 
-	return response
+	results = await _apply(request, [dict(op="register",
+	                                      name=input_vars.get("service_name"),
+	                                      description=post_data.get('description', None),
+	                                      node={
+		                                      "address"     : input_vars.get("address"),
+		                                      "service_port": input_vars.get("service_port"),
+		                                      "node_id"     : input_vars.get("node_id"),
+	                                      },
+	                                      ttl=ttl,
+	                                      weight=weight)])
 
+	headers = {"X-Catalog-Index": str(catalog.index)}
 
-@asyncio.coroutine
-def deregister(request):
+	if results[0] == "added":
+		return _json_response({"message": "service added"}, status=201, headers=headers)
+	else:
+		return _json_response({"message": "service updated"}, headers=headers)
+
+
+async def deregister(request):
 	"""
-	De-register a new service
+	De-register a service node
 	"""
-	post_data = yield from request.json()
+	post_data = await request.json()
 
 	input_vars = dict(
 		service_name=post_data.get('name', None),
@@ -92,59 +249,83 @@ def deregister(request):
 	if in_check:
 		return in_check
 
-	# Get DB instance
-	db = request.app['APP_DB']
+	# Get catalog instance
+	catalog = request.app['APP_CATALOG']
+
+	results = await _apply(request, [dict(op="deregister",
+	                                      name=input_vars.get("service_name"),
+	                                      node_id=input_vars.get("node_id"))])
+
+	if results[0] == "not_found":
+		return _json_response({"message": "service not found"}, status=404)
+
+	return _json_response({"message": "service removed"}, headers={"X-Catalog-Index": str(catalog.index)})
+
+
+async def batch(request):
+	"""
+	Apply many register, deregister and renew operations, with a single storage commit
+	"""
+	post_data = await request.json()
 
-	# Try to find in database
 	try:
-		res = db.get(Service, {"name": input_vars.get("service_name")})
+		operations, results = parse_batch(post_data)
+	except ValueError as e:
+		return _json_response(dict(message=str(e)), status=400)
 
-		# Try to find the service with node_id
-		post_to_remove = None
-		for i, node in enumerate(res['nodes']):
-			if node.get("node_id", None) == input_vars.get("node_id"):
-				post_to_remove = i
+	# Get catalog instance
+	catalog = request.app['APP_CATALOG']
 
-		# Found element?
-		if post_to_remove is not None:
-			res['nodes'].pop(post_to_remove)
+	catalog_results = await _apply_batch(request, [operation for _, operation in operations])
 
-			# If this is the unique existing node, remove it
-			if not res['nodes']:
-				res.delete()
+	return _json_response(batch_response(operations, results, catalog_results),
+	                      headers={"X-Catalog-Index": str(catalog.index)})
 
-		response = web.HTTPOk(body=json.dumps({"ok": "service removed"}).encode(errors="ignore"),
-		                      content_type="application/json")
-	except Service.DoesNotExist:
-		response = web.HTTPNotFound(body=json.dumps({"error": "service not found"}).encode(errors="ignore"),
-		                            content_type="application/json")
 
-	return response
+async def renew(request):
+	"""
+	Renew the lease of a registered node. It never touches the storage backend, so it runs in the event loop
+	"""
+	catalog = request.app['APP_CATALOG']
 
+	if catalog.renew(request.match_info['service'], request.match_info['node_id']):
+		return web.Response(body=b'{"message": "lease renewed"}', content_type="application/json")
+	else:
+		return web.Response(body=b'{"message": "node not found"}', content_type="application/json", status=404)
 
-@asyncio.coroutine
-def services(request):
+
+async def services(request):
 	"""
 	List available services by their name and description
 	"""
+	index, wait, error = _blocking_params(request.query)
+	if error:
+		return error
 
-	# Get DB instance
-	db = request.app['APP_DB']
+	# Get catalog instance
+	catalog = request.app['APP_CATALOG']
 
-	response = []
+	if index is not None:
+		await catalog.wait_async(None, index, wait)
 
-	# Get all services
-	for s in db.filter(Service, {}):
-		response.append({
-			"name": s.get("name"),
-			"description": s.get("description")
-		})
+	cache = request.app['APP_CACHE']
 
-	return web.HTTPOk(body=json.dumps(response).encode(errors="ignore"), content_type="application/json")
+	headers = {
+		"X-Catalog-Index": str(catalog.index),
+		"ETag"           : cache.services_etag()
+	}
 
+	# Conditional request
+	if etag_matches(request.headers.get("If-None-Match"), headers["ETag"]):
+		return web.Response(status=304, headers=headers)
 
-@asyncio.coroutine
-def service(request):
+	services_index, body = cache.services()
+	headers["ETag"] = cache.etag(services_index)
+
+	return web.Response(body=body, content_type="application/json", headers=headers)
+
+
+async def service(request):
 	"""
 	Get service details
 	"""
@@ -152,49 +333,148 @@ def service(request):
 
 	# Check all input values are filled
 	if not service_name:
-		return web.HTTPBadRequest(body=json.dumps({'error': 'service name is required'}),
-		                          content_type="application/json")
+		return _json_response({'error': 'service_name name is required'}, status=204)
+
+	index, wait, error = _blocking_params(request.query)
+	if error:
+		return error
+
+	# Get catalog instance
+	catalog = request.app['APP_CATALOG']
+
+	if index is not None:
+		await catalog.wait_async(service_name, index, wait)
+
+	cache = request.app['APP_CACHE']
+
+	# Conditional request
+	etag = cache.service_etag(service_name)
+	if etag and etag_matches(request.headers.get("If-None-Match"), etag):
+		return web.Response(status=304, headers={
+			"X-Catalog-Index": str(catalog.service_index(service_name)),
+			"ETag"           : etag
+		})
+
+	try:
+		current_index, body = cache.service(service_name)
+
+		response = web.Response(body=body,
+		                        content_type="application/json",
+		                        headers={"ETag": cache.etag(current_index)})
+	except Service.DoesNotExist:
+		current_index = catalog.service_index(service_name)
+
+		response = _json_response({"message": "service name not found"}, status=204)
+
+	response.headers["X-Catalog-Index"] = str(current_index)
+
+	return response
 
-	# Get DB instance
-	db = request.app['APP_DB']
 
-	# Try to find in database
+async def resolve(request):
+	"""
+	Get the details of many services at once
+	"""
+	names = request.query.getall("name", [])
+
+	if not names or len(names) > MAX_RESOLVE:
+		return _json_response(dict(message="Between 1 and %s 'name' are required" % MAX_RESOLVE), status=400)
+
+	# Get catalog instance
+	catalog = request.app['APP_CATALOG']
+
+	found, missing = catalog.resolve(names)
+
+	return _json_response(dict(services=found, missing=missing), headers={"X-Catalog-Index": str(catalog.index)})
+
+
+async def changes(request):
+	"""
+	Get the catalog changes made after an index, to keep a mirror of the catalog up to date
+	"""
 	try:
-		db.get(Service, {"name": service_name})
+		since, epoch, wait = parse_changes_params(request.query)
+	except ValueError as e:
+		return _json_response(dict(message=str(e)), status=400)
+
+	# Get catalog instance
+	catalog = request.app['APP_CATALOG']
 
-		response_data = []
+	if since is not None and wait and epoch == catalog.epoch:
+		await catalog.wait_async(None, since, wait)
 
-		# Get all services
-		for s in db.filter(Service, {}):
+	data = catalog.changes(since, epoch)
 
-			# Basic info
-			info = {
-				"name": s.get("name"),
-				"description": s.get("description"),
-				"nodes": []
-			}
+	return _json_response(data, headers={"X-Catalog-Index": str(data["index"])})
 
-			# Get node info, removing private data
-			for node in s.get("nodes", []):
 
-				node_info = {}
+async def stats(request):
+	"""
+	Get the catalog size and the group commit metrics
+	"""
+	catalog = request.app['APP_CATALOG']
+	commit = request.app['APP_COMMIT']
 
-				for n_name, n_data in node.items():
-					if n_name != "node_id":
-						node_info[n_name] = n_data
+	return _json_response(dict(index=catalog.index,
+	                           services=len(catalog),
+	                           commit=None if commit is None else commit.stats()))
 
-				# Append to service nodes
-				info['nodes'].append(node_info)
 
-			# Append to response
-			response_data.append(info)
+async def stream(request):
+	"""
+	Stream the catalog change events, as Server-Sent Events. Events can be filtered by service name, with one
+	'service' query parameter for each one. A client that reconnects with the 'Last-Event-ID' header first gets the
+	events it missed, or a 'resync' event if they are not available anymore
+	"""
+	catalog = request.app['APP_CATALOG']
+	change_stream = request.app['APP_STREAM']
 
-		response = web.HTTPOk(body=json.dumps(response_data).encode(errors="ignore"),
-		                      content_type="application/json")
+	services = request.query.getall("service", []) or None
 
-	except Service.DoesNotExist:
-		response = web.HTTPNotFound(body=json.dumps({"error": "service not found"}).encode(errors="ignore"),
-		                            content_type="application/json")
+	try:
+		last_event_id = int(request.headers["Last-Event-ID"])
+	except (KeyError, ValueError):
+		last_event_id = None
+
+	# Subscribe before reading the index: the events after it are all received
+	subscription = change_stream.subscribe(services)
+
+	try:
+		index = catalog.index
+
+		missed = []
+		if last_event_id is not None and last_event_id < index:
+			data = catalog.changes(last_event_id, catalog.epoch)
+
+			if "changes" in data:
+				missed = [event for event in data["changes"]
+				          if event["index"] <= index and (services is None or event["service"] in services)]
+			else:
+				missed = [{"index": index, "type": "resync"}]
+
+		response = web.StreamResponse(headers={
+			"Content-Type"               : "text/event-stream",
+			"Cache-Control"              : "no-cache",
+			"X-Catalog-Index"            : str(index),
+			"Access-Control-Allow-Origin": "*"
+		})
+		await response.prepare(request)
+
+		for event in missed:
+			await response.write(encode_event(event))
+
+		while True:
+			event = await subscription.get(STREAM_KEEPALIVE)
+
+			if event is None:
+				await response.write(b": keep-alive\n\n")
+			elif event["index"] > index or event["type"] == "resync":
+				# Events already in the catalog index can be dispatched after the subscription
+				await response.write(encode_event(event))
+	except ConnectionResetError:
+		pass
+	finally:
+		change_stream.unsubscribe(subscription)
 
 	return response
 
@@ -203,10 +483,16 @@ def routes_catalog(app):
 	"""
 	Add catalog end-points to the app
 
-	:param app: Application instance from asyncio module
-	:type app: `asyncio.web.Application`
+	:param app: Application instance from aiohttp module
+	:type app: `aiohttp.web.Application`
 	"""
-	app.router.add_route("POST", "/v1/catalog/register", register, expect_handler=aiohttp.web.Request.json)
-	app.router.add_route("POST", "/v1/catalog/deregister", deregister, expect_handler=aiohttp.web.Request.json)
-	app.router.add_route("GET", "/v1/catalog/services", services)
-	app.router.add_route("GET", "/v1/catalog/service/{service}", service)
+	app.router.add_route("POST", "/api/v1/catalog/register", register)
+	app.router.add_route("POST", "/api/v1/catalog/deregister", deregister)
+	app.router.add_route("POST", "/api/v1/catalog/batch", batch)
+	app.router.add_route("PUT", "/api/v1/catalog/renew/{service}/{node_id}", renew)
+	app.router.add_route("GET", "/api/v1/catalog/services", services)
+	app.router.add_route("GET", "/api/v1/catalog/service/{service}", service)
+	app.router.add_route("GET", "/api/v1/catalog/resolve", resolve)
+	app.router.add_route("GET", "/api/v1/catalog/changes", changes)
+	app.router.add_route("GET", "/api/v1/catalog/stats", stats)
+	app.router.add_route("GET", "/api/v1/catalog/stream", stream)
@@ -24,6 +24,7 @@
 #
 
 import os
+import atexit
 import logging
 import argparse
 
@@ -33,9 +34,13 @@ from flasgger import Swagger
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 
-from blitzdb import FileBackend, MongoBackend
+from pyservice_registry.backends.file import FileBackend
 
 from pyservice_registry.models import Service
+from pyservice_registry.cache import ResponseCache
+from pyservice_registry.commit import GroupCommit
+from pyservice_registry.catalog import Catalog
+from pyservice_registry.snapshot import Snapshot
 from pyservice_registry.routes.catalog import routes_catalog
 
 
@@ -93,6 +98,26 @@ def start(args):
 	:type args: Namespace
 
 	"""
+	# Followers keep a replica of the leader catalog, instead of a database of their own
+	if args.FOLLOW:
+		if args.WORKERS > 1:
+			raise ValueError("A follower runs in a single process: don't use '-w' with '--follow'")
+
+		start_follower(args)
+		return
+
+	# Workers are started as new interpreters: they never inherit the catalog nor the threads of this process
+	workers = None
+
+	if args.WORKERS > 1:
+		if args.ENGINE != "aiohttp":
+			raise ValueError("Many workers are only supported by the aiohttp engine: use '-e aiohttp'")
+
+		from pyservice_registry.workers import WorkerPool
+
+		workers = WorkerPool(args.IP, args.PORT, args.WORKERS)
+		workers.start()
+
 	# --------------------------------------------------------------------------
 	# Set Database connection
 	# --------------------------------------------------------------------------
@@ -105,9 +130,23 @@ def start(args):
 
 		backend = FileBackend(_path, {'serializer_class': 'pickle'})
 		backend.create_index(Service, 'name', ephemeral=False, fields=["name"])
+	elif args.DB_TYPE == "wal":
+		from pyservice_registry.backends.wal import WALBackend
+
+		# Append-only log, with periodic snapshots
+		_path = os.path.join(args.FILE_DB_PATH or os.getcwd(), "service_wal")
+
+		backend = WALBackend(_path, args.WAL_FSYNC_INTERVAL, args.WAL_SNAPSHOT_EVERY)
+	elif args.DB_TYPE == "sqlite":
+		from pyservice_registry.backends.sqlite import SQLiteBackend
+
+		# Embedded SQL database, in a single file
+		backend = SQLiteBackend(os.path.join(args.FILE_DB_PATH or os.getcwd(), "service_db.sqlite"))
 	else:
 		import socket
-		from pymongo import MongoClient, DESCENDING
+		from pymongo import MongoClient
+
+		from pyservice_registry.backends.mongo import NativeMongoBackend
 
 		if not args.MONGODB_HOST:
 			raise ValueError("You must specify a MongoDB host")
@@ -138,17 +177,45 @@ def start(args):
 		db = c["pyregister" if not args.MONGODB_DB else args.MONGODB_DB]
 		col = db["services" if not args.MONGODB_SCHEME else args.MONGODB_SCHEME]
 
-		# Create index
-		col.create_index([("name", DESCENDING)])
-
-		# create a new BlitzDB backend using a MongoDB database
-		backend = MongoBackend(col)
+		# Nodes are written with single-round-trip updates. Catalogs stored by blitzdb are imported on first load
+		backend = NativeMongoBackend(col)
 
 	#
 	# Link backend to web-server property
 	#
 	backend.autocommit = True
 
+	# Snapshot of the last run: it answers reads at once, while the catalog is loaded from the backend
+	snapshot = None
+
+	if args.SNAPSHOT and os.path.exists(args.SNAPSHOT):
+		try:
+			snapshot = Snapshot(args.SNAPSHOT)
+		except ValueError as e:
+			log.error(e)
+
+	# Load the catalog index. From here, reads are served from memory
+	catalog = Catalog(backend, snapshot, args.CHANGES_SIZE)
+	catalog.run_expiration(args.LEASE_INTERVAL)
+
+	if args.SNAPSHOT:
+		catalog.run_snapshots(args.SNAPSHOT, args.SNAPSHOT_INTERVAL)
+		atexit.register(catalog.save_snapshot, args.SNAPSHOT)
+
+	# Encoded responses of catalog reads
+	cache = ResponseCache(catalog, args.CACHE_SIZE)
+
+	# Writes received within the window share a single backend commit
+	commit = None
+
+	if args.COMMIT_WINDOW > 0:
+		commit = GroupCommit(catalog, args.COMMIT_WINDOW, args.COMMIT_MAX_OPS)
+		commit.start()
+
+	if args.ENGINE == "aiohttp":
+		start_aiohttp(args, catalog, cache, workers, commit)
+		return
+
 	# --------------------------------------------------------------------------
 	# Routes
 	# --------------------------------------------------------------------------
@@ -156,6 +223,9 @@ def start(args):
 	routes_catalog(app)
 
 	app.config['APP_DB'] = backend
+	app.config['APP_CATALOG'] = catalog
+	app.config['APP_CACHE'] = cache
+	app.config['APP_COMMIT'] = commit
 
 	# --------------------------------------------------------------------------
 	# Enable doc?
@@ -163,8 +233,121 @@ def start(args):
 	if args.NOD_DOC is False:
 		Swagger(app)
 
+	# Requests are served by many threads: the catalog is thread safe
 	app.run(host=args.IP,
-	        port=args.PORT)
+	        port=args.PORT,
+	        threaded=True)
+
+
+def build_aiohttp_app(catalog, cache, storage_workers=4, stream_buffer=1000, commit=None):
+	"""
+	Build the asyncio application, with the same catalog end-points than the Flask one.
+
+	Calls that write to the storage backend run in a bounded thread pool, so they never stall the event loop. Reads
+	and blocking queries are served from the catalog index, in the event loop.
+
+	:param catalog: catalog index
+	:type catalog: Catalog
+
+	:param cache: encoded responses of catalog reads
+	:type cache: ResponseCache
+
+	:param storage_workers: max threads writing to the storage backend
+	:type storage_workers: int
+
+	:param stream_buffer: max buffered change events of each change stream client
+	:type stream_buffer: int
+
+	:param commit: group commit pipeline of the writes. None to commit each write on its own
+	:type commit: `pyservice_registry.commit.GroupCommit`
+
+	:return: the application
+	:rtype: `aiohttp.web.Application`
+	"""
+	import asyncio
+
+	from aiohttp import web
+	from concurrent.futures import ThreadPoolExecutor
+
+	from pyservice_registry.stream import ChangeStream
+	from pyservice_registry.middleware import middleware_crossdomain
+	from pyservice_registry.routes.catalog_aiohttp import routes_catalog as routes_catalog_aiohttp
+
+	aio_app = web.Application(middlewares=[middleware_crossdomain])
+
+	aio_app['APP_CATALOG'] = catalog
+	aio_app['APP_CACHE'] = cache
+	aio_app['APP_EXECUTOR'] = ThreadPoolExecutor(max_workers=storage_workers)
+	aio_app['APP_STREAM'] = ChangeStream(catalog, stream_buffer)
+	aio_app['APP_COMMIT'] = commit
+
+	async def _start_stream(app):
+		app['APP_STREAM'].start(asyncio.get_event_loop())
+
+	async def _stop_stream(app):
+		app['APP_STREAM'].stop()
+
+	aio_app.on_startup.append(_start_stream)
+	aio_app.on_cleanup.append(_stop_stream)
+
+	routes_catalog_aiohttp(aio_app)
+
+	return aio_app
+
+
+def start_aiohttp(args, catalog, cache, workers=None, commit=None):
+	"""
+	Start the asyncio server
+
+	:param args: input parameters
+	:type args: Namespace
+
+	:param catalog: catalog index
+	:type catalog: Catalog
+
+	:param cache: encoded responses of catalog reads
+	:type cache: ResponseCache
+
+	:param workers: worker processes serving the clients. This process is their writer. None to serve them here
+	:type workers: `pyservice_registry.workers.WorkerPool`
+
+	:param commit: group commit pipeline of the writes. None to commit each write on its own
+	:type commit: `pyservice_registry.commit.GroupCommit`
+	"""
+	from aiohttp import web
+
+	aio_app = build_aiohttp_app(catalog, cache, args.STORAGE_WORKERS, args.STREAM_BUFFER, commit)
+
+	if workers is not None:
+		workers.serve(aio_app, catalog)
+	else:
+		web.run_app(aio_app, host=args.IP, port=args.PORT, print=None)
+
+
+def start_follower(args):
+	"""
+	Start a follower of a leader server. It replicates the catalog changes of the leader, in the order they were made,
+	and answers the lookups from its replica. Writes are forwarded to the leader, and they are answered once the
+	replica has them. The replication state, with the lag, is in the stats end-point.
+
+	:param args: input parameters
+	:type args: Namespace
+	"""
+	import asyncio
+
+	from pyservice_registry.agent import Agent, serve
+	from pyservice_registry.client_aiohttp import AsyncRegisterClient
+
+	host, _, port = args.FOLLOW.rpartition(":")
+
+	follower = Agent(AsyncRegisterClient(host, int(port), args.FOLLOW_HTTPS, agent=False),
+	                 flush_interval=0,
+	                 sync_wait=args.FOLLOW_SYNC_WAIT)
+
+	try:
+		asyncio.run(serve(follower, None, args.IP, args.PORT))
+	except KeyboardInterrupt:
+		pass
 
 
 # --------------------------------------------------------------------------
@@ -178,6 +361,18 @@ Examples:
 	Increase verbosity:
 	%(name)s -vvv
 
+	Run the asyncio server, for many concurrent connections:
+	%(name)s -e aiohttp
+
+	Run 8 worker processes, to serve lookups with many cores:
+	%(name)s -e aiohttp -w 8
+
+	Store the catalog in an append-only log:
+	%(name)s -t wal --path /var/lib/pyregistry
+
+	Run a follower of the server in registry.example.com, to serve lookups with many hosts:
+	%(name)s -p 8010 --follow registry.example.com:8000
+
 	""" % dict(name="pyservice-register")
 
 	parser = argparse.ArgumentParser(description='Register Service Server',
@@ -189,8 +384,48 @@ Examples:
 	parser.add_argument("-v", "--verbosity", dest="VERBOSE", action="count", help="verbosity level: -v, -vv, -vvv.",
 	                    default=3)
 	parser.add_argument('-t', '--db-type', dest="DB_TYPE", help="database type. Default: file", default="file",
-	                    choices=["file", "mongodb"])
+	                    choices=["file", "wal", "sqlite", "mongodb"])
 	parser.add_argument('-d', '--debug', dest="DEBUG", action="store_true", help="enable debug mode", default=False)
+	parser.add_argument('-e', '--engine', dest="ENGINE", help="web server engine. Default: flask", default="flask",
+	                    choices=["flask", "aiohttp"])
+	parser.add_argument('-w', '--workers', dest="WORKERS", type=int,
+	                    help="aiohttp engine: worker processes. Lookups are answered by the workers and writes by a "
+	                         "single writer process. Default: 1", default=1)
+	parser.add_argument('--cache-size', dest="CACHE_SIZE", type=int,
+	                    help="max number of cached service responses. Default: 1024", default=1024)
+	parser.add_argument('--storage-workers', dest="STORAGE_WORKERS", type=int,
+	                    help="aiohttp engine: max threads writing to the database. Default: 4", default=4)
+	parser.add_argument('--stream-buffer', dest="STREAM_BUFFER", type=int,
+	                    help="aiohttp engine: max buffered change events of each change stream client. Slower clients "
+	                         "are asked to resync. Default: 1000", default=1000)
+	parser.add_argument('--changes-size', dest="CHANGES_SIZE", type=int,
+	                    help="max catalog changes kept for mirrors. Older mirrors get a full copy. Default: 10000",
+	                    default=10000)
+	parser.add_argument('--commit-window', dest="COMMIT_WINDOW", type=float,
+	                    help="max seconds a write waits for others, to commit all of them at once. Each write is "
+	                         "answered once its group is committed. Ex: 0.005. Default: 0, each write commits on its own",
+	                    default=0.0)
+	parser.add_argument('--commit-max-ops', dest="COMMIT_MAX_OPS", type=int,
+	                    help="writes that close a group commit before its window ends. Default: 500", default=500)
+	parser.add_argument('--lease-interval', dest="LEASE_INTERVAL", type=float,
+	                    help="seconds between checks for expired node leases. Default: 1", default=1.0)
+	parser.add_argument('--snapshot', dest="SNAPSHOT",
+	                    help="binary catalog snapshot file. If it exists at start, reads are served from it while the "
+	                         "database is loaded", default=None)
+	parser.add_argument('--snapshot-interval', dest="SNAPSHOT_INTERVAL", type=float,
+	                    help="seconds between catalog snapshots. Default: 60", default=60.0)
+
+	# Replication options
+	gr_follow = parser.add_argument_group("Replication options")
+	gr_follow.add_argument("--follow", dest="FOLLOW",
+	                       help="run as a follower of the leader server in this address, as host:port. Lookups are "
+	                            "answered from a replica of its catalog, and writes are forwarded to it. No database "
+	                            "is used", default=None)
+	gr_follow.add_argument("--follow-https", dest="FOLLOW_HTTPS", action="store_true",
+	                       help="use HTTPS with the leader", default=False)
+	gr_follow.add_argument("--follow-sync-wait", dest="FOLLOW_SYNC_WAIT", type=float,
+	                       help="seconds each replication call waits for changes in the leader. Default: 30",
+	                       default=30.0)
 
 	# Security options
 	gr_security = parser.add_argument_group("Security options")
@@ -200,7 +435,14 @@ Examples:
 
 	# Scanner options
 	gr_file_db = parser.add_argument_group("File database options")
-	gr_file_db.add_argument("--path", dest="FILE_DB_PATH", type=bool, help="path to file database", default=False)
+	gr_file_db.add_argument("--path", dest="FILE_DB_PATH", help="path to file database", default=None)
+
+	gr_wal_db = parser.add_argument_group("Write-ahead log database options")
+	gr_wal_db.add_argument("--wal-fsync-interval", dest="WAL_FSYNC_INTERVAL", type=float,
+	                       help="max seconds between log fsyncs, shared by all the writes done meanwhile. Writes "
+	                            "are answered after their fsync. 0 to fsync each write. Default: 0.01", default=0.01)
+	gr_wal_db.add_argument("--wal-snapshot-every", dest="WAL_SNAPSHOT_EVERY", type=int,
+	                       help="log records written between snapshots. Default: 10000", default=10000)
 
 	gr_mongo_db = parser.add_argument_group("MongoDB database options")
 	gr_mongo_db.add_argument("-H", "--mongo-host", dest="MONGODB_HOST", help="mongoDB host", default=None)
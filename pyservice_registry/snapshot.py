@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+#
+# PyService-Registry - https://github.com/cr0hn/pyservice-registry
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+# following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the
+# following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the
+# following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote
+# products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Compact binary snapshot of the catalog, that can be served directly from a memory map.
+
+Layout, little endian:
+
+	header        magic, format version, catalog version, indexes, epoch and section offsets
+	strings       one (offset, length) entry per interned string
+	services      fixed-width records, sorted by name: (name, description, first node, node count)
+	nodes         fixed-width records: (node_id, address, port, extra)
+	indexes       fixed-width records, sorted by name: (name, index of its last change)
+	blob          UTF-8 text of the strings
+
+Each distinct string (names, addresses, node IDs...) is stored once and referenced by its position in the string
+table. The port is stored as a number. Any other node field (TTL, weight, non numeric ports...) goes, as JSON, to the
+'extra' string.
+"""
+
+import os
+import json
+import mmap
+import struct
+
+from pyservice_registry.models import Service
+
+MAGIC = b"PSRC"
+FORMAT_VERSION = 2
+
+# magic, format version, catalog version, services list index, load index, epoch, string count, service count,
+# node count, index count, section offsets
+_HEADER = struct.Struct("<4sHxxQQQIIIIIIIIII")
+_STRING = struct.Struct("<II")
+_SERVICE = struct.Struct("<IIII")
+_NODE = struct.Struct("<IIiI")
+_INDEX = struct.Struct("<IQ")
+
+# Null string reference
+_NONE = 0xFFFFFFFF
+
+_PORT_FIELDS = ("node_id", "address", "service_port")
+
+
+def _port(value):
+	"""
+	:return: port as a number, or -1 if it can't be stored as one
+	:rtype: int
+	"""
+	if isinstance(value, bool):
+		return -1
+
+	if isinstance(value, int) and 0 <= value < 2 ** 31:
+		return value
+
+	return -1
+
+
+def dump(services, path, version=0, sync=True, indexes=None, services_index=0, base_index=0, epoch=None):
+	"""
+	Write a snapshot. The file is replaced atomically: readers that already mapped the old one keep using it.
+
+	:param services: services to store, as name -> (description, {node_id: node})
+	:type services: dict
+
+	:param path: snapshot file path
+	:type path: str
+
+	:param version: catalog version stored in the header. Ex: the catalog index
+	:type version: int
+
+	:param indexes: index of the last change of each service, removed ones included, as name -> index
+	:type indexes: dict
+
+	:param services_index: index of the last change of the services list
+	:type services_index: int
+
+	:param base_index: index of the services that are not in `indexes`. Ex: the catalog index when it was loaded
+	:type base_index: int
+
+	:param epoch: catalog epoch, to build the same entity tags than the catalog
+	:type epoch: str
+
+	:param sync: flush the file to disk. Not needed for snapshots that don't outlive the server
+	:type sync: bool
+	"""
+	strings = {}
+
+	def intern(value):
+		if value is None:
+			return _NONE
+
+		try:
+			return strings[value]
+		except KeyError:
+			sid = strings[value] = len(strings)
+			return sid
+
+	service_records = []
+	node_records = []
+
+	for name in sorted(services):
+		description, nodes = services[name]
+
+		service_records.append(_SERVICE.pack(intern(name), intern(description), len(node_records), len(nodes)))
+
+		for node in nodes.values():
+			port = _port(node.get("service_port"))
+
+			extra = {k: v for k, v in node.items() if k not in _PORT_FIELDS}
+			if port < 0 and node.get("service_port") is not None:
+				extra["service_port"] = node.get("service_port")
+
+			node_records.append(_NODE.pack(intern(node.get("node_id")),
+			                               intern(node.get("address")),
+			                               port,
+			                               intern(json.dumps(extra, sort_keys=True)) if extra else _NONE))
+
+	index_records = [_INDEX.pack(intern(name), index) for name, index in sorted((indexes or {}).items())]
+
+	epoch_sid = intern(epoch)
+
+	blob = []
+	string_records = []
+	offset = 0
+
+	for value in strings:
+		encoded = value.encode("utf-8")
+
+		string_records.append(_STRING.pack(offset, len(encoded)))
+		blob.append(encoded)
+
+		offset += len(encoded)
+
+	strings_offset = _HEADER.size
+	services_offset = strings_offset + _STRING.size * len(string_records)
+	nodes_offset = services_offset + _SERVICE.size * len(service_records)
+	indexes_offset = nodes_offset + _NODE.size * len(node_records)
+	blob_offset = indexes_offset + _INDEX.size * len(index_records)
+
+	header = _HEADER.pack(MAGIC, FORMAT_VERSION, version, services_index, base_index, epoch_sid,
+	                      len(string_records), len(service_records), len(node_records), len(index_records),
+	                      strings_offset, services_offset, nodes_offset, indexes_offset, blob_offset)
+
+	tmp_path = "%s.tmp" % path
+
+	with open(tmp_path, "wb") as f:
+		f.write(header)
+		f.write(b"".join(string_records))
+		f.write(b"".join(service_records))
+		f.write(b"".join(node_records))
+		f.write(b"".join(index_records))
+		f.write(b"".join(blob))
+
+		if sync:
+			f.flush()
+			os.fsync(f.fileno())
+
+	os.replace(tmp_path, path)
+
+
+class Snapshot(object):
+	"""
+	Read-only catalog, served from a memory mapped snapshot. Opening it doesn't read nor decode the file: pages are
+	loaded by the OS when a lookup touches them, so it's ready to answer at once, whatever the catalog size.
+
+	Services are found by binary search over their sorted records. It has the same read methods than the catalog.
+	"""
+
+	def __init__(self, path):
+		"""
+		:param path: snapshot file path
+		:type path: str
+
+		:raise ValueError: if file is not a valid snapshot
+		"""
+		self.path = path
+
+		with open(path, "rb") as f:
+			self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+		if len(self._map) < _HEADER.size:
+			self._map.close()
+			raise ValueError("'%s' is not a catalog snapshot" % path)
+
+		(magic, format_version, self.version, self.services_index, self._base_index, epoch_sid,
+		 self._string_count, self._service_count, self._node_count, self._index_count,
+		 self._strings_offset, self._services_offset, self._nodes_offset, self._indexes_offset,
+		 self._blob_offset) = _HEADER.unpack_from(self._map, 0)
+
+		if magic != MAGIC or format_version != FORMAT_VERSION:
+			self._map.close()
+			raise ValueError("'%s' is not a catalog snapshot, or its format is not supported" % path)
+
+		self.epoch = self._string(epoch_sid)
+
+	def close(self):
+		self._map.close()
+
+	# --------------------------------------------------------------------------
+	# Records
+	# --------------------------------------------------------------------------
+	def _string(self, sid):
+		if sid == _NONE:
+			return None
+
+		offset, length = _STRING.unpack_from(self._map, self._strings_offset + sid * _STRING.size)
+		start = self._blob_offset + offset
+
+		return self._map[start:start + length].decode("utf-8")
+
+	def _service_record(self, i):
+		return _SERVICE.unpack_from(self._map, self._services_offset + i * _SERVICE.size)
+
+	def _find(self, name):
+		"""
+		:return: service record, as (name, description, first node, node count) string IDs. None if not found
+		:rtype: tuple|None
+		"""
+		lo, hi = 0, self._service_count
+
+		while lo < hi:
+			mid = (lo + hi) // 2
+			record = self._service_record(mid)
+			current = self._string(record[0])
+
+			if current == name:
+				return record
+			elif current < name:
+				lo = mid + 1
+			else:
+				hi = mid
+
+		return None
+
+	def _index_record(self, i):
+		return _INDEX.unpack_from(self._map, self._indexes_offset + i * _INDEX.size)
+
+	def _nodes(self, first, count):
+		"""
+		:return: nodes of a service, with all their fields
+		:rtype: generator(dict)
+		"""
+		for i in range(first, first + count):
+			node_sid, address_sid, port, extra_sid = _NODE.unpack_from(self._map, self._nodes_offset + i * _NODE.size)
+
+			node = {
+				"address"     : self._string(address_sid),
+				"service_port": port if port >= 0 else None,
+				"node_id"     : self._string(node_sid)
+			}
+
+			if extra_sid != _NONE:
+				node.update(json.loads(self._string(extra_sid)))
+
+			yield node
+
+	# --------------------------------------------------------------------------
+	# Reads
+	# --------------------------------------------------------------------------
+	def services(self):
+		"""
+		:return: list of services, by their name and description
+		:rtype: list(dict)
+		"""
+		ret = []
+
+		for i in range(self._service_count):
+			name_sid, description_sid, _, _ = self._service_record(i)
+
+			ret.append({
+				"name"       : self._string(name_sid),
+				"description": self._string(description_sid)
+			})
+
+		return ret
+
+	def service(self, name):
+		"""
+		Same as `pyservice_registry.catalog.Catalog.service()`
+
+		:raise Service.DoesNotExist: if service is not in the snapshot
+		"""
+		record = self._find(name)
+
+		if record is None:
+			raise Service.DoesNotExist()
+
+		return {
+			"name"       : name,
+			"description": self._string(record[1]),
+			"nodes"      : [
+				{n_name: n_data for n_name, n_data in node.items() if n_name != "node_id"}
+				for node in self._nodes(record[2], record[3])
+			]
+		}
+
+	def service_index(self, name):
+		"""
+		Same as `pyservice_registry.catalog.Catalog.service_index()`
+
+		:rtype: int
+		"""
+		lo, hi = 0, self._index_count
+
+		while lo < hi:
+			mid = (lo + hi) // 2
+			name_sid, index = self._index_record(mid)
+			current = self._string(name_sid)
+
+			if current == name:
+				return index
+			elif current < name:
+				lo = mid + 1
+			else:
+				hi = mid
+
+		return self._base_index
+
+	def node(self, name, node_id):
+		"""
+		:return: node info or None if node is not in the snapshot
+		:rtype: dict|None
+		"""
+		record = self._find(name)
+
+		if record is not None:
+			for node in self._nodes(record[2], record[3]):
+				if node["node_id"] == node_id:
+					return node
+
+		return None
+
+	def items(self):
+		"""
+		:return: all the services, as (name, description, {node_id: node}) tuples
+		:rtype: generator(tuple)
+		"""
+		for i in range(self._service_count):
+			name_sid, description_sid, first, count = self._service_record(i)
+
+			yield (self._string(name_sid),
+			       self._string(description_sid),
+			       {node["node_id"]: node for node in self._nodes(first, count)})
+
+	def __contains__(self, name):
+		return self._find(name) is not None
+
+	def __len__(self):
+		return self._service_count
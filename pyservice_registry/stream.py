@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+#
+# PyService-Registry - https://github.com/cr0hn/pyservice-registry
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+# following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the
+# following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the
+# following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote
+# products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Fan-out of the catalog change events to asyncio subscribers, like the clients of the change stream end-point.
+"""
+
+import json
+import asyncio
+import collections
+
+
+class Subscription(object):
+	"""
+	Events of a subscriber, optionally filtered by service name, in a bounded buffer.
+
+	When a slow subscriber fills its buffer, the buffered events are dropped and replaced by a single 'resync'
+	event: the subscriber must read the catalog again, and skip the next events with an index it has already seen.
+	So a slow subscriber never makes the server memory grow.
+	"""
+
+	def __init__(self, services=None, buffer_size=1000):
+		"""
+		:param services: service names to receive events of. None for all of them
+		:type services: list(str)
+
+		:param buffer_size: max buffered events
+		:type buffer_size: int
+		"""
+		self.services = set(services) if services else None
+		self.buffer_size = buffer_size
+
+		# Times the buffer was full
+		self.resyncs = 0
+
+		self._events = collections.deque()
+		self._waiter = None
+
+	def put(self, event):
+		"""
+		Buffer an event. Must be called from the event loop thread.
+		"""
+		if event["type"] != "resync" and self.services is not None and event["service"] not in self.services:
+			return
+
+		if len(self._events) >= self.buffer_size:
+			self._events.clear()
+			self.resyncs += 1
+
+			event = {"index": event["index"], "type": "resync"}
+
+		self._events.append(event)
+
+		if self._waiter is not None and not self._waiter.done():
+			self._waiter.set_result(None)
+
+	async def get(self, timeout=None):
+		"""
+		:return: next event. None if there's no event before the timeout
+		:rtype: dict|None
+		"""
+		if not self._events:
+			self._waiter = asyncio.get_event_loop().create_future()
+
+			try:
+				await asyncio.wait_for(self._waiter, timeout)
+			except asyncio.TimeoutError:
+				return None
+			finally:
+				self._waiter = None
+
+		return self._events.popleft()
+
+
+class ChangeStream(object):
+	"""
+	Receive the change events of the catalog, from the threads that change it, and dispatch them to the subscribers
+	in the event loop.
+	"""
+
+	def __init__(self, catalog, buffer_size=1000):
+		"""
+		:param catalog: catalog index
+		:type catalog: `pyservice_registry.catalog.Catalog`
+
+		:param buffer_size: max buffered events of each subscriber
+		:type buffer_size: int
+		"""
+		self.catalog = catalog
+		self.buffer_size = buffer_size
+
+		self._subscriptions = set()
+		self._loop = None
+
+	def start(self, loop=None):
+		self._loop = loop or asyncio.get_event_loop()
+		self.catalog.listen(self._on_event)
+
+	def stop(self):
+		self.catalog.unlisten(self._on_event)
+
+	def _on_event(self, event):
+		# Called by the thread that changed the catalog
+		self._loop.call_soon_threadsafe(self._dispatch, event)
+
+	def _dispatch(self, event):
+		for subscription in self._subscriptions:
+			subscription.put(event)
+
+	def subscribe(self, services=None):
+		"""
+		:param services: service names to receive events of. None for all of them
+		:type services: list(str)
+
+		:rtype: Subscription
+		"""
+		subscription = Subscription(services, self.buffer_size)
+
+		self._subscriptions.add(subscription)
+
+		return subscription
+
+	def unsubscribe(self, subscription):
+		self._subscriptions.discard(subscription)
+
+	def __len__(self):
+		return len(self._subscriptions)
+
+
+def encode_event(event):
+	"""
+	Encode an event in Server-Sent Events format. The event ID is the catalog index.
+
+	:rtype: bytes
+	"""
+	return ("id: %s\nevent: %s\ndata: %s\n\n" % (event["index"],
+	                                             event["type"],
+	                                             json.dumps(event, separators=(",", ":")))).encode(errors="ignore")
@@ -0,0 +1,485 @@
+# -*- coding: utf-8 -*-
+#
+# PyService-Registry - https://github.com/cr0hn/pyservice-registry
+#
+# Redistribution and use in source and binary forms, with or without modification, are permitted provided that the
+# following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this list of conditions and the
+# following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice, this list of conditions and the
+# following disclaimer in the documentation and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its contributors may be used to endorse or promote
+# products derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Multi-process server. A single writer process owns the catalog, and worker processes share the listening socket:
+
+- The writer applies all the writes, so they are linearizable, and publishes a versioned snapshot of the catalog
+  (see `pyservice_registry.snapshot`) each time it changes, in shared memory when it's available.
+- Workers answer the lookups from the last published snapshot, memory mapped, so they scale with the cores. Writes,
+  blocking queries and change streams are forwarded to the writer. A write is answered once the snapshot has it, so
+  any lookup made after it, in any worker, sees it. If the snapshot doesn't get it in WRITE_VISIBILITY_TIMEOUT
+  seconds, the write is answered with the 'X-Catalog-Visible: false' header.
+- Workers are started as new interpreters, that get the listening socket, so they never inherit the catalog, the
+  threads nor the locks of the writer.
+"""
+
+import os
+import sys
+import time
+import shutil
+import signal
+import socket
+import atexit
+import asyncio
+import logging
+import tempfile
+import threading
+import subprocess
+
+try:
+	import ujson as json
+except ImportError:
+	import json
+
+import aiohttp
+
+from aiohttp import web
+
+from pyservice_registry.cache import etag_matches
+from pyservice_registry.models import Service
+from pyservice_registry.snapshot import Snapshot
+from pyservice_registry.middleware import middleware_crossdomain
+from pyservice_registry.routes.catalog import MAX_RESOLVE
+from pyservice_registry.routes.catalog_aiohttp import forward, _json_response
+
+
+log = logging.getLogger(__name__)
+
+# Host name of the URLs of requests sent to the writer
+WRITER_HOST = "pyregistry-writer"
+
+# Max seconds a write waits for the snapshot to have it
+WRITE_VISIBILITY_TIMEOUT = 1
+
+# Seconds between checks of the snapshot version, while a write waits for it
+WRITE_VISIBILITY_POLL = 0.001
+
+
+class SnapshotPublisher(object):
+	"""
+	Writes a snapshot of the catalog each time it changes. Changes made while a snapshot is written are published
+	together, in the next one.
+	"""
+
+	def __init__(self, catalog, path):
+		"""
+		:param catalog: catalog index
+		:type catalog: `pyservice_registry.catalog.Catalog`
+
+		:param path: snapshot file path
+		:type path: str
+		"""
+		self.catalog = catalog
+		self.path = path
+
+		self._changed = threading.Event()
+
+	def start(self):
+		"""
+		:return: the running thread
+		:rtype: threading.Thread
+		"""
+		self.catalog.listen(self._on_event)
+
+		t = threading.Thread(target=self._loop, name="catalog-publisher", daemon=True)
+		t.start()
+
+		return t
+
+	def _on_event(self, event):
+		self._changed.set()
+
+	def _loop(self):
+		self.catalog.wait_ready()
+
+		last_index = None
+
+		while True:
+			try:
+				index = self.catalog.index
+
+				if index != last_index:
+					self.catalog.save_snapshot(self.path, sync=False)
+					last_index = index
+			except Exception as e:
+				log.error("Error publishing catalog snapshot: %s" % e)
+
+			self._changed.wait()
+			self._changed.clear()
+
+
+class SnapshotView(object):
+	"""
+	Last published snapshot of the catalog. It's opened again when a new one is published.
+	"""
+
+	def __init__(self, path):
+		self.path = path
+
+		self._snapshot = None
+		self._stat = None
+
+		# Encoded services list of the current snapshot
+		self._services_body = None
+
+	def current(self):
+		"""
+		:return: last published snapshot. None if there's none yet
+		:rtype: `pyservice_registry.snapshot.Snapshot`|None
+		"""
+		try:
+			st = os.stat(self.path)
+		except FileNotFoundError:
+			return None
+
+		key = (st.st_ino, st.st_mtime_ns, st.st_size)
+
+		if key != self._stat:
+			try:
+				snapshot = Snapshot(self.path)
+			except (IOError, OSError, ValueError):
+				# Replaced while it was opened: next call gets the new one
+				return self._snapshot
+
+			if self._snapshot is not None:
+				self._snapshot.close()
+
+			self._snapshot = snapshot
+			self._stat = key
+			self._services_body = None
+
+		return self._snapshot
+
+	@property
+	def version(self):
+		snapshot = self.current()
+
+		return -1 if snapshot is None else snapshot.version
+
+	def services_body(self):
+		"""
+		:return: encoded services list of the current snapshot
+		:rtype: bytes
+		"""
+		snapshot = self.current()
+
+		if self._services_body is None:
+			self._services_body = json.dumps(snapshot.services()).encode(errors="ignore")
+
+		return self._services_body
+
+
+# --------------------------------------------------------------------------
+# Worker end-points
+# --------------------------------------------------------------------------
+async def _to_writer(request, stream=True):
+	return await forward(request,
+	                     request.app['APP_WRITER'],
+	                     "http://%s%s" % (WRITER_HOST, request.rel_url.path_qs),
+	                     stream)
+
+
+async def write(request):
+	"""
+	Forward a write to the writer, and answer it once the snapshot has it. If the snapshot doesn't get it in time, the
+	'X-Catalog-Visible: false' header says lookups may not see it yet
+	"""
+	response = await _to_writer(request, stream=False)
+
+	index = response.headers.get("X-Catalog-Index")
+
+	if index is not None:
+		view = request.app['APP_VIEW']
+		deadline = time.monotonic() + WRITE_VISIBILITY_TIMEOUT
+
+		while view.version < int(index) and time.monotonic() < deadline:
+			await asyncio.sleep(WRITE_VISIBILITY_POLL)
+
+		if view.version < int(index):
+			log.warning("Snapshot doesn't have the write of index %s yet" % index)
+
+			response.headers["X-Catalog-Visible"] = "false"
+
+	return response
+
+
+async def read(request):
+	"""
+	Forward a read to the writer: blocking queries, changes and the change stream
+	"""
+	return await _to_writer(request)
+
+
+def _etag(snapshot, index):
+	"""
+	:return: entity tag of a response built from the given index. The same than the writer builds
+	:rtype: str
+	"""
+	return '"%s-%d"' % (snapshot.epoch, index)
+
+
+async def services(request):
+	"""
+	List available services by their name and description
+	"""
+	view = request.app['APP_VIEW']
+	snapshot = view.current()
+
+	if snapshot is None or "index" in request.query:
+		return await read(request)
+
+	headers = {
+		"X-Catalog-Index": str(snapshot.version),
+		"ETag"           : _etag(snapshot, snapshot.services_index)
+	}
+
+	# Conditional request
+	if etag_matches(request.headers.get("If-None-Match"), headers["ETag"]):
+		return web.Response(status=304, headers=headers)
+
+	return web.Response(body=view.services_body(), content_type="application/json", headers=headers)
+
+
+async def service(request):
+	"""
+	Get service details
+	"""
+	snapshot = request.app['APP_VIEW'].current()
+
+	if snapshot is None or "index" in request.query:
+		return await read(request)
+
+	service_name = request.match_info['service']
+	index = snapshot.service_index(service_name)
+
+	headers = {"X-Catalog-Index": str(index)}
+
+	try:
+		details = snapshot.service(service_name)
+	except Service.DoesNotExist:
+		return _json_response({"message": "service name not found"}, status=204, headers=headers)
+
+	headers["ETag"] = _etag(snapshot, index)
+
+	# Conditional request
+	if etag_matches(request.headers.get("If-None-Match"), headers["ETag"]):
+		return web.Response(status=304, headers=headers)
+
+	return _json_response([details], headers=headers)
+
+
+async def resolve(request):
+	"""
+	Get the details of many services at once
+	"""
+	snapshot = request.app['APP_VIEW'].current()
+
+	if snapshot is None:
+		return await read(request)
+
+	names = request.query.getall("name", [])
+
+	if not names or len(names) > MAX_RESOLVE:
+		return _json_response(dict(message="Between 1 and %s 'name' are required" % MAX_RESOLVE), status=400)
+
+	found = []
+	missing = []
+
+	for name in names:
+		try:
+			found.append(snapshot.service(name))
+		except Service.DoesNotExist:
+			missing.append(name)
+
+	return _json_response(dict(services=found, missing=missing), headers={"X-Catalog-Index": str(snapshot.version)})
+
+
+def build_worker_app(writer_socket, snapshot_path):
+	"""
+	Build the application of a worker, with the same catalog end-points than the server.
+
+	:param writer_socket: Unix socket of the writer
+	:type writer_socket: str
+
+	:param snapshot_path: snapshot published by the writer
+	:type snapshot_path: str
+
+	:rtype: `aiohttp.web.Application`
+	"""
+	app = web.Application(middlewares=[middleware_crossdomain])
+
+	app['APP_VIEW'] = SnapshotView(snapshot_path)
+
+	async def _connect(app):
+		app['APP_WRITER'] = aiohttp.ClientSession(connector=aiohttp.UnixConnector(writer_socket))
+
+	async def _disconnect(app):
+		await app['APP_WRITER'].close()
+
+	app.on_startup.append(_connect)
+	app.on_cleanup.append(_disconnect)
+
+	app.router.add_route("POST", "/api/v1/catalog/register", write)
+	app.router.add_route("POST", "/api/v1/catalog/deregister", write)
+	app.router.add_route("POST", "/api/v1/catalog/batch", write)
+	app.router.add_route("PUT", "/api/v1/catalog/renew/{service}/{node_id}", write)
+	app.router.add_route("GET", "/api/v1/catalog/services", services)
+	app.router.add_route("GET", "/api/v1/catalog/service/{service}", service)
+	app.router.add_route("GET", "/api/v1/catalog/resolve", resolve)
+	app.router.add_route("GET", "/api/v1/catalog/changes", read)
+	app.router.add_route("GET", "/api/v1/catalog/stats", read)
+	app.router.add_route("GET", "/api/v1/catalog/stream", read)
+
+	return app
+
+
+# --------------------------------------------------------------------------
+# Processes
+# --------------------------------------------------------------------------
+class WorkerPool(object):
+	"""
+	Worker processes, sharing a listening socket. Workers that die are started again.
+
+	Workers are not forked from the writer, but started as new interpreters (see run_worker()): they don't inherit its
+	catalog, its threads nor their locks, whenever they are started.
+	"""
+
+	def __init__(self, ip, port, count):
+		"""
+		:param ip: listen IP
+		:type ip: str
+
+		:param port: listen port
+		:type port: int
+
+		:param count: number of workers
+		:type count: int
+		"""
+		self.ip = ip
+		self.port = port
+		self.count = count
+
+		# Writer socket and snapshot, in shared memory when it's available
+		self.run_dir = tempfile.mkdtemp(prefix="pyregistry-", dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+
+		self.writer_socket = os.path.join(self.run_dir, "writer.sock")
+		self.snapshot_path = os.path.join(self.run_dir, "catalog.snapshot")
+
+		self.pids = set()
+
+		# pid -> subprocess.Popen
+		self._processes = {}
+
+		self._socket = None
+		self._stopping = False
+
+	def start(self):
+		self._socket = socket.create_server((self.ip, self.port), backlog=1024)
+
+		for _ in range(self.count):
+			self._spawn()
+
+		atexit.register(self.stop)
+
+		threading.Thread(target=self._monitor, name="worker-monitor", daemon=True).start()
+
+	def _spawn(self):
+		fd = self._socket.fileno()
+
+		process = subprocess.Popen([sys.executable, "-m", "pyservice_registry.workers",
+		                            str(fd), self.writer_socket, self.snapshot_path],
+		                           pass_fds=(fd,))
+
+		self._processes[process.pid] = process
+		self.pids.add(process.pid)
+
+	def _monitor(self):
+		while True:
+			try:
+				pid, status = os.wait()
+			except ChildProcessError:
+				return
+
+			# Reaped here: the process object must not wait for it
+			process = self._processes.pop(pid, None)
+			if process is not None:
+				process.returncode = status
+
+			if pid not in self.pids or self._stopping:
+				continue
+
+			self.pids.discard(pid)
+
+			log.error("Worker %s exited with status %s: starting a new one" % (pid, status))
+
+			self._spawn()
+
+	def serve(self, app, catalog):
+		"""
+		Run the writer, until it's stopped.
+
+		:param app: application of the writer, with all the catalog end-points
+		:type app: `aiohttp.web.Application`
+
+		:param catalog: catalog index
+		:type catalog: `pyservice_registry.catalog.Catalog`
+		"""
+		SnapshotPublisher(catalog, self.snapshot_path).start()
+
+		web.run_app(app, path=self.writer_socket, print=None)
+
+	def stop(self):
+		self._stopping = True
+
+		for pid in list(self.pids):
+			try:
+				os.kill(pid, signal.SIGTERM)
+			except ProcessLookupError:
+				pass
+
+		shutil.rmtree(self.run_dir, ignore_errors=True)
+
+
+def run_worker(fd, writer_socket, snapshot_path):
+	"""
+	Run a worker, until it's stopped.
+
+	:param fd: file descriptor of the listening socket, inherited from the writer
+	:type fd: int
+
+	:param writer_socket: Unix socket of the writer
+	:type writer_socket: str
+
+	:param snapshot_path: snapshot published by the writer
+	:type snapshot_path: str
+	"""
+	sock = socket.socket(fileno=fd)
+
+	web.run_app(build_worker_app(writer_socket, snapshot_path), sock=sock, print=None)
+
+
+if __name__ == "__main__":
+	run_worker(int(sys.argv[1]), sys.argv[2], sys.argv[3])
@@ -42,7 +42,9 @@ setup(
     include_package_data=True,
     entry_points={'console_scripts': [
             'pyregistry-server = pyservice_registry.server:main',
-            'pyregistry-client = pyservice_registry.client:main'
+            'pyregistry-client = pyservice_registry.client:main',
+            'pyregistry-agent = pyservice_registry.agent:main',
+            'pyservice-agent = pyservice_registry.agent:main'
     ]},
     description='PyService-Registry: Simple, Fast and Lightweight Service Registry in pure Python',
     long_description=open('README.rst', "r").read(),